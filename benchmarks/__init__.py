@@ -0,0 +1,9 @@
+"""
+Benchmarks for Drafter, kept out of the installed package.
+
+``benchmarks.load_test`` replays scripted visits against a site's WSGI application from several
+threads or processes and reports throughput and latency; ``benchmarks.sites`` has the example
+sites that the benchmarks run against. Run them as modules from the repository root, e.g.::
+
+    python -m benchmarks.load_test --concurrency 8 --iterations 50
+"""
@@ -0,0 +1,326 @@
+"""
+An in-process load test for Drafter sites.
+
+Instead of starting a real server and driving it with a browser, this calls the site's WSGI
+application (``Server.app``) directly. Each simulated visitor replays a script of requests (with
+its own session cookie), and several visitors run at once, on threads or in separate processes.
+The report gives the throughput, the latency percentiles, and how much memory each request
+allocates at its peak (measured separately, on a single visitor, since tracing allocations slows
+everything down).
+
+Example::
+
+    python -m benchmarks.load_test --concurrency 8 --iterations 50 --mode threads
+    python -m benchmarks.load_test --site benchmarks.sites:inventory_site --json results.json
+"""
+from dataclasses import dataclass, field, asdict
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+import argparse
+import importlib
+import io
+import json
+import math
+import sys
+import time
+import tracemalloc
+from wsgiref.util import setup_testing_defaults
+
+from drafter.constants import SESSION_COOKIE_KEY
+
+
+@dataclass
+class Step:
+    """
+    A single request in a visitor's script, like clicking a button or submitting a form.
+
+    :ivar path: The URL path of the route (e.g., ``/add_item``).
+    :type path: str
+    :ivar params: The query (for ``GET``) or form (for ``POST``) parameters.
+    :type params: Dict[str, str]
+    :ivar method: Either ``GET`` or ``POST``.
+    :type method: str
+    """
+    path: str
+    params: Dict[str, str] = field(default_factory=dict)
+    method: str = "GET"
+
+
+DEFAULT_SCRIPT = [
+    Step("/"),
+    Step("/add_item"),
+    Step("/add_item"),
+    Step("/rename", {"name": "Grace"}, "POST"),
+    Step("/remove_item"),
+    Step("/"),
+]
+
+
+class WsgiVisitor:
+    """
+    Calls a WSGI application directly, keeping track of the session cookie like a browser would.
+
+    :param app: The WSGI application.
+    :param accept_encoding: The ``Accept-Encoding`` header to send, if any.
+    """
+
+    def __init__(self, app, accept_encoding: Optional[str] = None):
+        self.app = app
+        self.accept_encoding = accept_encoding
+        self.session_id: Optional[str] = None
+
+    def request(self, step: Step) -> Tuple[int, int]:
+        """
+        Sends a single request and reads the entire response.
+
+        :param step: The request to send.
+        :return: The status code and the size of the response body, in bytes.
+        """
+        query = urlencode(step.params)
+        body = query.encode('latin-1') if step.method == "POST" else b""
+        environ = {
+            'REQUEST_METHOD': step.method,
+            'PATH_INFO': step.path,
+            'QUERY_STRING': "" if step.method == "POST" else query,
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': io.BytesIO(body),
+        }
+        if step.method == "POST":
+            environ['CONTENT_TYPE'] = "application/x-www-form-urlencoded"
+        if self.session_id is not None:
+            environ['HTTP_COOKIE'] = f"{SESSION_COOKIE_KEY}={self.session_id}"
+        if self.accept_encoding:
+            environ['HTTP_ACCEPT_ENCODING'] = self.accept_encoding
+        setup_testing_defaults(environ)
+        status_line = []
+
+        def start_response(status, headers, exc_info=None):
+            status_line.append(status)
+            for name, value in headers:
+                if name.lower() == 'set-cookie' and value.startswith(SESSION_COOKIE_KEY + "="):
+                    self.session_id = value.split(";", 1)[0].split("=", 1)[1]
+
+        result = self.app(environ, start_response)
+        try:
+            size = sum(len(chunk) for chunk in result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return int(status_line[0].split(" ", 1)[0]), size
+
+
+@dataclass
+class LoadTestResult:
+    """
+    The results of a load test.
+
+    :ivar mode: Whether the visitors ran on ``threads`` or in ``processes``.
+    :ivar concurrency: How many visitors ran at once.
+    :ivar requests: How many requests were sent in total.
+    :ivar errors: How many of the requests had an error status (400 or more).
+    :ivar seconds: How long it took to send all of the requests.
+    :ivar requests_per_second: The throughput.
+    :ivar p50: The median latency, in milliseconds.
+    :ivar p95: The 95th percentile latency, in milliseconds.
+    :ivar p99: The 99th percentile latency, in milliseconds.
+    :ivar mean_response_bytes: The average size of a response body.
+    :ivar allocated_bytes_per_request: The average peak memory allocated while handling a request,
+        or None if it was not measured.
+    """
+    mode: str
+    concurrency: int
+    requests: int
+    errors: int
+    seconds: float
+    requests_per_second: float
+    p50: float
+    p95: float
+    p99: float
+    mean_response_bytes: float
+    allocated_bytes_per_request: Optional[float] = None
+
+    def summary(self) -> str:
+        """ Formats the results for a person to read. """
+        lines = [f"{self.requests} requests from {self.concurrency} visitors ({self.mode}) in {self.seconds:.2f}s",
+                 f"  Throughput: {self.requests_per_second:.1f} requests/second",
+                 f"  Latency: p50 {self.p50:.2f} ms, p95 {self.p95:.2f} ms, p99 {self.p99:.2f} ms",
+                 f"  Response size: {self.mean_response_bytes:.0f} bytes on average",
+                 f"  Errors: {self.errors}"]
+        if self.allocated_bytes_per_request is not None:
+            lines.append(f"  Allocated: {self.allocated_bytes_per_request:.0f} bytes per request (peak)")
+        return "\n".join(lines)
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    """
+    Finds a percentile of already sorted values, using the nearest rank.
+
+    :param ordered: The values, in increasing order.
+    :param fraction: Which percentile, as a fraction (e.g., 0.95).
+    :return: The value at that percentile, or zero if there are no values.
+    """
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def load_site(site: str) -> Callable:
+    """
+    Imports a site factory given as ``module:function``.
+
+    :param site: Where to find the function that builds the site's ``Server``.
+    :return: The factory function.
+    """
+    module_name, _, function_name = site.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def replay(app, script: List[Step], iterations: int,
+           accept_encoding: Optional[str] = None) -> Tuple[List[float], int, int]:
+    """
+    Replays the script as a single new visitor.
+
+    :param app: The WSGI application.
+    :param script: The requests to send, in order.
+    :param iterations: How many times to go through the script.
+    :param accept_encoding: The ``Accept-Encoding`` header to send, if any.
+    :return: The latency of each request (in seconds), the number of errors, and the total bytes received.
+    """
+    visitor = WsgiVisitor(app, accept_encoding)
+    latencies = []
+    errors = 0
+    received = 0
+    for _ in range(iterations):
+        for step in script:
+            started = time.perf_counter()
+            status, size = visitor.request(step)
+            latencies.append(time.perf_counter() - started)
+            received += size
+            if status >= 400:
+                errors += 1
+    return latencies, errors, received
+
+
+def replay_in_process(site: str, site_options: dict, script: List[Step], iterations: int,
+                      accept_encoding: Optional[str]) -> Tuple[List[float], int, int]:
+    """ Builds the site in a worker process, and then replays the script as one visitor. """
+    app = load_site(site)(**site_options).app
+    return replay(app, script, iterations, accept_encoding)
+
+
+def measure_allocations(app, script: List[Step], iterations: int = 3) -> float:
+    """
+    Measures the average peak memory allocated while handling each request of the script.
+    The script is run once first, so that one-time setup (e.g., hashing the theme) is not counted.
+
+    :param app: The WSGI application.
+    :param script: The requests to send, in order.
+    :param iterations: How many times to go through the script while measuring.
+    :return: The average peak allocation per request, in bytes.
+    """
+    visitor = WsgiVisitor(app)
+    for step in script:
+        visitor.request(step)
+    tracemalloc.start()
+    try:
+        total = 0
+        count = 0
+        for _ in range(iterations):
+            for step in script:
+                before, _ = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+                visitor.request(step)
+                _, peak = tracemalloc.get_traced_memory()
+                total += max(0, peak - before)
+                count += 1
+    finally:
+        tracemalloc.stop()
+    return total / count if count else 0.0
+
+
+def run_load_test(site: str = "benchmarks.sites:inventory_site", script: Optional[List[Step]] = None,
+                  concurrency: int = 4, iterations: int = 20, mode: str = "threads",
+                  site_options: Optional[dict] = None, accept_encoding: Optional[str] = None,
+                  measure_memory: bool = True) -> LoadTestResult:
+    """
+    Runs a load test: ``concurrency`` visitors each replay the script ``iterations`` times.
+
+    :param site: The site factory, as ``module:function``; it must return a set up ``Server``.
+    :param script: The requests each visitor sends; defaults to ``DEFAULT_SCRIPT``.
+    :param concurrency: How many visitors run at the same time.
+    :param iterations: How many times each visitor goes through the script.
+    :param mode: Either ``threads`` (all visitors share one server) or ``processes`` (each visitor
+        gets its own process and server, like separate worker processes).
+    :param site_options: Keyword arguments for the site factory (e.g., server configuration).
+    :param accept_encoding: The ``Accept-Encoding`` header to send, if any.
+    :param measure_memory: Whether to also measure the memory allocated per request.
+    :return: The results of the load test.
+    :raises ValueError: If the mode is not ``threads`` or ``processes``.
+    """
+    script = DEFAULT_SCRIPT if script is None else script
+    site_options = site_options or {}
+    if mode == "threads":
+        from concurrent.futures import ThreadPoolExecutor
+        app = load_site(site)(**site_options).app
+        # Warm up, so that one-time setup is not counted
+        replay(app, script, 1, accept_encoding)
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            started = time.perf_counter()
+            futures = [pool.submit(replay, app, script, iterations, accept_encoding) for _ in range(concurrency)]
+            outcomes = [future.result() for future in futures]
+            seconds = time.perf_counter() - started
+    elif mode == "processes":
+        from concurrent.futures import ProcessPoolExecutor
+        app = load_site(site)(**site_options).app if measure_memory else None
+        with ProcessPoolExecutor(max_workers=concurrency) as pool:
+            started = time.perf_counter()
+            futures = [pool.submit(replay_in_process, site, site_options, script, iterations, accept_encoding)
+                       for _ in range(concurrency)]
+            outcomes = [future.result() for future in futures]
+            seconds = time.perf_counter() - started
+    else:
+        raise ValueError(f"Unknown mode {mode!r}. Please choose 'threads' or 'processes'.")
+    latencies = sorted(latency for outcome in outcomes for latency in outcome[0])
+    errors = sum(outcome[1] for outcome in outcomes)
+    received = sum(outcome[2] for outcome in outcomes)
+    requests = len(latencies)
+    return LoadTestResult(
+        mode=mode, concurrency=concurrency, requests=requests, errors=errors, seconds=seconds,
+        requests_per_second=requests / seconds if seconds else 0.0,
+        p50=percentile(latencies, 0.50) * 1000,
+        p95=percentile(latencies, 0.95) * 1000,
+        p99=percentile(latencies, 0.99) * 1000,
+        mean_response_bytes=received / requests if requests else 0.0,
+        allocated_bytes_per_request=measure_allocations(app, script) if measure_memory else None)
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Load test a Drafter site in-process.")
+    parser.add_argument("--site", default="benchmarks.sites:inventory_site",
+                        help="The function that builds the site's Server, as module:function")
+    parser.add_argument("--concurrency", type=int, default=4, help="How many visitors run at once")
+    parser.add_argument("--iterations", type=int, default=20, help="How many times each visitor replays the script")
+    parser.add_argument("--mode", choices=["threads", "processes"], default="threads")
+    parser.add_argument("--script", help="A JSON file with a list of steps ({path, params, method})")
+    parser.add_argument("--gzip", action="store_true", help="Ask for compressed responses")
+    parser.add_argument("--no-debug", action="store_true", help="Turn off the debug information")
+    parser.add_argument("--no-memory", action="store_true", help="Skip measuring allocations")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args(arguments)
+    script = None
+    if args.script:
+        with open(args.script) as script_file:
+            script = [Step(**step) for step in json.load(script_file)]
+    result = run_load_test(args.site, script, args.concurrency, args.iterations, args.mode,
+                           {'debug': False} if args.no_debug else {},
+                           "gzip" if args.gzip else None, not args.no_memory)
+    print(result.summary())
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(asdict(result), output, indent=2)
+    return result
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,385 @@
+"""
+Micro-benchmarks for the functions that every request spends its time in: rendering pages and
+components, and serializing the state.
+
+Each benchmark is run at several input sizes, and the results are written to a JSON file, so that
+two commits can be compared. Comparing against an earlier results file reports every benchmark
+that got slower by more than the threshold, and exits with an error if there are any.
+
+Example::
+
+    python -m benchmarks.micro --output before.json
+    # ... make some changes ...
+    python -m benchmarks.micro --output after.json --compare before.json --threshold 0.2
+    python -m benchmarks.micro --filter table --sizes 1000
+"""
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import timeit
+
+from drafter import Page, Button, Table, TextBox, Header, Div, Text, BulletedList, Argument
+from drafter.configuration import ServerConfiguration
+from drafter.constants import LABEL_SEPARATOR
+from drafter.history import dehydrate_json, rehydrate_json, safe_repr, format_page_content, \
+    remap_hidden_form_parameters, StateDumpCache
+from drafter.state_codecs import get_codec
+from drafter.snapshots import take_snapshot
+from drafter.state_tokens import encode_state_token, decode_state_token
+from drafter.blobs import BlobStore
+from drafter.image_support import HAS_PILLOW, PILImage
+
+DEFAULT_SIZES = (10, 100, 1000)
+DEFAULT_THRESHOLD = 0.25
+
+
+@dataclass
+class Benchmark:
+    """
+    A single benchmark, run at each of its input sizes.
+
+    :ivar name: The name of the benchmark (e.g., ``table.str``).
+    :type name: str
+    :ivar setup: Given an input size, prepares the inputs and returns the function to time.
+    :type setup: Callable[[int], Callable[[], Any]]
+    :ivar sizes: The input sizes to run the benchmark at.
+    :type sizes: Sequence[int]
+    """
+    name: str
+    setup: Callable[[int], Callable[[], Any]]
+    sizes: Sequence[int] = DEFAULT_SIZES
+
+
+BENCHMARKS: List[Benchmark] = []
+
+
+def benchmark(name: str, sizes: Sequence[int] = DEFAULT_SIZES):
+    """
+    Registers a setup function as a benchmark.
+
+    :param name: The name of the benchmark.
+    :param sizes: The input sizes to run it at.
+    :return: A decorator that registers the setup function and returns it unchanged.
+    """
+    def register(setup):
+        BENCHMARKS.append(Benchmark(name, setup, sizes))
+        return setup
+    return register
+
+
+@dataclass
+class Item:
+    name: str
+    quantity: int
+    tags: List[str] = field(default_factory=list)
+
+
+@dataclass
+class Shelf:
+    label: str
+    items: List[Item]
+
+
+@dataclass
+class Warehouse:
+    owner: str
+    shelves: List[Shelf]
+    notes: Dict[str, str] = field(default_factory=dict)
+
+
+def make_warehouse(size: int) -> Warehouse:
+    """ Makes a nested state with ``size`` items in total, spread over shelves of ten. """
+    shelves = [Shelf(f"Shelf {start // 10}", [Item(f"Item {i}", i, ["a", "b"]) for i in range(start, min(start + 10, size))])
+               for start in range(0, size, 10)]
+    return Warehouse("Ada", shelves, {f"note {i}": "x" * 10 for i in range(size // 10)})
+
+
+def make_rows(size: int) -> List[Item]:
+    return [Item(f"Item {i}", i, ["a"]) for i in range(size)]
+
+
+CONFIGURATION = ServerConfiguration()
+
+
+def setup_render(content: List[Any]) -> Callable[[], Any]:
+    page = Page(None, content)
+    return lambda: page.render_content("null", CONFIGURATION)
+
+
+@benchmark("render_content.text")
+def render_text(size):
+    return setup_render([f"Line {i} of some text" for i in range(size)])
+
+
+@benchmark("render_content.components")
+def render_components(size):
+    return setup_render([[Header(f"Section {i}"), Text(f"Text {i}", style_color="red"),
+                          TextBox(f"box{i}", str(i)), Button(f"Go {i}", "index", Argument("which", i))][i % 4]
+                         for i in range(size)])
+
+
+@benchmark("render_content.nested")
+def render_nested(size):
+    return setup_render([Div(Text(f"Item {i}"), BulletedList([f"a{i}", f"b{i}"]), style_padding="1em")
+                         for i in range(size)])
+
+
+@benchmark("render_content.table")
+def render_table(size):
+    return setup_render(["Here is the table:", Table(make_rows(size))])
+
+
+@benchmark("parse_extra_settings", sizes=(1, 10, 50))
+def parse_extra_settings(size):
+    component = Text("Hello", **{f"style_margin_{i}": f"{i}px" for i in range(size)})
+    return lambda: component.parse_extra_settings(title="greeting", classes="big")
+
+
+@benchmark("table.construct")
+def table_construct(size):
+    rows = make_rows(size)
+    return lambda: Table(rows)
+
+
+@benchmark("table.str")
+def table_str(size):
+    table = Table(make_rows(size))
+    return lambda: str(table)
+
+
+@benchmark("dehydrate_json")
+def dehydrate(size):
+    state = make_warehouse(size)
+    return lambda: dehydrate_json(state)
+
+
+@benchmark("rehydrate_json")
+def rehydrate(size):
+    data = json.loads(json.dumps(dehydrate_json(make_warehouse(size))))
+    return lambda: rehydrate_json(data, Warehouse)
+
+
+@benchmark("codec.encode")
+def codec_encode(size):
+    state = make_warehouse(size)
+    codec = get_codec(Warehouse)
+    return lambda: codec.encode(state)
+
+
+@benchmark("codec.decode")
+def codec_decode(size):
+    codec = get_codec(Warehouse)
+    data = json.loads(json.dumps(codec.encode(make_warehouse(size))))
+    return lambda: codec.decode(data)
+
+
+@benchmark("state_dump.uncached")
+def uncached_dump(size):
+    state = make_warehouse(size)
+    encode = get_codec(Warehouse).encode
+    return lambda: json.dumps(encode(state))
+
+
+@benchmark("state_dump_cache.unchanged")
+def cached_dump(size):
+    state = make_warehouse(size)
+    encode = get_codec(Warehouse).encode
+    cache = StateDumpCache()
+    cache.dump(state, encode)
+    return lambda: cache.dump(state, encode)
+
+
+@benchmark("state_dump_cache.after_route")
+def cleared_dump(size):
+    # A route was called, so the cache is cleared and the state dumped again
+    state = make_warehouse(size)
+    encode = get_codec(Warehouse).encode
+    cache = StateDumpCache()
+
+    def dump():
+        cache.clear()
+        return cache.dump(state, encode)
+    return dump
+
+
+TOKEN_SECRET = "benchmark secret"
+
+
+@benchmark("state_token.encode")
+def token_encode(size):
+    dumped = json.dumps(dehydrate_json(make_warehouse(size)))
+    return lambda: encode_state_token(dumped, TOKEN_SECRET)
+
+
+@benchmark("state_token.decode")
+def token_decode(size):
+    token = encode_state_token(json.dumps(dehydrate_json(make_warehouse(size))), TOKEN_SECRET)
+    return lambda: decode_state_token(token, TOKEN_SECRET)
+
+
+@benchmark("take_snapshot.one_change")
+def snapshot_one_change(size):
+    state = make_warehouse(size)
+    previous = take_snapshot(state)
+
+    def run():
+        state.shelves[-1].items[-1].quantity += 1
+        return take_snapshot(state, previous)
+    return run
+
+
+@benchmark("blob_store.image_url", sizes=(16, 128, 512))
+def blob_image_url(size):
+    # The same image is shown again on every request; only the first one is encoded
+    if not HAS_PILLOW:
+        return lambda: None
+    store = BlobStore()
+    image = PILImage.effect_noise((size, size), 64)
+    return lambda: store.image_url(image)
+
+
+@benchmark("figure_fingerprint", sizes=(100, 10000))
+def plot_fingerprint(size):
+    # Deciding whether a plot was drawn before has to cost far less than drawing it
+    try:
+        import matplotlib.pyplot as plt
+    except ImportError:
+        return lambda: None
+    from drafter.plots import figure_fingerprint
+    figure = plt.figure()
+    plt.plot(range(size), range(size))
+    plt.title("Benchmark")
+    return lambda: figure_fingerprint(figure, {"format": "png"})
+
+
+@benchmark("safe_repr")
+def repr_state(size):
+    state = make_warehouse(size)
+    return lambda: safe_repr(state)
+
+
+@benchmark("format_page_content")
+def format_content(size):
+    page = Page(make_warehouse(size), [f"Line {i}" for i in range(size)])
+    return lambda: format_page_content(page, 120)
+
+
+@benchmark("remap_hidden_form_parameters")
+def remap_form(size):
+    kwargs = {f"field{i}": f"value {i}" for i in range(size)}
+    for i in range(size):
+        # The browser submits the (unescaped) JSON of each button's namespace
+        namespace = json.dumps(f"Button {i}#{i}")
+        kwargs[f"{namespace}{LABEL_SEPARATOR}which"] = json.dumps(i)
+        kwargs[f"{namespace}{LABEL_SEPARATOR}extra"] = json.dumps({"index": i})
+    pressed = f"Button {size // 2}#{size // 2}"
+    return lambda: remap_hidden_form_parameters(kwargs, pressed)
+
+
+def measure(function: Callable[[], Any], min_time: float = 0.05, repeat: int = 5) -> Dict[str, float]:
+    """
+    Times a function. The number of calls per measurement is chosen so that each measurement takes
+    at least ``min_time`` seconds, and the measurement is repeated ``repeat`` times.
+
+    :param function: The function to time.
+    :param min_time: The shortest time a single measurement should take, in seconds.
+    :param repeat: How many measurements to take.
+    :return: The best and median seconds per call, and how many calls each measurement made.
+    """
+    timer = timeit.Timer(function)
+    loops = 1
+    while True:
+        if timer.timeit(loops) >= min_time:
+            break
+        loops *= 10 if loops < 1000 else 2
+    per_call = [elapsed / loops for elapsed in timer.repeat(repeat, loops)]
+    return {'best': min(per_call), 'median': statistics.median(per_call), 'loops': loops}
+
+
+def run_benchmarks(name_filter: str = "", sizes: Optional[Sequence[int]] = None,
+                   min_time: float = 0.05, repeat: int = 5, report: Callable[[str], Any] = print) -> dict:
+    """
+    Runs the benchmarks and collects their results.
+
+    :param name_filter: Only run benchmarks whose names contain this text.
+    :param sizes: Only run at these input sizes (by default, each benchmark's own sizes).
+    :param min_time: The shortest time a single measurement should take, in seconds.
+    :param repeat: How many measurements to take of each benchmark.
+    :param report: Called with a line of text as each result comes in.
+    :return: The results, with some information about the machine, ready to be saved as JSON.
+    """
+    import drafter
+    results = {}
+    for bench in BENCHMARKS:
+        if name_filter not in bench.name:
+            continue
+        for size in (sizes or bench.sizes):
+            key = f"{bench.name}[{size}]"
+            results[key] = measure(bench.setup(size), min_time, repeat)
+            report(f"{key:<40} {results[key]['best'] * 1e6:12.2f} us")
+    return {
+        'meta': {
+            'drafter': drafter.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        'results': results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float = DEFAULT_THRESHOLD) -> List[Dict[str, Any]]:
+    """
+    Finds the benchmarks that got slower, comparing the best time of each benchmark in both results.
+
+    :param baseline: Earlier results, as returned by ``run_benchmarks``.
+    :param current: Newer results, as returned by ``run_benchmarks``.
+    :param threshold: How much slower (as a fraction, e.g. 0.25 for 25%) counts as a regression.
+    :return: One entry per regression, with the benchmark, both times, and their ratio.
+    """
+    regressions = []
+    for key, result in current['results'].items():
+        before = baseline['results'].get(key)
+        if before is None or before['best'] <= 0:
+            continue
+        ratio = result['best'] / before['best']
+        if ratio > 1 + threshold:
+            regressions.append({'benchmark': key, 'before': before['best'], 'after': result['best'], 'ratio': ratio})
+    return regressions
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Run Drafter's micro-benchmarks.")
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose names contain this text")
+    parser.add_argument("--sizes", type=int, nargs="*", help="Only run at these input sizes")
+    parser.add_argument("--min-time", type=float, default=0.05, help="Shortest time for one measurement (seconds)")
+    parser.add_argument("--repeat", type=int, default=5, help="Measurements per benchmark")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare against the results in this JSON file")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Slowdown (as a fraction) that counts as a regression")
+    args = parser.parse_args(arguments)
+    results = run_benchmarks(args.filter, args.sizes, args.min_time, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(baseline, results, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression['benchmark']}: {regression['before'] * 1e6:.2f} us -> "
+                  f"{regression['after'] * 1e6:.2f} us ({regression['ratio']:.2f}x)")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,68 @@
+"""
+Small example sites for the benchmarks, similar to what students build: a state with a few fields,
+a page with a table and a form, and routes that change the state.
+"""
+from dataclasses import dataclass, field
+from typing import List
+
+from drafter import route, Page, Button, Table, TextBox, Header, BulletedList
+from drafter.server import Server
+
+
+@dataclass
+class Item:
+    name: str
+    quantity: int
+
+
+@dataclass
+class Inventory:
+    owner: str
+    count: int
+    items: List[Item] = field(default_factory=list)
+
+
+def inventory_site(initial_items: int = 10, **configuration) -> Server:
+    """
+    Builds (and sets up) a small inventory site.
+
+    :param initial_items: How many items the initial state has.
+    :param configuration: Any server configuration settings (e.g., ``debug=False``).
+    :return: The set up server; its ``app`` is the WSGI application.
+    """
+    server = Server(_custom_name="BENCHMARK_INVENTORY", **configuration)
+
+    @route(server=server)
+    def index(state: Inventory) -> Page:
+        return Page(state, [
+            Header(f"{state.owner}'s Inventory"),
+            f"There have been {state.count} changes.",
+            Table(state.items),
+            BulletedList([item.name for item in state.items[:5]]),
+            TextBox("name", state.owner),
+            Button("Rename", "rename"),
+            Button("Add item", "add_item"),
+            Button("Remove item", "remove_item"),
+        ])
+
+    @route(server=server)
+    def add_item(state: Inventory) -> Page:
+        state.items.append(Item(f"Item {len(state.items)}", state.count))
+        state.count += 1
+        return index(state)
+
+    @route(server=server)
+    def remove_item(state: Inventory) -> Page:
+        if state.items:
+            state.items.pop()
+        state.count += 1
+        return index(state)
+
+    @route(server=server)
+    def rename(state: Inventory, name: str) -> Page:
+        state.owner = name
+        state.count += 1
+        return index(state)
+
+    server.setup(Inventory("Ada", 0, [Item(f"Item {i}", i) for i in range(initial_items)]))
+    return server
@@ -0,0 +1,166 @@
+"""
+Content-hashed theme assets.
+
+Normally, every page inlines the theme's stylesheets and scripts. When ``inline_assets`` is turned
+off in the server configuration, each of those files is instead served from its own URL under
+``/--assets/``, named after a hash of its contents. Since the URL changes whenever the contents
+do, browsers can cache the files forever and only download them once.
+"""
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from drafter.raw_files import RAW_FILES
+from drafter.compression import compress
+
+ASSET_URL_PREFIX = "/--assets/"
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+ASSET_CONTENT_TYPES = {
+    'css': "text/css; charset=utf-8",
+    'js': "application/javascript; charset=utf-8",
+}
+
+
+@dataclass
+class Asset:
+    """
+    A single theme file, ready to be served.
+
+    :ivar name: The original filename of the asset (e.g., ``skeleton.css``).
+    :type name: str
+    :ivar extension: Either ``css`` or ``js``.
+    :type extension: str
+    :ivar content: The encoded contents of the file.
+    :type content: bytes
+    :ivar digest: A hash of the contents, used as both the filename and the ``ETag``.
+    :type digest: str
+    :ivar compressed: The compressed contents, by content encoding, filled in on first use.
+    :type compressed: Dict[str, bytes]
+    """
+    name: str
+    extension: str
+    content: bytes
+    digest: str
+    compressed: Dict[str, bytes] = field(default_factory=dict, repr=False)
+
+    @property
+    def filename(self) -> str:
+        """ The hashed filename that the asset is served under. """
+        return f"{self.digest}.{self.extension}"
+
+    @property
+    def url(self) -> str:
+        """ The URL that the asset is served at. """
+        return ASSET_URL_PREFIX + self.filename
+
+    @property
+    def etag(self) -> str:
+        """ The (quoted) ``ETag`` header value for the asset. """
+        return f'"{self.digest}"'
+
+    @property
+    def content_type(self) -> str:
+        """ The ``Content-Type`` header value for the asset. """
+        return ASSET_CONTENT_TYPES[self.extension]
+
+    def encoded(self, encoding: Optional[str], level: int = 6) -> bytes:
+        """
+        Retrieves the contents in the given content encoding. Each encoding is only
+        compressed once, and then reused for every later request.
+
+        :param encoding: Either ``gzip``, ``deflate``, or None for the uncompressed contents.
+        :param level: The compression level, used the first time the encoding is requested.
+        :return: The (possibly compressed) contents.
+        """
+        if encoding is None:
+            return self.content
+        if encoding not in self.compressed:
+            self.compressed[encoding] = compress(self.content, encoding, level)
+        return self.compressed[encoding]
+
+    def to_tag(self) -> str:
+        """
+        Makes the HTML tag that loads this asset.
+
+        :return: Either a ``<link>`` tag for a stylesheet or a ``<script>`` tag for a script.
+        """
+        if self.extension == 'css':
+            return f'<link rel="stylesheet" href="{self.url}">'
+        return f'<script src="{self.url}"></script>'
+
+
+def make_asset(name: str, text: str, extension: str) -> Asset:
+    """
+    Encodes and hashes the given file contents.
+
+    :param name: The original filename.
+    :param text: The contents of the file.
+    :param extension: Either ``css`` or ``js``.
+    :return: The new asset.
+    """
+    import hashlib
+    content = text.encode('utf-8')
+    return Asset(name, extension, content, hashlib.sha256(content).hexdigest()[:20])
+
+
+@dataclass
+class ThemeAssets:
+    """
+    The hashed stylesheets and scripts of a single theme, in the order they should be included.
+
+    :ivar styles: The theme's stylesheets.
+    :type styles: List[Asset]
+    :ivar scripts: The theme's scripts.
+    :type scripts: List[Asset]
+    """
+    styles: List[Asset]
+    scripts: List[Asset]
+
+
+class AssetRegistry:
+    """
+    Keeps track of every asset that the server can serve, by hashed filename. Each theme's files
+    are hashed the first time that theme is used, and reused after that.
+    """
+
+    def __init__(self):
+        self._assets: Dict[str, Asset] = {}
+        self._themes: Dict[str, ThemeAssets] = {}
+
+    def get_theme(self, theme: str) -> Optional[ThemeAssets]:
+        """
+        Retrieves (hashing and registering, if needed) the assets for the given theme.
+
+        :param theme: The name of the theme (e.g., ``global`` or ``skeleton``).
+        :return: The theme's assets, or None if there is no such theme.
+        """
+        if theme in self._themes:
+            return self._themes[theme]
+        if theme not in RAW_FILES:
+            return None
+        raw = RAW_FILES[theme]
+        assets = ThemeAssets([self.add(make_asset(name, text, 'css')) for name, text in raw.styles.items()],
+                             [self.add(make_asset(name, text, 'js')) for name, text in raw.scripts.items()])
+        self._themes[theme] = assets
+        return assets
+
+    def add(self, asset: Asset) -> Asset:
+        """
+        Registers the asset so that it can be served.
+
+        :param asset: The asset to register.
+        :return: The same asset.
+        """
+        self._assets[asset.filename] = asset
+        return asset
+
+    def get(self, filename: str) -> Optional[Asset]:
+        """
+        Finds the asset with the given hashed filename.
+
+        :param filename: The hashed filename (e.g., ``0123abcd.css``).
+        :return: The asset, or None if there is no such asset.
+        """
+        return self._assets.get(filename)
+
+    def __len__(self):
+        return len(self._assets)
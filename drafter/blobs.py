@@ -0,0 +1,328 @@
+"""
+Content-addressed storage for images shown on pages or kept in the state.
+
+A PIL image used to be encoded to PNG several times per request: once for each copy of the state
+(``dehydrate_json``), again for every ``Image`` or ``Download`` on the page (inlined as a ``data:``
+URI), and once more for the debug information. A ``BlobStore`` instead encodes each distinct image
+once, names the result after a hash of its contents, and serves it from ``/--blobs/<filename>``.
+Pages then only contain a short URL, and the state only contains a short handle::
+
+    "--blob:" + sha256(png)[:32] + ".png"
+
+Recently used blobs are kept in memory (up to ``max_bytes``). Older ones are moved to a folder on
+disk, so that handles in old states and history entries keep working. If the folder is configured
+explicitly (``blob_path``), every blob is written to it as soon as it is added, so several workers
+sharing the folder can serve each other's blobs. Otherwise, a temporary folder is used, and it is
+removed when the process that made it exits.
+
+In Skulpt (or with ``inline_images``), there is no server to serve blobs from, so the store is
+turned off and images are inlined as before.
+"""
+import io
+import os
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from drafter.image_support import PILImage
+from drafter.sessions import RLock
+
+BLOB_URL_PREFIX = "/--blobs/"
+BLOB_HANDLE_PREFIX = "--blob:"
+BLOB_CACHE_CONTROL = "public, max-age=31536000, immutable"
+BLOB_CONTENT_TYPES = {
+    'png': "image/png",
+}
+BLOB_FILENAME = re.compile(r"^[0-9a-f]{32}\.[a-z0-9]+$")
+DEFAULT_MAX_IMAGES = 1024
+
+
+@dataclass
+class Blob:
+    """
+    A single stored file, named after a hash of its contents.
+
+    :ivar digest: A hash of the contents, used as both the filename and the ``ETag``.
+    :type digest: str
+    :ivar extension: The kind of file (e.g., ``png``).
+    :type extension: str
+    :ivar content: The contents of the file.
+    :type content: bytes
+    """
+    digest: str
+    extension: str
+    content: bytes
+
+    @property
+    def filename(self) -> str:
+        """ The hashed filename that the blob is served under. """
+        return f"{self.digest}.{self.extension}"
+
+    @property
+    def url(self) -> str:
+        """ The URL that the blob is served at. """
+        return BLOB_URL_PREFIX + self.filename
+
+    @property
+    def handle(self) -> str:
+        """ The short string that stands in for the blob in a saved state. """
+        return BLOB_HANDLE_PREFIX + self.filename
+
+    @property
+    def etag(self) -> str:
+        """ The (quoted) ``ETag`` header value for the blob. """
+        return f'"{self.digest}"'
+
+    @property
+    def content_type(self) -> str:
+        """ The ``Content-Type`` header value for the blob. """
+        return BLOB_CONTENT_TYPES.get(self.extension, "application/octet-stream")
+
+
+def make_blob(content: bytes, extension: str) -> Blob:
+    """
+    Hashes the given file contents.
+
+    :param content: The contents of the file.
+    :param extension: The kind of file (e.g., ``png``).
+    :return: The new blob.
+    """
+    import hashlib
+    return Blob(hashlib.sha256(content).hexdigest()[:32], extension, content)
+
+
+def encode_png(image) -> bytes:
+    """ Encodes a PIL image as PNG. """
+    with io.BytesIO() as output:
+        image.save(output, format='PNG')
+        return output.getvalue()
+
+
+def image_fingerprint(image) -> Tuple:
+    """
+    Identifies an image by its pixels, which is much cheaper than encoding it, so that the same
+    image is only encoded once even if it is a different (or since changed) object.
+
+    :param image: A PIL image.
+    :return: A hashable value that is equal for images with the same pixels.
+    """
+    import hashlib
+    palette = image.getpalette()
+    return (image.mode, image.size, bytes(palette) if palette else None,
+            hashlib.sha256(image.tobytes()).digest())
+
+
+class BlobStore:
+    """
+    Keeps blobs by hashed filename: the most recently used ones in memory, and the rest on disk.
+
+    :param max_bytes: The largest total size of the blobs kept in memory; zero (or less) means no limit.
+    :param path: The folder that blobs are written to. If empty, a temporary folder is made the first
+        time a blob is moved out of memory, and removed when the process exits.
+    :param enabled: Whether images are stored and linked to at all, rather than inlined.
+    :ivar total_bytes: The total size of the blobs currently kept in memory.
+    :type total_bytes: int
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, path: str = '', enabled: bool = True):
+        self.max_bytes = max_bytes
+        self.path = path
+        self.enabled = enabled
+        self.total_bytes = 0
+        self._blobs: 'OrderedDict[str, Blob]' = OrderedDict()
+        self._images: 'OrderedDict[Tuple, str]' = OrderedDict()
+        self._folder: Optional[str] = path or None
+        # The temporary folder (if one was made), and the process that made it
+        self._temporary_folder: Optional[str] = None
+        self._temporary_owner = 0
+        self._lock = RLock()
+
+    def configure(self, max_bytes: int, path: str, enabled: bool):
+        """
+        Changes the store's settings (e.g., when a server is set up with its configuration).
+        Blobs that are already stored are kept.
+
+        :param max_bytes: The largest total size of the blobs kept in memory.
+        :param path: The folder that blobs are written to (empty for a temporary folder).
+        :param enabled: Whether images are stored and linked to at all.
+        """
+        with self._lock:
+            self.max_bytes, self.enabled = max_bytes, enabled
+            if path != self.path:
+                self.path = path
+                self._folder = path or None
+            self._evict()
+
+    def add(self, content: bytes, extension: str) -> Blob:
+        """
+        Stores the given file contents, unless a blob with the same contents is already stored.
+
+        :param content: The contents of the file.
+        :param extension: The kind of file (e.g., ``png``).
+        :return: The stored blob.
+        """
+        blob = make_blob(content, extension)
+        with self._lock:
+            existing = self._blobs.get(blob.filename)
+            if existing is not None:
+                self._blobs.move_to_end(blob.filename)
+                return existing
+            self._blobs[blob.filename] = blob
+            self.total_bytes += len(content)
+            if self.path:
+                self._write(blob)
+            self._evict()
+        return blob
+
+    def add_image(self, image) -> Blob:
+        """
+        Stores a PIL image as a PNG. Images with the same pixels as one stored earlier are not
+        encoded again.
+
+        :param image: The PIL image.
+        :return: The stored blob.
+        """
+        fingerprint = image_fingerprint(image)
+        with self._lock:
+            filename = self._images.get(fingerprint)
+            if filename is not None:
+                self._images.move_to_end(fingerprint)
+                blob = self.get(filename)
+                if blob is not None:
+                    return blob
+        blob = self.add(encode_png(image), 'png')
+        with self._lock:
+            self._images[fingerprint] = blob.filename
+            while len(self._images) > DEFAULT_MAX_IMAGES:
+                self._images.popitem(last=False)
+        return blob
+
+    def get(self, filename: str) -> Optional[Blob]:
+        """
+        Finds the blob with the given hashed filename, in memory or on disk. Blobs read from disk
+        are kept in memory again.
+
+        :param filename: The hashed filename (e.g., ``0123abcd....png``).
+        :return: The blob, or None if there is no such blob.
+        """
+        with self._lock:
+            blob = self._blobs.get(filename)
+            if blob is not None:
+                self._blobs.move_to_end(filename)
+                return blob
+            if not BLOB_FILENAME.match(filename) or self._folder is None:
+                return None
+            try:
+                with open(os.path.join(self._folder, filename), 'rb') as blob_file:
+                    content = blob_file.read()
+            except OSError:
+                return None
+            digest, extension = filename.split('.', 1)
+            blob = Blob(digest, extension, content)
+            self._blobs[filename] = blob
+            self.total_bytes += len(content)
+            self._evict()
+            return blob
+
+    def image_url(self, image) -> str:
+        """
+        Makes the URL that shows a PIL image: a ``/--blobs/`` URL, or a ``data:`` URI if the store
+        is turned off.
+
+        :param image: The PIL image.
+        :return: The URL.
+        """
+        if not self.enabled:
+            return self.content_url(encode_png(image), 'png')
+        return self.add_image(image).url
+
+    def content_url(self, content: bytes, extension: str) -> str:
+        """
+        Makes the URL that serves already encoded file contents (e.g., a rendered plot): a
+        ``/--blobs/`` URL, or a ``data:`` URI if the store is turned off.
+
+        :param content: The contents of the file.
+        :param extension: The kind of file (e.g., ``png``).
+        :return: The URL.
+        """
+        if not self.enabled:
+            import base64
+            content_type = BLOB_CONTENT_TYPES.get(extension, "application/octet-stream")
+            return f"data:{content_type};base64," + base64.b64encode(content).decode('ascii')
+        return self.add(content, extension).url
+
+    def dump_image(self, image) -> str:
+        """
+        Turns a PIL image into a string for a saved state: a blob handle, or the PNG itself (as
+        latin1 text) if the store is turned off.
+
+        :param image: The PIL image.
+        :return: The string to keep in the state.
+        """
+        if not self.enabled:
+            return encode_png(image).decode('latin1')
+        return self.add_image(image).handle
+
+    def load_image(self, value: str):
+        """
+        Restores a PIL image from a string made by ``dump_image`` (either kind).
+
+        :param value: The string kept in the state.
+        :return: The PIL image.
+        :raises ValueError: If the value is a handle for a blob that is no longer stored.
+        """
+        if value.startswith(BLOB_HANDLE_PREFIX):
+            blob = self.get(value[len(BLOB_HANDLE_PREFIX):])
+            if blob is None:
+                raise ValueError(f"The image {value!r} is no longer stored on the server.")
+            return PILImage.open(io.BytesIO(blob.content))
+        return PILImage.open(io.BytesIO(value.encode('latin1')))
+
+    def remove_temporary_folder(self):
+        """
+        Removes the temporary folder that blobs were moved into, along with those blobs, if this process
+        made it. Called when the process exits; a folder given as ``path`` is never removed.
+        """
+        with self._lock:
+            folder = self._temporary_folder
+            if folder is None or self._temporary_owner != os.getpid():
+                return
+            import shutil
+            shutil.rmtree(folder, ignore_errors=True)
+            self._temporary_folder = None
+            if self._folder == folder:
+                self._folder = None
+
+    def _write(self, blob: Blob):
+        if self._folder is None:
+            import tempfile
+            import atexit
+            self._folder = self._temporary_folder = tempfile.mkdtemp(prefix="drafter-blobs-")
+            self._temporary_owner = os.getpid()
+            atexit.register(self.remove_temporary_folder)
+        os.makedirs(self._folder, exist_ok=True)
+        target = os.path.join(self._folder, blob.filename)
+        if os.path.exists(target):
+            return
+        # Write to a temporary name first, so that other workers never read half a file
+        partial = f"{target}.{os.getpid()}.partial"
+        with open(partial, 'wb') as blob_file:
+            blob_file.write(blob.content)
+        os.replace(partial, target)
+
+    def _evict(self):
+        # The newest blob is always kept in memory, even if it is larger than the limit on its own
+        while self.max_bytes > 0 and self.total_bytes > self.max_bytes and len(self._blobs) > 1:
+            filename, blob = self._blobs.popitem(last=False)
+            self.total_bytes -= len(blob.content)
+            try:
+                self._write(blob)
+            except OSError:
+                pass
+
+    def __len__(self):
+        return len(self._blobs)
+
+
+BLOB_STORE = BlobStore(enabled=not os.environ.get('DRAFTER_SKULPT', False))
@@ -1,16 +1,19 @@
 from dataclasses import dataclass, is_dataclass, fields
 from copy import deepcopy
-from typing import Any, Union, Optional, List, Dict, Tuple
+from typing import Any, Union, Optional, List, Dict, Tuple, Iterator
 import io
 import base64
 # from urllib.parse import quote_plus
 import json
 import html
 
-from drafter.constants import LABEL_SEPARATOR, SUBMIT_BUTTON_KEY, JSON_DECODE_SYMBOL
+from drafter.constants import LABEL_SEPARATOR, SUBMIT_BUTTON_KEY, JSON_DECODE_SYMBOL, RESTORABLE_STATE_KEY
 from drafter.urls import remap_attr_styles, friendly_urls, check_invalid_external_url, merge_url_query_params
 from drafter.image_support import HAS_PILLOW, PILImage
+from drafter.blobs import BLOB_STORE
+from drafter.plots import PLOT_RENDERER, PYPLOT_LOCK
 from drafter.history import safe_repr
+from drafter.state_tokens import is_state_token
 
 try:
     import matplotlib.pyplot as plt
@@ -175,9 +178,46 @@ class PageContent:
         """
         return str(self)
 
+    def render_iter(self, current_state, configuration) -> Iterator[str]:
+        """
+        Renders the component as a sequence of HTML fragments, which together are the same as the
+        result of ``render``. This lets the server start sending a page before all of it has been
+        rendered. By default, the entire component is yielded as a single fragment; components that
+        can be very large (like tables) yield smaller pieces instead.
+
+        :param current_state: The current state of the component
+        :type current_state: Any
+        :param configuration: The configuration settings for the component
+        :type configuration: Configuration
+        :return: An iterator of HTML fragments
+        """
+        yield self.render(current_state, configuration)
+
 
 Content = Union[PageContent, str]
 
+
+def render_child_iter(item, current_state, configuration) -> Iterator[str]:
+    """
+    Renders a component nested inside another one (e.g., in a ``Div`` or a ``Table``), so that it
+    gets the same state and configuration as the components at the top of the page. Outside of a
+    page (when there is no configuration), the item is just turned into a string.
+
+    :param item: The nested component or string
+    :param current_state: The current state of the page
+    :param configuration: The configuration settings for the page, or None
+    :return: An iterator of HTML fragments
+    """
+    if configuration is not None and isinstance(item, PageContent):
+        yield from item.render_iter(current_state, configuration)
+    else:
+        yield str(item)
+
+
+def render_child(item, current_state, configuration) -> str:
+    """ Renders a nested component to a single string; see ``render_child_iter``. """
+    return "".join(render_child_iter(item, current_state, configuration))
+
 def make_safe_json_argument(value):
     """
     Converts the given value to a JSON-compatible string and escapes special
@@ -325,12 +365,22 @@ class Link(PageContent, LinkContent):
         # Generate a unique ID for this link instance to avoid namespace collisions
         self._link_id = id(self)
 
+    def render(self, current_state, configuration):
+        if configuration.stateless and not self.external and is_state_token(current_state):
+            # Following a link does not submit the page's form, so the link carries the state itself
+            return self.render_link({RESTORABLE_STATE_KEY: current_state})
+        return str(self)
+
     def __str__(self) -> str:
+        return self.render_link({})
+
+    def render_link(self, extra_parameters: dict) -> str:
         # Create a unique namespace using both link text and instance ID
         link_namespace = f"{self.text}#{self._link_id}"
         precode = self.create_arguments(self.arguments, link_namespace)
-        url = merge_url_query_params(self.url, {SUBMIT_BUTTON_KEY: link_namespace})
-        return f"{precode}<a href='{url}' {self.parse_extra_settings()}>{self.text}</a>"
+        # The server decodes the pressed button (or link) as JSON, the same as a button's value
+        url = merge_url_query_params(self.url, {SUBMIT_BUTTON_KEY: json.dumps(link_namespace), **extra_parameters})
+        return f"{precode}<a href='{html.escape(url)}' {self.parse_extra_settings()}>{self.text}</a>"
 
 
 @dataclass
@@ -365,7 +415,6 @@ class Button(PageContent, LinkContent):
         parsed_settings = self.parse_extra_settings(**self.extra_settings)
         value = make_safe_argument(button_namespace)
         text = html.escape(self.text)
-        print(repr(self.text), repr(text))
         return f"{precode}<button type='submit' name='{SUBMIT_BUTTON_KEY}' value='{value}' formaction='{url}' {parsed_settings}>{text}</button>"
 
 
@@ -408,12 +457,7 @@ class Image(PageContent, LinkContent):
 
         if image is None:
             return True, ""
-        image_data = io.BytesIO()
-        image.save(image_data, format="PNG")
-        image_data.seek(0)
-        figure = base64.b64encode(image_data.getvalue()).decode('utf-8')
-        figure = f"data:image/png;base64,{figure}"
-        return True, figure
+        return True, BLOB_STORE.image_url(image)
 
     def __str__(self) -> str:
         from drafter.server import get_server_setting
@@ -560,8 +604,17 @@ class _HtmlGroup(PageContent):
         return f"{class_name}({', '.join(repr(item) for item in self.content)})"
 
     def __str__(self) -> str:
+        return "".join(self.render_iter(None, None))
+
+    def render(self, current_state, configuration):
+        return "".join(self.render_iter(current_state, configuration))
+
+    def render_iter(self, current_state, configuration) -> Iterator[str]:
         parsed_settings = self.parse_extra_settings(**self.extra_settings)
-        return f"<{self.kind} {parsed_settings}>{''.join(str(item) for item in self.content)}</{self.kind}>"
+        yield f"<{self.kind} {parsed_settings}>"
+        for item in self.content:
+            yield from render_child_iter(item, current_state, configuration)
+        yield f"</{self.kind}>"
 
 
 @dataclass(repr=False)
@@ -625,9 +678,18 @@ class _HtmlList(PageContent):
         self.extra_settings = kwargs
 
     def __str__(self) -> str:
+        return "".join(self.render_iter(None, None))
+
+    def render(self, current_state, configuration):
+        return "".join(self.render_iter(current_state, configuration))
+
+    def render_iter(self, current_state, configuration) -> Iterator[str]:
         parsed_settings = self.parse_extra_settings(**self.extra_settings)
-        items = "\n".join(f"<li>{item}</li>" for item in self.items)
-        return f"<{self.kind} {parsed_settings}>{items}</{self.kind}>"
+        yield f"<{self.kind} {parsed_settings}>"
+        for index, item in enumerate(self.items):
+            item = render_child(item, current_state, configuration)
+            yield f"\n<li>{item}</li>" if index else f"<li>{item}</li>"
+        yield f"</{self.kind}>"
 
 
 class NumberedList(_HtmlList):
@@ -692,18 +754,27 @@ class Table(PageContent):
             if isinstance(row, str):
                 result.append(row)
             elif isinstance(row, list):
-                result.append([str(cell) for cell in row])
+                # Components are rendered later, so that they get the page's state
+                result.append([cell if isinstance(cell, PageContent) else str(cell) for cell in row])
 
         if had_dataclasses and self.header is None:
             self.header = list(row.__dataclass_fields__.keys())
         self.rows = result
 
     def __str__(self) -> str:
+        return "".join(self.render_iter(None, None))
+
+    def render(self, current_state, configuration):
+        return "".join(self.render_iter(current_state, configuration))
+
+    def render_iter(self, current_state, configuration) -> Iterator[str]:
         parsed_settings = self.parse_extra_settings(**self.extra_settings)
-        rows = "\n".join(f"<tr>{''.join(f'<td>{cell}</td>' for cell in row)}</tr>"
-                         for row in self.rows)
-        header = "" if not self.header else f"<thead><tr>{''.join(f'<th>{cell}</th>' for cell in self.header)}</tr></thead>"
-        return f"<table {parsed_settings}>{header}{rows}</table>"
+        header = "" if not self.header else f"<thead><tr>{''.join(f'<th>{render_child(cell, current_state, configuration)}</th>' for cell in self.header)}</tr></thead>"
+        yield f"<table {parsed_settings}>{header}"
+        for index, row in enumerate(self.rows):
+            cells = ''.join(f'<td>{render_child(cell, current_state, configuration)}</td>' for cell in row)
+            yield f"\n<tr>{cells}</tr>" if index else f"<tr>{cells}</tr>"
+        yield "</table>"
 
     def __repr__(self):
         pieces = [repr(self._original_rows)]
@@ -787,21 +858,22 @@ class MatPlotLibPlot(PageContent):
 
     def __str__(self):
         parsed_settings = self.parse_extra_settings(**self.extra_settings)
-        # Handle image processing
-        image_data = io.BytesIO()
-        plt.savefig(image_data, **self.extra_matplotlib_settings)
+        image_format = self.extra_matplotlib_settings["format"]
+        if image_format not in ("png", "svg"):
+            raise ValueError(f"Unsupported format {image_format}")
+        # Handle image processing; the current figure is global pyplot state, shared by every thread
+        with PYPLOT_LOCK:
+            figure = plt.gcf()
+            if self.close_automatically:
+                # Once closed, no other thread can reach the figure, so it is rendered without the lock
+                plt.close(figure)
+            else:
+                output = PLOT_RENDERER.render(figure, self.extra_matplotlib_settings)
         if self.close_automatically:
-            plt.close()
-        image_data.seek(0)
-        if self.extra_matplotlib_settings["format"] == "png":
-            figure = base64.b64encode(image_data.getvalue()).decode('utf-8')
-            figure = f"data:image/png;base64,{figure}"
-            return f"<img src='{figure}' {parsed_settings}/>"
-        elif self.extra_matplotlib_settings["format"] == "svg":
-            figure = image_data.read().decode()
-            return figure
-        else:
-            raise ValueError(f"Unsupported format {self.extra_matplotlib_settings['format']}")
+            output = PLOT_RENDERER.render(figure, self.extra_matplotlib_settings)
+        if image_format == "png":
+            return f"<img src='{BLOB_STORE.content_url(output, 'png')}' {parsed_settings}/>"
+        return output.decode()
 
 
 @dataclass
@@ -821,12 +893,7 @@ class Download(PageContent):
         if not HAS_PILLOW or isinstance(image, str):
             return False, image
 
-        image_data = io.BytesIO()
-        image.save(image_data, format="PNG")
-        image_data.seek(0)
-        figure = base64.b64encode(image_data.getvalue()).decode('utf-8')
-        figure = f"data:image/png;base64,{figure}"
-        return True, figure
+        return True, BLOB_STORE.image_url(image)
 
     def __str__(self):
         was_pil, url = self._handle_pil_image(self.content)
@@ -0,0 +1,87 @@
+"""
+Compression of responses, negotiated with the browser's ``Accept-Encoding`` header.
+
+Drafter pages are very repetitive HTML, so they compress well. Pages are compressed as they are
+sent, if they are large enough to be worth it; theme assets (see ``drafter.assets``) are compressed
+once, the first time each encoding is requested, and the compressed bytes are reused after that.
+"""
+from typing import Optional, Dict, Iterable, Iterator
+import gzip
+
+# In order of preference, when the browser has no preference between them
+SUPPORTED_ENCODINGS = ('gzip', 'deflate')
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Chooses the best supported content encoding for an ``Accept-Encoding`` header.
+    Encodings with a quality of zero are refused, and ``*`` stands for any encoding
+    that was not otherwise mentioned.
+
+    :param accept_encoding: The value of the request's ``Accept-Encoding`` header, if any.
+    :return: Either ``gzip``, ``deflate``, or None if the response should not be compressed.
+    """
+    if not accept_encoding:
+        return None
+    qualities: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, parameters = part.strip().partition(";")
+        name = name.strip().lower()
+        quality = 1.0
+        parameters = parameters.strip()
+        if parameters.startswith("q="):
+            try:
+                quality = float(parameters[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            qualities[name] = quality
+    best, best_quality = None, 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data: bytes, encoding: str, level: int = 6) -> bytes:
+    """
+    Compresses the data with the given content encoding.
+
+    :param data: The uncompressed body of the response.
+    :param encoding: Either ``gzip`` or ``deflate``.
+    :param level: The compression level, from 1 (fastest) to 9 (smallest).
+    :return: The compressed body.
+    :raises ValueError: If the encoding is not supported.
+    """
+    if encoding == 'gzip':
+        # A fixed timestamp keeps the output the same for the same input
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if encoding == 'deflate':
+        import zlib
+        return zlib.compress(data, level)
+    raise ValueError(f"Unsupported content encoding {encoding!r}. Please choose from {', '.join(SUPPORTED_ENCODINGS)}.")
+
+
+
+def compress_iter(chunks: Iterable[bytes], encoding: str, level: int = 6) -> Iterator[bytes]:
+    """
+    Compresses a streamed response, chunk by chunk. Each chunk is flushed as soon as it is
+    compressed, so that the browser can start working on the page before the rest arrives.
+
+    :param chunks: The uncompressed chunks of the response body.
+    :param encoding: Either ``gzip`` or ``deflate``.
+    :param level: The compression level, from 1 (fastest) to 9 (smallest).
+    :return: An iterator of compressed chunks.
+    :raises ValueError: If the encoding is not supported.
+    """
+    import zlib
+    if encoding not in SUPPORTED_ENCODINGS:
+        raise ValueError(f"Unsupported content encoding {encoding!r}. Please choose from {', '.join(SUPPORTED_ENCODINGS)}.")
+    # The window bits choose between the gzip (16 + 15) and zlib (15) containers
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31 if encoding == 'gzip' else 15)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -42,6 +42,18 @@ class ServerConfiguration:
     :type reloader: bool
     :ivar skip: Whether to skip running the server, often used for testing purposes.
     :type skip: bool
+    :ivar workers: How many processes should handle requests, all sharing the same listening socket.
+    :type workers: int
+    :ivar threads: How many requests each process can handle at the same time.
+    :type threads: int
+    :ivar production: Whether the site is deployed for real visitors. No page or state history is kept
+        (so there is no debug information), pages are not pretty-printed for the history, the state's type
+        is not checked between pages, and warnings are logged instead of printed. Error pages are still shown.
+    :type production: bool
+    :ivar metrics: Whether request metrics are served in the Prometheus format at ``/--metrics`` (ignored in Skulpt).
+        Off unless turned on, since anyone who can reach the site could read them (including its route names,
+        error counts, and number of visitors); only turn it on where the endpoint is not public.
+    :type metrics: bool
 
     :ivar title: Title for the website server.
     :type title: str
@@ -60,8 +72,84 @@ class ServerConfiguration:
     :type src_image_folder: str
     :ivar save_uploaded_files: Whether uploaded files should be saved to storage.
     :type save_uploaded_files: bool
+    :ivar upload_max_request_size: Largest request (in bytes) that may be sent with uploaded files;
+        larger ones are refused as they arrive (zero for no limit).
+    :type upload_max_request_size: int
+    :ivar upload_max_file_size: Largest single uploaded file (in bytes; zero for no limit).
+    :type upload_max_file_size: int
+    :ivar upload_spool_size: Largest uploaded file (in bytes) kept in memory; bigger ones are moved
+        into temporary files as they arrive.
+    :type upload_spool_size: int
+    :ivar upload_hash: The ``hashlib`` algorithm that uploaded files are hashed with as they arrive
+        (empty for none).
+    :type upload_hash: str
     :ivar deploy_image_path: Path for deploying images (defaults vary based on Skulpt usage).
     :type deploy_image_path: str
+    :ivar inline_assets: Whether the theme's styles and scripts are inlined into every page. If False,
+        they are linked to content-hashed URLs under ``/--assets/`` that browsers can cache (ignored in Skulpt).
+    :type inline_assets: bool
+    :ivar inline_images: Whether PIL images are inlined into pages and states as encoded data. If False,
+        each distinct image is encoded once, served from a content-hashed URL under ``/--blobs/``, and
+        kept in the state as a short handle (always True in Skulpt).
+    :type inline_images: bool
+    :ivar blob_max_bytes: Largest total size of the images kept in memory; older ones are moved to disk.
+    :type blob_max_bytes: int
+    :ivar blob_path: The folder that images are written to as soon as they are stored, so that several
+        workers can share them. If empty, a temporary folder is only used for images moved out of memory,
+        and it is removed (with the images in it) when the server exits, so handles to those images in
+        saved states stop working after a restart. With more than one worker, images are inlined
+        (as with ``inline_images``) unless this is set.
+    :type blob_path: str
+    :ivar plot_cache_size: How many rendered ``MatPlotLibPlot`` figures are kept, so that drawing the
+        same figure again does not rasterize it again (zero for none).
+    :type plot_cache_size: int
+    :ivar plot_workers: How many processes rasterize ``MatPlotLibPlot`` figures, so that plotting does
+        not hold up other requests (zero to render on the request's thread; ignored in Skulpt and where
+        processes cannot be forked).
+    :type plot_workers: int
+    :ivar compression_level: How hard to compress pages and assets (1 to 9) for browsers that accept
+        gzip or deflate; zero turns compression off.
+    :type compression_level: int
+    :ivar compression_min_size: Smallest response (in bytes) that is worth compressing.
+    :type compression_min_size: int
+    :ivar stream_pages: Whether pages are sent in chunks as they are rendered, instead of all at once
+        (ignored in Skulpt).
+    :type stream_pages: bool
+    :ivar stream_chunk_size: Smallest chunk (in characters) of a streamed page that is sent at a time.
+    :type stream_chunk_size: int
+    :ivar debug_page_size: How many page loads are shown on each page of the debug information's history.
+    :type debug_page_size: int
+
+    :ivar history_max_entries: Most page and state history entries kept per session (zero for no limit).
+    :type history_max_entries: int
+    :ivar history_max_bytes: Largest estimated size of the page history kept per session (zero for no limit).
+    :type history_max_bytes: int
+    :ivar history_spill_path: If set, the file that page history entries are appended to (compressed)
+        once they are evicted from memory.
+    :type history_spill_path: str
+    :ivar history_keyframe_interval: How often the page history keeps a full copy of the state; the
+        states in between are kept as differences from the previous one (one for always full copies).
+    :type history_keyframe_interval: int
+
+    :ivar session_store: Where visitor sessions are kept, either "memory" or "sqlite".
+    :type session_store: str
+    :ivar session_path: Filename of the database used by the "sqlite" session store.
+    :type session_path: str
+    :ivar session_max_count: Most sessions kept by the "memory" session store (zero for no limit).
+    :type session_max_count: int
+    :ivar session_idle_timeout: Seconds of inactivity before a session expires (zero for never).
+    :type session_idle_timeout: float
+    :ivar state_secret: The key that state tokens are signed with. If empty, a random key is made
+        when the server starts, so tokens are only accepted by the process that made them.
+    :type state_secret: str
+    :ivar state_token_max_size: Largest state (in bytes of JSON) that a state token may expand into.
+    :type state_token_max_size: int
+    :ivar stateless: Whether every rendered page carries the state as a signed token in its form and
+        links, so that any worker (sharing the same ``state_secret``) can serve the next request.
+    :type stateless: bool
+    :ivar stateless_token_budget: Length (in characters) of a state token above which a warning is
+        shown in stateless mode, since very long links fail in some browsers and proxies (zero for none).
+    :type stateless_token_budget: int
 
     :ivar cdn_skulpt: CDN URL for accessing Skulpt library files.
     :type cdn_skulpt: str
@@ -82,6 +170,10 @@ class ServerConfiguration:
     # This makes the server not run (e.g., to only run tests)
     skip: bool = bool(os.environ.get('DRAFTER_SKIP', False))
     must_have_site_information: bool = bool(os.environ.get('DRAFTER_MUST_HAVE_SITE_INFORMATION', False))
+    workers: int = int(os.environ.get('DRAFTER_WORKERS', 1))
+    threads: int = int(os.environ.get('DRAFTER_THREADS', 1))
+    production: bool = bool(os.environ.get('DRAFTER_PRODUCTION', False))
+    metrics: bool = bool(os.environ.get('DRAFTER_METRICS', False))
 
     # Website configuration
     title: str = "Drafter Website"
@@ -95,7 +187,38 @@ class ServerConfiguration:
     additional_css_content: List[str] = field(default_factory=list)
     src_image_folder: str = ''
     save_uploaded_files: bool = not skulpt
+    upload_max_request_size: int = int(os.environ.get('DRAFTER_UPLOAD_MAX_REQUEST_SIZE', 1024 * 1024 * 1024))
+    upload_max_file_size: int = int(os.environ.get('DRAFTER_UPLOAD_MAX_FILE_SIZE', 0))
+    upload_spool_size: int = 1024 * 1024
+    upload_hash: str = 'sha256'
     deploy_image_path: str = os.environ.get('DRAFTER_DEPLOY_IMAGE_PATH', './' if skulpt else 'images')
+    inline_assets: bool = not os.environ.get('DRAFTER_EXTERNAL_ASSETS', False)
+    inline_images: bool = bool(os.environ.get('DRAFTER_INLINE_IMAGES', False))
+    blob_max_bytes: int = 64 * 1024 * 1024
+    blob_path: str = os.environ.get('DRAFTER_BLOB_PATH', '')
+    plot_cache_size: int = 128
+    plot_workers: int = int(os.environ.get('DRAFTER_PLOT_WORKERS', 0))
+    compression_level: int = 6
+    compression_min_size: int = 1024
+    stream_pages: bool = bool(os.environ.get('DRAFTER_STREAM_PAGES', False))
+    stream_chunk_size: int = 16 * 1024
+    debug_page_size: int = 20
+
+    # History configuration
+    history_max_entries: int = 1000
+    history_max_bytes: int = 0
+    history_spill_path: str = os.environ.get('DRAFTER_HISTORY_SPILL_PATH', '')
+    history_keyframe_interval: int = 32
+
+    # Session configuration
+    session_store: str = os.environ.get('DRAFTER_SESSION_STORE', 'memory')
+    session_path: str = os.environ.get('DRAFTER_SESSION_PATH', 'drafter_sessions.sqlite3')
+    session_max_count: int = 1000
+    session_idle_timeout: float = 60 * 60
+    state_secret: str = os.environ.get('DRAFTER_STATE_SECRET', '')
+    state_token_max_size: int = 16 * 1024 * 1024
+    stateless: bool = bool(os.environ.get('DRAFTER_STATELESS', False))
+    stateless_token_budget: int = 8 * 1024
 
     # Test Deployment CDN configurations
     cdn_skulpt: str = os.environ.get("DRAFTER_CDN_SKULPT", "https://drafter-edu.github.io/drafter-cdn/skulpt/skulpt.js")
@@ -2,7 +2,9 @@
 Constants that are used throughout the project.
 """
 RESTORABLE_STATE_KEY = "--restorable-state"
+RESTORABLE_HISTORY_KEY = "--restore-history"
 SUBMIT_BUTTON_KEY = '--submit-button'
 PREVIOUSLY_PRESSED_BUTTON = "--last-button"
 LABEL_SEPARATOR = "$@~@$"
 JSON_DECODE_SYMBOL = "$@JSON~@$"
+SESSION_COOKIE_KEY = "drafter-session"
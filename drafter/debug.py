@@ -1,15 +1,46 @@
-from dataclasses import dataclass, is_dataclass
-from typing import Any, Callable, List, Tuple, Dict
+from dataclasses import dataclass, is_dataclass, field
+from typing import Any, Callable, List, Tuple, Dict, Optional
 import inspect
 import html
+import json
 
-from drafter.constants import RESTORABLE_STATE_KEY, PREVIOUSLY_PRESSED_BUTTON
-from drafter.history import ConversionRecord, VisitedPage, format_page_content, make_value_expandable, safe_repr
+from drafter.constants import RESTORABLE_HISTORY_KEY, PREVIOUSLY_PRESSED_BUTTON
+from drafter.history import ConversionRecord, VisitedPage, HistoryBuffer, format_page_content, make_value_expandable, \
+    safe_repr
 from drafter.page import Page
 from drafter.urls import merge_url_query_params
 from drafter.testing import bakery, _bakery_tests, DIFF_WRAP_WIDTH, diff_tests
 from drafter.components import Table
 from drafter.configuration import ServerConfiguration
+from drafter.timing import format_timings_html
+from drafter.snapshots import restore_snapshot
+
+# Loads each section of the debug placeholder from the server the first time it is opened,
+# and the pages of the page load history when their links are clicked.
+DEBUG_LOADER_SCRIPT = """<script>
+(function () {
+    document.querySelectorAll('[data-debug-section]').forEach(function (section) {
+        var body = section.querySelector('.btlw-debug-body');
+        var url = '/--debug/' + section.dataset.debugSection;
+        function load(query) {
+            body.dataset.loaded = 'true';
+            fetch(url + query, {credentials: 'same-origin'})
+                .then(function (response) { return response.text(); })
+                .then(function (html) { body.innerHTML = html; });
+        }
+        section.addEventListener('toggle', function () {
+            if (section.open && !body.dataset.loaded) { load(''); }
+        });
+        body.addEventListener('click', function (event) {
+            var link = event.target.closest('[data-debug-page]');
+            if (link) {
+                event.preventDefault();
+                load('?page=' + link.dataset.debugPage);
+            }
+        });
+    });
+})();
+</script>"""
 
 @dataclass
 class DebugInformation:
@@ -22,8 +53,9 @@ class DebugInformation:
     state of the server, the history of page loads, available routes, and test statuses.
     Additionally, it outlines server configuration details and deployment settings.
 
-    :ivar page_history: List of tuples where each tuple contains a `VisitedPage` instance
-        representing a visited page and its associated state.
+    :ivar page_history: List (or ``HistoryBuffer``) of tuples where each tuple contains a `VisitedPage`
+        instance representing a visited page and its associated state. Only the retained window of
+        the history is shown.
     :type page_history: List[Tuple[VisitedPage, Any]]
     :ivar state: The current state of the application.
     :type state: Any
@@ -34,23 +66,43 @@ class DebugInformation:
     :type conversion_record: List[ConversionRecord]
     :ivar configuration: Server configuration holding deployment and runtime configuration details.
     :type configuration: ServerConfiguration
+    :ivar route_plans: The precompiled plan of each route function, used to list their parameters.
+    :type route_plans: Dict[Callable, RoutePlan]
+    :ivar share_state: Makes a link to the current page that restores the current state, if available.
+    :type share_state: Optional[Callable[[], str]]
     """
     page_history: List[Tuple[VisitedPage, Any]]
     state: Any
     routes: Dict[str, Callable]
     conversion_record: List[ConversionRecord]
     configuration: ServerConfiguration
+    route_plans: Dict[Callable, Any] = field(default_factory=dict)
+    share_state: Optional[Callable[[], str]] = None
 
     INDENTATION_START_HTML = "<div class='row'><div class='one column'></div><div class='eleven columns'>"
     INDENTATION_END_HTML = "</div></div>"
 
-    def generate(self):
+    # Each section of the debug panel: its name (as used in the ``/--debug/<section>`` URL),
+    # its title, whether it starts open, and the method that renders its body.
+    # Sections that start open are rendered with the page, so only cheap ones should.
+    SECTIONS = [
+        ("route", "Current Route", True, "current_route"),
+        ("state", "Current State", False, "current_state"),
+        ("routes", "Available Routes", False, "available_routes"),
+        ("history", "Page Load History", False, "page_load_history"),
+        ("combined", "Combined Page History", False, "copy_all_page_history"),
+        ("tests", "Test Status", False, "test_status"),
+        ("configuration", "Configuration", False, "test_deployment"),
+    ]
+
+    def generate(self, page: int = 0):
         """
         Generates an HTML string containing debug information for the current system state. The generated
         debug information includes details about the current route, system state, available routes, page
         load history, test status, and test deployment. The HTML content is wrapped within a `<div>` element
         with the class `btlw-debug`.
 
+        :param page: Which page of the page load history to show (the newest entries are on page zero).
         :return: An HTML string composed of debug information for the current system state.
         :rtype: str
         """
@@ -58,16 +110,60 @@ class DebugInformation:
             "<div class='btlw-debug'>",
             "<h3>Debug Information</h3>",
             "<em>To hide this information, call <code>hide_debug_information()</code> in your code.</em><br>",
-            *self.current_route(),
-            *self.current_state(),
-            *self.available_routes(),
-            *self.page_load_history(),
-            *self.test_status(),
-            *self.test_deployment(),
-            "</div>"
         ]
+        for name, title, is_open, _ in self.SECTIONS:
+            parts.append(f"<details{' open' if is_open else ''}><summary><strong>{title}</strong></summary>")
+            parts.append(self.INDENTATION_START_HTML)
+            parts.extend(self.section(name, page))
+            parts.append(f"{self.INDENTATION_END_HTML}</details>")
+        parts.append("</div>")
         return "\n".join(parts)
 
+    def placeholder(self):
+        """
+        Generates the small stand-in for the debug information that goes at the bottom of every page.
+        Sections that start open are rendered right away; every other section is loaded from the
+        ``/--debug/<section>`` endpoint the first time it is opened, so the cost of a page does not
+        grow with the length of the page load history.
+
+        :return: An HTML string with a collapsible element for each section.
+        :rtype: str
+        """
+        parts = [
+            "<div class='btlw-debug'>",
+            "<h3>Debug Information</h3>",
+            "<em>To hide this information, call <code>hide_debug_information()</code> in your code.</em> "
+            "<a href='/--debug' target=_blank>Open in a new tab</a><br>",
+        ]
+        for name, title, is_open, _ in self.SECTIONS:
+            if is_open:
+                body = f"<div class='btlw-debug-body' data-loaded='true'>{''.join(self.section(name))}</div>"
+            else:
+                body = "<div class='btlw-debug-body'><em>Loading...</em></div>"
+            parts.append(f"<details{' open' if is_open else ''} data-debug-section='{name}'>"
+                         f"<summary><strong>{title}</strong></summary>"
+                         f"{self.INDENTATION_START_HTML}{body}{self.INDENTATION_END_HTML}</details>")
+        parts.append(DEBUG_LOADER_SCRIPT)
+        parts.append("</div>")
+        return "\n".join(parts)
+
+    def section(self, name: str, page: int = 0):
+        """
+        Renders the body of a single section of the debug information.
+
+        :param name: The name of the section (e.g., ``history``).
+        :param page: Which page of the page load history to show, if this is the history section.
+        :return: A generator that yields HTML content for the section.
+        :rtype: Iterator[str]
+        :raises KeyError: If there is no section with that name.
+        """
+        for section_name, _, _, method in self.SECTIONS:
+            if section_name == name:
+                if name == "history":
+                    return self.page_load_history(page)
+                return getattr(self, method)()
+        raise KeyError(name)
+
     def current_route(self):
         """
         Generates a sequence of HTML content describing the current routing state
@@ -86,7 +182,7 @@ class DebugInformation:
         if not self.page_history:
             yield "Currently no pages have been successfully visited."
         else:
-            yield self.page_history[-1][0].as_html()
+            yield self.visit_at(-1).as_html()
         yield f"<br>"
         non_state_parameters = [record for record in self.conversion_record if record.parameter != 'state']
         if non_state_parameters:
@@ -116,13 +212,17 @@ class DebugInformation:
 
         """
         # Current State
-        yield "<details open><summary><strong>Current State</strong></summary>"
-        yield f"{self.INDENTATION_START_HTML}"
         if self.state is not None:
             yield self.render_state(self.state)
         else:
             yield "<code>None</code>"
-        yield f"{self.INDENTATION_END_HTML}</details>"
+        if self.share_state is not None:
+            try:
+                link = self.share_state()
+            except Exception:
+                # States that cannot be serialized are already reported elsewhere
+                return
+            yield f"<br><a href='{html.escape(link)}'>Link to this page with this state</a>"
 
     def available_routes(self):
         """
@@ -132,17 +232,17 @@ class DebugInformation:
         functions and their parameters in the `routes` dictionary. It formats each route as a list
         item with its corresponding callable function and parameters. Routes that have no parameters
         are formatted as clickable links pointing to the route path. The output is returned as
-        HTML-rendered lines suitable for detailed documentation display.
+        HTML-rendered lines suitable for detailed documentation display. The parameter names come
+        from the precompiled route plans when they are available.
 
         :returns: HTML-formatted strings representing available routes and their metadata.
         :rtype: Iterator[str]
         """
         # Routes
-        yield f"<details open><summary><strong>Available Routes</strong></summary>"
-        yield f"{self.INDENTATION_START_HTML}"
         yield f"<ul>"
         for original_route, function in self.routes.items():
-            parameter_list = inspect.signature(function).parameters.keys()
+            plan = self.route_plans.get(function)
+            parameter_list = plan.names if plan is not None else list(inspect.signature(function).parameters.keys())
             parameters = ", ".join(parameter_list)
             if original_route != '/':
                 original_route += '/'
@@ -151,73 +251,90 @@ class DebugInformation:
             if len(parameter_list) == 1:
                 call = f"<a href='{original_route}'>{call}</a>"
             yield f"<li>{route}: <code>{call}</code></li>"
-        yield f"</ul>{self.INDENTATION_END_HTML}</details>"
+        yield f"</ul>"
 
-    def page_load_history(self):
+    def page_load_history(self, page: int = 0):
         """
         Generates HTML content listing the history of web page loads including related details, such as
         the button actions, function calls, URLs, and page content. Each step is presented in an
         expandable/collapsible structure for better visualization.
 
+        Only one page of the history is shown at a time (the newest entries first), with links to
+        the newer and older pages, so the cost does not grow with the length of the history.
+
+        :param page: Which page of the history to show, starting from zero.
         :returns: A generator that yields strings representing segments of an HTML document formatted
             with the history details.
         :rtype: Iterator[str]
         """
         # Page History
-        yield "<details open><summary><strong>Page Load History</strong></summary><ol>"
-        all_visits = set()
-        for page_history, old_state in reversed(self.page_history):
+        page_size = max(1, self.configuration.debug_page_size)
+        total = len(self.page_history)
+        first = max(0, page) * page_size
+        last = min(first + page_size, total)
+        evicted = getattr(self.page_history, 'evicted', 0)
+        yield f"<ol start='{first + 1}'>"
+        for offset in range(first, last):
+            page_history = self.visit_at(total - 1 - offset)
             button_pressed = f"Clicked <code>{page_history.button_pressed}</code> &rarr; " if page_history.button_pressed else ""
+            # The state is only looked up (and reconstructed) by the server when the link is opened
             url = merge_url_query_params(page_history.url, {
-                RESTORABLE_STATE_KEY: old_state,
-                PREVIOUSLY_PRESSED_BUTTON: page_history.button_pressed
+                RESTORABLE_HISTORY_KEY: str(evicted + total - 1 - offset),
+                PREVIOUSLY_PRESSED_BUTTON: json.dumps(page_history.button_pressed)
             })
             yield f"<li>{button_pressed}{page_history.status}"  # <details><summary>
             yield f"{self.INDENTATION_START_HTML}"
             yield f"URL: <a href='{url}'><code>{page_history.url}/</code></a><br>"
             call = f"{page_history.function.__name__}({page_history.arguments})"
             yield f"Call: <code>{call}</code><br>"
+            if page_history.timings:
+                yield f"{format_timings_html(page_history.timings)}<br>"
+            if page_history.state_snapshot is not None:
+                yield f"<details><summary>Resulting State:</summary>"
+                yield f"{self.render_state(restore_snapshot(page_history.state_snapshot))}</details>"
             yield f"<details><summary>Page Content:</summary><pre style='width: fit-content' class='copyable'>"
             full_code = f"assert_equal(\n {call},\n {page_history.original_page_content})"
-            all_visits.add(full_code)
             yield f"<code>{full_code}</code></pre></details>"
             yield f"{self.INDENTATION_END_HTML}"
             yield f"</li>"
+        if evicted and last >= total:
+            yield f"<li><em>{evicted} earlier page loads are no longer kept in the history.</em></li>"
         yield "</ol>"
-        for part in self.copy_all_page_history(all_visits):
-            yield part
-        yield "</details>"
+        if page > 0:
+            yield f"<a href='/--debug?page={page - 1}' data-debug-page='{page - 1}'>&larr; Newer</a> "
+        if last < total:
+            yield f"<a href='/--debug?page={page + 1}' data-debug-page='{page + 1}'>Older &rarr;</a>"
 
-    def copy_all_page_history(self, all_visits):
+    def visit_at(self, index: int) -> VisitedPage:
         """
-        Copies and formats the entire history of all page visits into a structured HTML
-        representation, combining them within a collapsible details element for display.
+        Gets a visited page from the page history, without reconstructing the state stored with it.
 
-        This function yields formatted HTML elements suitable for embedding in web pages
-        or other HTML-based interfaces. The page history provided as input is processed
-        and rendered into a human-readable format enclosed in a collapsible container.
+        :param index: The position of the entry in the page history.
+        :return: The visited page.
+        """
+        if isinstance(self.page_history, HistoryBuffer):
+            return self.page_history.stored(index)[0]
+        return self.page_history[index][0]
 
-        :param all_visits: The list of strings where each string represents individual
-            page visit details to be combined and formatted for rendering.
-        :type all_visits: list of str
+    def copy_all_page_history(self):
+        """
+        Copies and formats the entire history of all page visits into a structured HTML
+        representation, ready to be copied into tests.
 
         :return: Yields strings of HTML elements representing the formatted and combined
             page history.
         :rtype: Iterator[str]
         """
-        yield "<details><summary><strong>Combined Page History</strong></summary>"
-        yield f"{self.INDENTATION_START_HTML}"
+        visits = (self.visit_at(index) for index in range(len(self.page_history)))
+        all_visits = {f"assert_equal(\n {visit.function.__name__}({visit.arguments}),\n {visit.original_page_content})"
+                      for visit in visits}
         yield "<pre style='width: fit-content' class='copyable'><code>" + "\n\n".join(all_visits) + "</code></pre>"
-        yield f"{self.INDENTATION_END_HTML}"
-        yield "</details>"
 
     def test_status(self):
         if bakery is None and _bakery_tests.tests:
             yield ""
         else:
             if _bakery_tests.tests:
-                yield "<details open><summary><strong>Test Status</strong></summary>"
-                yield f"{self.INDENTATION_START_HTML}"
                 yield "<ul>"
                 for test_case in _bakery_tests.tests:
                     if len(test_case.args) == 2:
@@ -234,8 +351,6 @@ class DebugInformation:
                                              "Your function returned",
                                              "But the test expected")
                 yield "</ul>"
-                yield f"{self.INDENTATION_END_HTML}"
-                yield "</details>"
             else:
                 yield "<div><strong>No Tests</strong></div>"
 
@@ -250,10 +365,8 @@ class DebugInformation:
 
     def test_deployment(self):
         if self.configuration.skulpt:
-            yield "<strong>Configuration</strong>"
             yield f"<p>Running on Skulpt.</p>"
         else:
-            yield "<strong>Configuration</strong>"
             yield f"<div>Running on {self.configuration.backend}.</div>"
             yield f"""<details><summary>Configuration Details</summary><pre>
 Host: {self.configuration.host}
@@ -0,0 +1,213 @@
+"""
+Delta-encoded storage for the states kept in the page history.
+
+Every page history entry keeps the (JSON) state from before the visit, so that it can be restored
+later. Consecutive states usually differ in only a few fields, so storing each of them in full
+mostly stores the same text over and over. A ``DeltaHistoryBuffer`` instead keeps a full copy (a
+keyframe) of every ``keyframe_interval``-th state, and only the differences from the previous state
+for the ones in between. A state is reconstructed when it is needed (e.g., when a history link in
+the debug information is opened) by applying the differences since the nearest keyframe.
+
+Differences are computed between the decoded JSON values, and are themselves stored as JSON text.
+A difference (a "patch") is one of:
+
+* ``[value]``: the value was replaced by ``value``.
+* ``{"d": {key: patch, ...}, "r": [key, ...]}``: a dictionary, with the given keys changed (or
+  added), and the ``r`` keys removed.
+* ``{"i": [[index, patch], ...], "n": length, "t": [value, ...]}``: a list, with the given items
+  changed, cut to ``length`` items, and then extended by the ``t`` values.
+"""
+import json
+from typing import Any, Callable, List, Optional
+
+from drafter.history import HistoryBuffer
+
+
+def diff_json(old, new):
+    """
+    Finds the difference between two JSON values (as decoded by ``json.loads``).
+
+    :param old: The earlier value.
+    :param new: The later value.
+    :return: A patch that turns ``old`` into ``new`` (see the module documentation), or ``None``
+        if they are the same.
+    """
+    if old.__class__ is not new.__class__:
+        return [new]
+    if isinstance(new, dict):
+        changed = {}
+        for key, value in new.items():
+            if key in old:
+                patch = diff_json(old[key], value)
+                if patch is not None:
+                    changed[key] = patch
+            else:
+                changed[key] = [value]
+        removed = [key for key in old if key not in new]
+        if not changed and not removed:
+            return None
+        patch = {"d": changed}
+        if removed:
+            patch["r"] = removed
+        return patch
+    if isinstance(new, list):
+        common = min(len(old), len(new))
+        items = []
+        for index in range(common):
+            patch = diff_json(old[index], new[index])
+            if patch is not None:
+                items.append([index, patch])
+        if not items and len(old) == len(new):
+            return None
+        patch = {"i": items, "n": common}
+        if len(new) > common:
+            patch["t"] = new[common:]
+        # A patch that changes most of the list is no smaller than the list itself
+        return patch if len(items) * 2 <= common else [new]
+    return None if old == new else [new]
+
+
+def patch_json(value, patch):
+    """
+    Applies a patch made by ``diff_json``. Dictionaries and lists are changed in place.
+
+    :param value: The earlier value.
+    :param patch: The patch, or ``None`` for no changes.
+    :return: The later value.
+    """
+    if patch is None:
+        return value
+    if isinstance(patch, list):
+        return patch[0]
+    if "d" in patch:
+        for key in patch.get("r", ()):
+            del value[key]
+        for key, change in patch["d"].items():
+            value[key] = patch_json(value.get(key), change)
+        return value
+    for index, change in patch["i"]:
+        value[index] = patch_json(value[index], change)
+    del value[patch["n"]:]
+    value.extend(patch.get("t", ()))
+    return value
+
+
+class StateDelta:
+    """
+    A state kept as the difference from the state before it, as JSON text.
+
+    :ivar patch: The JSON text of the patch (see ``diff_json``).
+    :type patch: str
+    """
+    __slots__ = ('patch',)
+
+    def __init__(self, patch: str):
+        self.patch = patch
+
+    def __len__(self):
+        return len(self.patch)
+
+    def __repr__(self):
+        return f"StateDelta({self.patch!r})"
+
+
+class DeltaHistoryBuffer(HistoryBuffer):
+    """
+    A ``HistoryBuffer`` of page history entries (pairs of a visited page and the JSON state from
+    before the visit) that keeps most of the states as differences from the previous one. Reading
+    an entry (by index or by iterating) gives back the pair with the full state, as if it had been
+    stored as it was.
+
+    The oldest entry that is kept is always a keyframe: when it is evicted, the entry after it is
+    reconstructed and stored in full instead.
+
+    :param max_entries: The most entries to keep; zero (or less) means no limit.
+    :param max_bytes: The largest total size of the entries to keep; zero (or less) means no limit.
+    :param sizer: Function estimating the size of an (encoded) entry in bytes.
+    :param keyframe_interval: Store every state in full after this many entries.
+    """
+
+    def __init__(self, max_entries: int = 0, max_bytes: int = 0, sizer: Optional[Callable[[Any], int]] = None,
+                 keyframe_interval: int = 32):
+        super().__init__(max_entries, max_bytes, sizer)
+        self.keyframe_interval = max(1, keyframe_interval)
+        self._since_keyframe = 0
+        self._last_state: Any = None
+        self._last_data: Any = None
+
+    def append(self, entry) -> List[Any]:
+        visit, state = entry
+        encoded = state
+        if state is not None and self._last_state is not None and self._since_keyframe + 1 < self.keyframe_interval:
+            data = json.loads(state)
+            encoded = StateDelta(json.dumps(diff_json(self._last_data, data)))
+            self._since_keyframe += 1
+        else:
+            data = json.loads(state) if state is not None else None
+            self._since_keyframe = 0
+        self._last_state, self._last_data = state, data
+        return super().append((visit, encoded))
+
+    def _evict(self) -> List[Any]:
+        evicted = []
+        while len(self._entries) > 1 and (
+                (0 < self.max_entries < len(self._entries)) or
+                (0 < self.max_bytes < self.total_bytes)):
+            visit, state = self._entries.popleft()
+            self.total_bytes -= self._sizes.popleft()
+            evicted.append((visit, state))
+            following, delta = self._entries[0]
+            if isinstance(delta, StateDelta):
+                # Make the new oldest entry a keyframe, since the one it depends on is gone
+                self._entries[0] = (following, json.dumps(patch_json(json.loads(state), json.loads(delta.patch))))
+                size = self.sizer(self._entries[0]) if self.max_bytes > 0 else 0
+                self.total_bytes += size - self._sizes[0]
+                self._sizes[0] = size
+        self.evicted += len(evicted)
+        return evicted
+
+    def clear(self):
+        super().clear()
+        self._since_keyframe = 0
+        self._last_state = self._last_data = None
+
+    def state_at(self, index: int) -> Optional[str]:
+        """
+        Reconstructs the state of a single entry, starting from the nearest keyframe before it.
+
+        :param index: The position of the entry (negative numbers count from the newest).
+        :return: The JSON state stored with the entry.
+        :raises IndexError: If there is no such entry.
+        """
+        if index < 0:
+            index += len(self._entries)
+        if not 0 <= index < len(self._entries):
+            raise IndexError("history index out of range")
+        start = index
+        while isinstance(self._entries[start][1], StateDelta):
+            start -= 1
+        if start == index:
+            return self._entries[index][1]
+        data = json.loads(self._entries[start][1])
+        for position in range(start + 1, index + 1):
+            data = patch_json(data, json.loads(self._entries[position][1].patch))
+        return json.dumps(data)
+
+    def __getitem__(self, index):
+        return self._entries[index][0], self.state_at(index)
+
+    def __iter__(self):
+        data = None
+        for visit, state in self._entries:
+            if isinstance(state, StateDelta):
+                data = patch_json(data, json.loads(state.patch))
+                yield visit, json.dumps(data)
+            else:
+                data = json.loads(state) if state is not None else None
+                yield visit, state
+
+    def __reversed__(self):
+        return reversed(list(self))
+
+    def __repr__(self):
+        return f"DeltaHistoryBuffer({list(self._entries)!r})"
@@ -25,6 +25,7 @@ def set_website_title(title: str):
     :param title: The title of the website.
     """
     MAIN_SERVER.configuration.title = title
+    MAIN_SERVER.configuration_changed()
 
 
 def set_website_framed(framed: bool):
@@ -73,6 +74,7 @@ def set_website_style(style: Optional[str]):
     if style is None:
         style = "none"
     MAIN_SERVER.configuration.style = style
+    MAIN_SERVER.configuration_changed()
 
 
 def add_website_header(header: str):
@@ -83,6 +85,7 @@ def add_website_header(header: str):
     :param header: The raw header content to add. This will not be wrapped in additional tags.
     """
     MAIN_SERVER.configuration.additional_header_content.append(header)
+    MAIN_SERVER.configuration_changed()
 
 
 def add_website_css(selector: str, css: Optional[str] = None):
@@ -100,17 +103,18 @@ def add_website_css(selector: str, css: Optional[str] = None):
         MAIN_SERVER.configuration.additional_css_content.append(selector+"\n")
     else:
         MAIN_SERVER.configuration.additional_css_content.append(f"{selector} {{{css}}}\n")
+    MAIN_SERVER.configuration_changed()
 
 
 def deploy_site(image_folder='images'):
     """
-    Deploys the website with the given image folder. This will set the production
-    flag to True and turn off debug information, too.
+    Deploys the website with the given image folder. This will turn on production mode
+    (see ``ServerConfiguration.production``) and turn off debug information, too.
 
     :param image_folder: The folder where images are stored.
     """
     hide_debug_information()
-    MAIN_SERVER.production = True
+    MAIN_SERVER.configuration.production = True
     MAIN_SERVER.image_folder = image_folder
 
 def set_image_path(image_folder='./'):
@@ -1,21 +1,28 @@
 import json
 import html
 import base64
+import gzip
 import os
 import io
+from collections import deque
 from urllib.parse import unquote
 from dataclasses import dataclass, is_dataclass, replace, asdict, fields
 from dataclasses import field as dataclass_field
 from datetime import timezone, timedelta, datetime
-from typing import Any, Optional, Callable, Dict
+from typing import Any, Optional, Callable, Dict, List, Iterator
 import pprint
+import logging
 
 from drafter.constants import LABEL_SEPARATOR, JSON_DECODE_SYMBOL
 from drafter.setup import request
 from drafter.testing import DIFF_INDENT_WIDTH
 from drafter.image_support import HAS_PILLOW, PILImage
+from drafter.blobs import BLOB_STORE
+from drafter.sessions import RLock
 
 
+logger = logging.getLogger('drafter')
+
 timezone_UTC = timezone(timedelta(0))
 
 
@@ -35,44 +42,115 @@ def is_generator(iterable):
 
 # TODO: If no filename data, then could dump base64 representation or something? tobytes perhaps?
 
-def safe_repr(value: Any, handled=None):
-    obj_id = id(value)
-    if handled is None:
-        handled = set()
-    else:
-        handled = set(handled)
-    if obj_id in handled:
-        return f"<strong>Circular Reference</strong>"
+def fold_structure(value, expand: Callable[[Any], tuple], on_cycle: Callable[[Any], Any], path=None):
+    """
+    Walks a nested structure (lists, dictionaries, dataclasses, ...) and combines the results of
+    its parts from the bottom up. This is the traversal behind ``safe_repr``, ``dehydrate_json``,
+    and ``dump_json``.
+
+    The walk keeps an explicit stack instead of recursing, so deeply nested structures do not hit
+    Python's recursion limit. Circular references are detected by tracking the containers on the
+    path from the root to the current value, adding each container when it is entered and removing
+    it when it is finished, so the whole walk takes time proportional to the size of the structure.
+    A value that appears in several places (but does not contain itself) is not a cycle.
+
+    :param value: The structure to walk.
+    :param expand: Called on each value. For a leaf, returns ``(None, result)``; for a container,
+        returns ``(children, finish)``, where ``children`` is a sized collection of the values inside
+        it, and ``finish`` turns the list of their results into the container's result.
+    :param on_cycle: Called with a container that (indirectly) contains itself, instead of
+        walking it again; returns its result, or raises an exception.
+    :param path: The ids of any containers that are already being walked (e.g., by a caller).
+    :return: The result for the whole structure.
+    """
+    path = set(path) if path else set()
+    children, finish = expand(value)
+    if children is None:
+        return finish
+    if id(value) in path:
+        return on_cycle(value)
+    # Each frame is (container, iterator over its children, results so far, finish)
+    path.add(id(value))
+    frames = [(value, iter(children), [], finish)]
+    while True:
+        container, remaining, results, finish_container = frames[-1]
+        append = results.append
+        for child in remaining:
+            children, finish = expand(child)
+            if children is None:
+                append(finish)
+            elif id(child) in path:
+                append(on_cycle(child))
+            elif not children:
+                append(finish([]))
+            else:
+                # Descend; this frame's loop resumes from the next child once the new one is finished
+                path.add(id(child))
+                frames.append((child, iter(children), [], finish))
+                break
+        else:
+            frames.pop()
+            path.discard(id(container))
+            result = finish_container(results)
+            if not frames:
+                return result
+            frames[-1][2].append(result)
+
+
+_FIELD_NAMES: Dict[type, tuple] = {}
+
+
+def field_names(value) -> tuple:
+    """ The names of a dataclass instance's fields, looked up once per class. """
+    names = _FIELD_NAMES.get(value.__class__)
+    if names is None:
+        names = _FIELD_NAMES[value.__class__] = tuple(f.name for f in fields(value))
+    return names
+
+
+def pair_up(results: list) -> list:
+    """ Groups a flat list of dictionary keys and values (as expanded by ``fold_structure``) into pairs. """
+    return list(zip(results[::2], results[1::2]))
+
+
+def flatten_items(value: dict) -> list:
+    """ Flattens a dictionary's items into a list of keys and values, for ``fold_structure``. """
+    children = []
+    for key, item in value.items():
+        children.append(key)
+        children.append(item)
+    return children
+
+
+def expand_for_repr(value):
     if isinstance(value, (int, float, bool, type(None), str, bytes, complex, bytearray)):
-        return make_value_expandable(html.escape(repr(value)))
+        return None, make_value_expandable(html.escape(repr(value)))
     if isinstance(value, list):
-        handled.add(obj_id)
-        return f"[{', '.join(safe_repr(v, handled) for v in value)}]"
+        return value, lambda parts: f"[{', '.join(parts)}]"
     if isinstance(value, dict):
-        handled.add(obj_id)
-        return f"{{{', '.join(f'{safe_repr(k, handled)}: {safe_repr(v, handled)}' for k, v in value.items())}}}"
+        return flatten_items(value), lambda parts: f"{{{', '.join(f'{k}: {v}' for k, v in pair_up(parts))}}}"
     if is_dataclass(value):
-        handled.add(obj_id)
-        fields_repr = ', '.join(f'{f.name}={safe_repr(getattr(value, f.name), handled)}' for f in fields(value))
-        return f"{value.__class__.__name__}({fields_repr})"
+        names = field_names(value)
+        class_name = value.__class__.__name__
+        return ([getattr(value, name) for name in names],
+                lambda parts: f"{class_name}({', '.join(f'{name}={part}' for name, part in zip(names, parts))})")
     if isinstance(value, set):
-        handled.add(obj_id)
-        return f"{{{', '.join(safe_repr(v, handled) for v in value)}}}"
+        return value, lambda parts: f"{{{', '.join(parts)}}}"
     if isinstance(value, tuple):
-        handled.add(obj_id)
-        return f"({', '.join(safe_repr(v, handled) for v in value)})"
+        return value, lambda parts: f"({', '.join(parts)})"
     if isinstance(value, (frozenset, range, )):
-        handled.add(obj_id)
-        args_repr = ', '.join(safe_repr(v, handled) for v in value)
-        return f"{value.__class__.__name__}({{{args_repr}}})"
+        class_name = value.__class__.__name__
+        return value, lambda parts: f"{class_name}({{{', '.join(parts)}}})"
 
     if HAS_PILLOW and isinstance(value, PILImage.Image):
-        return repr_pil_image(value)
+        return None, repr_pil_image(value)
 
     # TODO: How should we handle custom things like dict_keys, numpy arrays, etc?
+    return None, make_value_expandable(html.escape(repr(value)))
 
-    # TODO: Handle the recursive case of a list/dictionary/dataclass with images inside
-    return make_value_expandable(html.escape(repr(value)))
+
+def safe_repr(value: Any, handled=None):
+    return fold_structure(value, expand_for_repr, lambda cycle: f"<strong>Circular Reference</strong>", handled)
 
 
 
@@ -80,6 +158,9 @@ def repr_pil_image(value):
     from drafter.server import get_server_setting
     filename = value.filename if hasattr(value, 'filename') else None
     if not filename:
+        if BLOB_STORE.enabled:
+            width, height = value.size
+            return f"<img src={BLOB_STORE.image_url(value)} alt='A {width}x{height} image' />"
         # TODO: Make sure that the imports are provided to the student
         image_data = base64.b64encode(image_to_bytes(value)).decode('latin1')
         image_src = f"data:image/png;base64,{image_data}"
@@ -88,20 +169,19 @@ def repr_pil_image(value):
         return f"<img src={image_src} alt='{full_call}' />"
     try:
         # If the file does not already exist, persist it to the image folder
-        print("Folder:", get_server_setting("src_image_folder"))
-        print("Filename:", filename)
+        logger.debug("Saving image %s to folder %s", filename, get_server_setting("src_image_folder"))
         full_path = os.path.join(get_server_setting("src_image_folder"), filename)
         if get_server_setting("save_uploaded_files"):
             if not os.path.exists(full_path):
                 value.save(full_path)
     except Exception as e:
-        print(f"Could not save {value!r} because", e)
+        logger.warning("Could not save %r because %s", value, e)
         return f"Image.open('?')"
     try:
         escaped_name = json.dumps(full_path)
         return f"<img src={escaped_name} alt='Image.open({escaped_name})' />"
     except AttributeError as e:
-        print(f"Could not get filename for {value!r} because", e)
+        logger.warning("Could not get filename for %r because %s", value, e)
         return f"Image.open('?')"
 
 
@@ -208,6 +288,10 @@ class VisitedPage:
     old_state: Any = None
     started: datetime = dataclass_field(default_factory=lambda:datetime.now(timezone_UTC))
     stopped: Optional[datetime] = None
+    # Milliseconds spent in each phase of the request, filled in by the server's PhaseTimer
+    timings: Dict[str, float] = dataclass_field(default_factory=dict)
+    # Immutable snapshot (see drafter.snapshots) of the state that the route returned
+    state_snapshot: Any = None
 
     def update(self, new_status, original_page_content=None):
         self.status = new_status
@@ -226,32 +310,289 @@ class VisitedPage:
         return (f"<strong>Current Route:</strong><br>Route function: <code>{function_name}</code><br>"
                 f"URL: <href='{self.url}'><code>{self.url}</code></href>")
 
-def dehydrate_json(value, seen=None):
-    if seen is None:
-        seen = set()
-    else:
-        seen = set(seen)
-    if id(value) in seen:
-        raise ValueError(f"Error while serializing state: Circular reference detected in {value!r}")
+class HistoryBuffer:
+    """
+    A list-like ring buffer for history entries. Once there are more than ``max_entries``
+    entries, or their total (estimated) size goes over ``max_bytes``, the oldest entries
+    are evicted to make room. At least the newest entry is always kept.
+
+    :param max_entries: The most entries to keep; zero (or less) means no limit.
+    :param max_bytes: The largest total size of the entries to keep; zero (or less) means no limit.
+    :param sizer: Function estimating the size of an entry in bytes; required for ``max_bytes`` to apply.
+    :ivar evicted: How many entries have been evicted since the buffer was last cleared.
+    :type evicted: int
+    """
+
+    def __init__(self, max_entries: int = 0, max_bytes: int = 0, sizer: Optional[Callable[[Any], int]] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes if sizer is not None else 0
+        self.sizer = sizer
+        self.evicted = 0
+        self.total_bytes = 0
+        self._entries: deque = deque()
+        self._sizes: deque = deque()
+
+    def append(self, entry) -> List[Any]:
+        """
+        Adds a new entry to the end of the history, evicting old entries if necessary.
+
+        :param entry: The entry to add.
+        :return: The entries that were evicted, oldest first.
+        """
+        size = self.sizer(entry) if self.max_bytes > 0 else 0
+        self._entries.append(entry)
+        self._sizes.append(size)
+        self.total_bytes += size
+        return self._evict()
+
+    def remeasure_last(self) -> List[Any]:
+        """
+        Re-estimates the size of the newest entry, for entries that grow after being added
+        (e.g., a visited page whose content is recorded once the route finishes).
+
+        :return: The entries that were evicted as a result, oldest first.
+        """
+        if self.max_bytes <= 0 or not self._entries:
+            return []
+        size = self.sizer(self._entries[-1])
+        self.total_bytes += size - self._sizes[-1]
+        self._sizes[-1] = size
+        return self._evict()
+
+    def _evict(self) -> List[Any]:
+        evicted = []
+        while len(self._entries) > 1 and (
+                (0 < self.max_entries < len(self._entries)) or
+                (0 < self.max_bytes < self.total_bytes)):
+            evicted.append(self._entries.popleft())
+            self.total_bytes -= self._sizes.popleft()
+        self.evicted += len(evicted)
+        return evicted
+
+    def clear(self):
+        """ Removes all of the entries, and forgets how many were evicted. """
+        self._entries.clear()
+        self._sizes.clear()
+        self.total_bytes = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __reversed__(self):
+        return reversed(self._entries)
+
+    def __getitem__(self, index):
+        return self._entries[index]
+
+    def stored(self, index):
+        """
+        Gets an entry as it is stored, which may be cheaper than getting it with ``[]`` for buffers
+        that encode their entries (e.g., ``DeltaHistoryBuffer``).
+
+        :param index: The position of the entry (negative numbers count from the newest).
+        :return: The stored entry.
+        """
+        return self._entries[index]
+
+    def __repr__(self):
+        return f"HistoryBuffer({list(self._entries)!r})"
+
+
+def estimate_visit_size(entry) -> int:
+    """
+    Estimates how much memory a page history entry takes up, based on the lengths of the
+    strings that it keeps around (which is where almost all of the memory goes).
+
+    :param entry: A tuple of the visited page and the serialized state before the visit.
+    :return: The estimated size in bytes.
+    """
+    visit, old_state = entry
+    return (len(old_state or "") + len(visit.original_page_content or "") +
+            len(visit.arguments or "") + len(visit.url or ""))
+
+
+class HistorySpillLog:
+    """
+    An append-only, gzip-compressed log of page history entries that were evicted from memory.
+    Each entry is stored as a line of JSON. Entries are gathered into batches, and each batch is
+    appended to the file as its own gzip member, so the file can be read at any time with
+    ``read_history_log`` (or any gzip tool). Entries that are still gathered when the process exits
+    are written out then.
+
+    :param path: The filename of the log.
+    :param batch_size: How many entries to gather before writing them out.
+    """
+
+    def __init__(self, path: str, batch_size: int = 32):
+        self.path = path
+        self.batch_size = batch_size
+        self._pending: List[str] = []
+        self._lock = RLock()
+        import atexit
+        atexit.register(self.flush)
+
+    def write(self, session_id: str, visit: "VisitedPage", old_state: Optional[str]):
+        """
+        Adds an evicted page history entry to the log.
+
+        :param session_id: The session that the entry belonged to.
+        :param visit: The visited page.
+        :param old_state: The serialized state before the visit.
+        """
+        entry = json.dumps({
+            "session": session_id,
+            "url": visit.url,
+            "function": getattr(visit.function, '__name__', repr(visit.function)),
+            "arguments": visit.arguments,
+            "status": visit.status,
+            "button_pressed": visit.button_pressed,
+            "original_page_content": visit.original_page_content,
+            "old_state": old_state,
+            "started": visit.started.isoformat() if visit.started else None,
+            "stopped": visit.stopped.isoformat() if visit.stopped else None,
+        })
+        with self._lock:
+            self._pending.append(entry)
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        """ Writes out any gathered entries as a new gzip member at the end of the file. """
+        with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, []
+            with open(self.path, 'ab') as log:
+                log.write(gzip.compress(("\n".join(pending) + "\n").encode('utf-8')))
+
+
+def read_history_log(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Reads back the entries written to a ``HistorySpillLog``, oldest first.
+
+    :param path: The filename of the log.
+    :return: An iterator of dictionaries, one per page history entry.
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as log:
+        for line in log:
+            if line.strip():
+                yield json.loads(line)
+
+
+PRIMITIVE_CLASSES = (int, str, float, bool, type(None))
+
+
+def expand_for_json(value):
+    if value.__class__ in PRIMITIVE_CLASSES:
+        return None, value
     if isinstance(value, (list, set, tuple)):
-        seen.add(id(value))
-        return [dehydrate_json(v, seen) for v in value]
+        return value, list
     elif isinstance(value, dict):
-        seen.add(id(value))
-        return {dehydrate_json(k, seen): dehydrate_json(v, seen)
-                for k, v in value.items()}
+        return flatten_items(value), lambda parts: dict(pair_up(parts))
     elif isinstance(value, (int, str, float, bool)) or value == None:
-        return value
+        return None, value
     elif is_dataclass(value):
-        seen.add(id(value))
-        return {f.name: dehydrate_json(getattr(value, f.name), seen)
-                for f in fields(value)}
+        names = field_names(value)
+        return [getattr(value, name) for name in names], lambda parts: dict(zip(names, parts))
     elif HAS_PILLOW and isinstance(value, PILImage.Image):
-        return image_to_bytes(value).decode('latin1')
+        return None, BLOB_STORE.dump_image(value)
     raise ValueError(
         f"Error while serializing state: The {value!r} is not a int, str, float, bool, list, or dataclass.")
 
 
+def report_circular_reference(value):
+    raise ValueError(f"Error while serializing state: Circular reference detected in {value!r}")
+
+
+def dehydrate_json(value, seen=None):
+    return fold_structure(value, expand_for_json, report_circular_reference, seen)
+
+
+def json_key(key) -> str:
+    """ Quotes a dictionary key the way ``json.dumps`` does, turning numbers, booleans, and None into strings. """
+    if not isinstance(key, str):
+        key = json.dumps(key)
+    return json.dumps(key)
+
+
+def expand_for_dumps(value):
+    if isinstance(value, (list, tuple)):
+        return value, lambda parts: f"[{', '.join(parts)}]"
+    if isinstance(value, dict):
+        keys = [json_key(key) for key in value]
+        return list(value.values()), lambda parts: "{" + ", ".join(
+            f"{key}: {part}" for key, part in zip(keys, parts)) + "}"
+    return None, json.dumps(value)
+
+
+def dump_json(data) -> str:
+    """
+    Serializes JSON-compatible data like ``json.dumps`` does. Data nested more deeply than
+    ``json.dumps`` can handle is serialized with ``fold_structure`` instead, which does not recurse.
+
+    :param data: The JSON-compatible data (e.g., from ``dehydrate_json``).
+    :return: The JSON string.
+    """
+    try:
+        return json.dumps(data)
+    except RecursionError:
+        return fold_structure(data, expand_for_dumps, report_circular_reference)
+
+
+class StateDumpCache:
+    """
+    Remembers the most recent serialized state, so that dumping the same state again (e.g., for the
+    rendered page, the debug information, and the history at the start of the next request) reuses
+    it. The cached dump is only reused for the very same state object, which takes constant time to
+    check. Changes made to the state in place are not noticed, so the cache must be cleared before
+    running code that might make them (e.g., a route function).
+
+    The cache is not kept when it is pickled (e.g., by a session store).
+
+    :ivar hits: How many dumps were reused.
+    :type hits: int
+    :ivar misses: How many dumps had to be made from scratch.
+    :type misses: int
+    """
+    __slots__ = ('state', 'encode', 'dumped', 'hits', 'misses')
+
+    def __init__(self):
+        self.state: Any = None
+        self.encode: Any = None
+        self.dumped: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+
+    def dump(self, state, encode=dehydrate_json) -> str:
+        """
+        Serializes the state to a JSON string, reusing the last result if it was for the same state
+        object and the cache has not been cleared since.
+
+        :param state: The state to serialize.
+        :param encode: Turns the state into JSON-compatible data (e.g., a compiled codec's ``encode``).
+        :return: The JSON string of ``encode(state)`` (see ``dump_json``).
+        :raises ValueError: If the state cannot be dehydrated.
+        """
+        if self.dumped is not None and state is self.state and encode == self.encode:
+            self.hits += 1
+            return self.dumped
+        self.misses += 1
+        dumped = dump_json(encode(state))
+        self.state, self.encode, self.dumped = state, encode, dumped
+        return dumped
+
+    def clear(self):
+        """ Forgets the cached dump (e.g., because the state may be about to change in place). """
+        self.state, self.encode, self.dumped = None, None, None
+
+    def __reduce__(self):
+        return StateDumpCache, ()
+
+
 def image_to_bytes(value):
     with io.BytesIO() as output:
         value.save(output, format='PNG')
@@ -277,7 +618,7 @@ def rehydrate_json(value, new_type):
             return value
     elif isinstance(value, str):
         if HAS_PILLOW and issubclass(new_type, PILImage.Image):
-            return bytes_to_image(value.encode('latin1'))
+            return BLOB_STORE.load_image(value)
         return value
     elif isinstance(value, (int, float, bool)) or value is None:
         return value
@@ -301,9 +642,17 @@ def rehydrate_json(value, new_type):
 
 
 def get_params():
+    # Decoding makes a copy, so it is kept for the rest of the request; otherwise, parameters
+    # removed by one step (e.g., the restorable state) would come back in the next one
+    environ = getattr(request, 'environ', None)
+    params = environ.get('drafter.params') if environ is not None else None
+    if params is not None:
+        return params
     params = request.params
     if hasattr(params, 'decode'):
         params = params.decode('utf-8')
     for file_object in request.files:
         params[file_object] = request.files[file_object]
+    if environ is not None:
+        environ['drafter.params'] = params
     return params
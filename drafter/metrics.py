@@ -0,0 +1,317 @@
+"""
+Request metrics for monitoring a Drafter site, in the Prometheus text format.
+
+The server keeps a ``ServerMetrics`` registry, served at ``/--metrics``. It counts requests per
+route and errors per phase, records histograms of latencies and response sizes, and reports the
+size of the history and state as gauges.
+
+Recording a metric never takes a lock: each thread counts into its own shard, and the shards are
+only added together when the metrics are collected. Histograms use a fixed list of buckets, so
+observing a value is a short scan and an increment. With several worker processes, each process
+keeps (and reports) its own metrics.
+"""
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from drafter.sessions import RequestLocal
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape_label_value(value: str) -> str:
+    """
+    Escapes a label value for the Prometheus text format.
+
+    :param value: The raw label value.
+    :return: The value with backslashes, double quotes, and newlines escaped.
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    """
+    Formats a set of labels as they appear after a metric's name.
+
+    :param names: The names of the labels.
+    :param values: The values of the labels, in the same order.
+    :param extra: An additional, already formatted label (e.g., ``le="0.5"``).
+    :return: The labels in braces, or an empty string if there are none.
+    """
+    labels = [f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def format_number(value: float) -> str:
+    """ Formats a sample value, without a needless fractional part. """
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """
+    Base class for metrics, which keep each thread's values in their own shard so that recording
+    does not need a lock. Only the thread that owns a shard ever changes it.
+
+    :param name: The name of the metric (e.g., ``drafter_requests_total``).
+    :param documentation: A short description of the metric.
+    :param label_names: The names of the labels that each value is recorded with.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._local = RequestLocal()
+        self._shards: List[dict] = []
+
+    def shard(self) -> dict:
+        """
+        Gets the current thread's shard, creating it on the thread's first use.
+
+        :return: The dictionary of values that only the current thread changes.
+        """
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            # Appending to a list is atomic, so no lock is needed here either
+            self._shards.append(shard)
+            return shard
+
+    def snapshots(self) -> List[dict]:
+        """
+        Copies every thread's shard, so that they can be added up while other threads keep recording.
+
+        :return: A copy of each shard.
+        """
+        return [shard.copy() for shard in list(self._shards)]
+
+    def reset(self):
+        """ Forgets all recorded values (e.g., in a new worker process after forking). """
+        self._local = RequestLocal()
+        self._shards = []
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """
+        Collects the current values of the metric.
+
+        :return: A list of (sample name, formatted labels, value) triples.
+        """
+        raise NotImplementedError()
+
+    def render(self) -> str:
+        """
+        Formats the metric in the Prometheus text format.
+
+        :return: The ``HELP`` and ``TYPE`` lines, followed by one line per sample.
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {format_number(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """ A value that only goes up, such as the number of requests. """
+    kind = "counter"
+
+    def inc(self, labels: LabelValues = (), amount: float = 1):
+        """
+        Adds to the counter.
+
+        :param labels: The label values, in the order of the metric's label names.
+        :param amount: How much to add.
+        """
+        shard = self.shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def values(self) -> Dict[LabelValues, float]:
+        """
+        Adds up the counter across all threads.
+
+        :return: The total for each combination of label values.
+        """
+        totals: Dict[LabelValues, float] = {}
+        for shard in self.snapshots():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def samples(self):
+        return [(self.name, format_labels(self.label_names, labels), value)
+                for labels, value in sorted(self.values().items())]
+
+
+class Histogram(Metric):
+    """
+    Counts observed values (such as latencies) into a fixed list of buckets, and keeps their sum.
+
+    :param name: The name of the metric (e.g., ``drafter_request_duration_seconds``).
+    :param documentation: A short description of the metric.
+    :param buckets: The upper bounds of the buckets, in increasing order.
+    :param label_names: The names of the labels that each value is recorded with.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, labels: LabelValues = ()):
+        """
+        Records a single value.
+
+        :param value: The observed value.
+        :param labels: The label values, in the order of the metric's label names.
+        """
+        shard = self.shard()
+        record = shard.get(labels)
+        if record is None:
+            # One count per bucket (plus one for +Inf), then the sum
+            record = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        index = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            index += 1
+        record[index] += 1
+        record[-1] += value
+
+    def values(self) -> Dict[LabelValues, List[float]]:
+        """
+        Adds up the histogram across all threads.
+
+        :return: The (non-cumulative) bucket counts followed by the sum, for each combination of label values.
+        """
+        totals: Dict[LabelValues, List[float]] = {}
+        for shard in self.snapshots():
+            for labels, record in shard.items():
+                record = list(record)
+                if labels in totals:
+                    totals[labels] = [a + b for a, b in zip(totals[labels], record)]
+                else:
+                    totals[labels] = record
+        return totals
+
+    def samples(self):
+        samples = []
+        for labels, record in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), record):
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else format_number(bound)
+                samples.append((self.name + "_bucket", format_labels(self.label_names, labels, f'le="{le}"'),
+                                cumulative))
+            formatted = format_labels(self.label_names, labels)
+            samples.append((self.name + "_sum", formatted, record[-1]))
+            samples.append((self.name + "_count", formatted, cumulative))
+        return samples
+
+
+class Gauge(Metric):
+    """
+    A value that can go up and down, such as the size of the history. Either the latest value set
+    is reported, or (if a ``function`` is given) the value is computed whenever it is collected.
+
+    :param name: The name of the metric.
+    :param documentation: A short description of the metric.
+    :param function: Computes the current value when the metrics are collected.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, function: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation)
+        self.function = function
+        self.value = 0.0
+
+    def set(self, value: float):
+        """
+        Replaces the gauge's value. A single assignment, so it does not need a lock either.
+
+        :param value: The new value.
+        """
+        self.value = value
+
+    def reset(self):
+        super().reset()
+        self.value = 0.0
+
+    def samples(self):
+        value = self.function() if self.function is not None else self.value
+        return [(self.name, "", value)]
+
+
+class MetricsRegistry:
+    """ A collection of metrics that are rendered together. """
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric):
+        """
+        Adds a metric to the registry.
+
+        :param metric: The metric to add.
+        :return: The same metric.
+        """
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Formats every metric in the Prometheus text format.
+
+        :return: The complete body of a metrics response.
+        """
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+    def reset(self):
+        """ Forgets the recorded values of every metric. """
+        for metric in self.metrics:
+            metric.reset()
+
+
+class ServerMetrics(MetricsRegistry):
+    """
+    The metrics that the Drafter server records for every request to a route.
+
+    :ivar requests: Requests handled, by route function.
+    :ivar errors: Error pages shown, by the phase that failed (e.g., ``Error creating page``).
+    :ivar latency: Seconds spent handling each request, by route function.
+    :ivar response_size: Bytes sent for each page (after compression), by route function.
+    :ivar state_dumps: States serialized, by whether the cached dump was reused (``hit``) or not (``miss``).
+    :ivar history_entries: Page history entries kept for the most recent visitor.
+    :ivar history_bytes: Estimated size of the page history kept for the most recent visitor.
+    :ivar state_bytes: Size of the most recent visitor's state, when serialized.
+    :ivar sessions: Sessions currently kept by the server.
+    """
+
+    def __init__(self, count_sessions: Optional[Callable[[], float]] = None):
+        super().__init__()
+        self.requests = self.register(Counter("drafter_requests_total", "Requests handled by each route.",
+                                              ["route"]))
+        self.errors = self.register(Counter("drafter_errors_total", "Error pages shown, by the phase that failed.",
+                                            ["phase"]))
+        self.latency = self.register(Histogram("drafter_request_duration_seconds",
+                                               "Time spent handling requests to each route.",
+                                               DEFAULT_LATENCY_BUCKETS, ["route"]))
+        self.response_size = self.register(Histogram("drafter_response_size_bytes",
+                                                     "Size of the pages sent by each route.",
+                                                     DEFAULT_SIZE_BUCKETS, ["route"]))
+        self.state_dumps = self.register(Counter("drafter_state_dumps_total",
+                                                 "States serialized, by whether a cached dump was reused.",
+                                                 ["result"]))
+        self.history_entries = self.register(Gauge("drafter_history_entries",
+                                                   "Page history entries kept for the most recent visitor."))
+        self.history_bytes = self.register(Gauge("drafter_history_bytes",
+                                                 "Estimated size of the most recent visitor's page history."))
+        self.state_bytes = self.register(Gauge("drafter_state_bytes",
+                                               "Serialized size of the most recent visitor's state."))
+        self.sessions = self.register(Gauge("drafter_sessions", "Visitor sessions currently kept.", count_sessions))
@@ -1,9 +1,11 @@
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Iterator
+import html
 
 from drafter.configuration import ServerConfiguration
 from drafter.constants import RESTORABLE_STATE_KEY
 from drafter.components import PageContent, Link
+from drafter.state_tokens import is_state_token
 
 
 @dataclass
@@ -72,30 +74,50 @@ class Page:
         Users should not call this method directly; it will be called on their behalf by the server.
 
         :param current_state: The current state of the server. This will be used to restore the page if needed.
+            In stateless mode, this is a signed state token, which is included in the page's form and links.
         :param configuration: The configuration of the server. This will be used to determine how the page is rendered.
         :return: A string of HTML representing the content of the page.
         """
-        # TODO: Decide if we want to dump state on the page
-        chunked = [
-            # f'<input type="hidden" name="{RESTORABLE_STATE_KEY}" value={current_state!r}/>'
-        ]
-        for chunk in self.content:
-            if isinstance(chunk, str):
-                chunked.append(f"<p>{chunk}</p>")
-            else:
-                chunked.append(chunk.render(current_state, configuration))
-        content = "\n".join(chunked)
-        content = f"<form method='POST' enctype='multipart/form-data' accept-charset='utf-8'>{content}</form>"
+        return "".join(self.render_iter(current_state, configuration)), self.render_js()
+
+    def render_iter(self, current_state, configuration: ServerConfiguration) -> Iterator[str]:
+        """
+        Renders the content of the page as a sequence of HTML fragments, so that the server can
+        start sending the page before all of it has been rendered. Joined together, the fragments
+        are the same as the content returned by ``render_content``.
+
+        :param current_state: The current state of the server. This will be used to restore the page if needed.
+        :param configuration: The configuration of the server. This will be used to determine how the page is rendered.
+        :return: An iterator of HTML fragments representing the content of the page.
+        """
         if configuration.framed:
             reset_button = self.make_reset_button()
             about_button = self.make_about_button()
-            content = (f"<div class='container btlw-header'>{configuration.title}{reset_button}{about_button}</div>"
-                       f"<div class='container btlw-container'>{content}</div>")
+            yield (f"<div class='container btlw-header'>{configuration.title}{reset_button}{about_button}</div>"
+                   f"<div class='container btlw-container'>")
+        yield "<form method='POST' enctype='multipart/form-data' accept-charset='utf-8'>"
+        if configuration.stateless and is_state_token(current_state):
+            # In stateless mode, every button submits the state along with the rest of the form
+            yield f"<input type='hidden' name='{RESTORABLE_STATE_KEY}' value='{html.escape(current_state)}'>"
+        for index, chunk in enumerate(self.content):
+            if index:
+                yield "\n"
+            if isinstance(chunk, str):
+                yield f"<p>{chunk}</p>"
+            else:
+                yield from chunk.render_iter(current_state, configuration)
+        yield "</form>"
+        if configuration.framed:
+            yield "</div>"
 
-        js  = "\n".join([line if line.strip().startswith("<script") else f"<script>{line}</script>"
-                         for line in self.js])
+    def render_js(self) -> str:
+        """
+        Renders the page's extra JavaScript, wrapping each line in a script tag unless it already is one.
 
-        return content, js
+        :return: A string of HTML script tags.
+        """
+        return "\n".join([line if line.strip().startswith("<script") else f"<script>{line}</script>"
+                          for line in self.js])
 
     def make_reset_button(self) -> str:
         """
@@ -0,0 +1,374 @@
+"""
+Cached, optionally out-of-process rendering of Matplotlib figures.
+
+Rasterizing a figure (``savefig``) is by far the slowest part of a page with a ``MatPlotLibPlot``,
+and a dashboard usually draws the very same plots again on every refresh. ``figure_fingerprint``
+walks the figure's artists and hashes everything that affects how it looks (their data, colors,
+text, limits, and so on, along with the ``rcParams`` and the ``savefig`` settings). The
+``PlotRenderer`` keeps the encoded output of recent figures by fingerprint, so a figure that was
+already drawn is not rasterized again.
+
+Figures that contain artists the fingerprint does not know about (e.g., 3D or polar axes, or
+formatters that call functions) cannot be fingerprinted safely, so they are always rasterized.
+
+With ``plot_workers`` set, figures are pickled and rasterized in a pool of processes, so the
+request thread only waits for the result instead of holding the interpreter while rendering, and
+other requests carry on in the meantime. Pools are only used where processes can be forked.
+"""
+import io
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from drafter.sessions import RLock
+
+PYPLOT_LOCK = RLock()
+PLAIN_VALUES = (type(None), bool, int, float, str)
+
+
+class NotFingerprintable(Exception):
+    """ Raised while fingerprinting a figure that contains something whose looks cannot be hashed. """
+
+
+def save_figure(figure, settings: Dict[str, Any]) -> bytes:
+    """
+    Rasterizes (or otherwise encodes) a figure.
+
+    :param figure: The Matplotlib figure.
+    :param settings: The keyword arguments for ``savefig`` (e.g., ``format``).
+    :return: The encoded image.
+    """
+    with io.BytesIO() as output:
+        figure.savefig(output, **settings)
+        return output.getvalue()
+
+
+def rasterize_pickled(payload: bytes, settings: Dict[str, Any]) -> bytes:
+    """
+    Rasterizes a pickled figure; this is what runs in the worker processes.
+
+    :param payload: The pickled figure.
+    :param settings: The keyword arguments for ``savefig``.
+    :return: The encoded image.
+    """
+    import pickle
+    import matplotlib.pyplot as plt
+    figure = pickle.loads(payload)
+    try:
+        return save_figure(figure, settings)
+    finally:
+        plt.close(figure)
+
+
+def figure_fingerprint(figure, settings: Dict[str, Any]) -> Optional[str]:
+    """
+    Hashes everything about a figure that affects how it is drawn.
+
+    :param figure: The Matplotlib figure.
+    :param settings: The keyword arguments for ``savefig``, which also affect the output.
+    :return: The hash, or None if the figure contains something that cannot be fingerprinted.
+    """
+    import hashlib
+    import matplotlib
+    parts = [sorted(settings.items()), repr(sorted(matplotlib.rcParams.items()))]
+    try:
+        artists = [figure]
+        while artists:
+            artist = artists.pop()
+            parts.append((type(artist).__name__, describe_artist(artist)))
+            artists.extend(reversed(artist_children(artist)))
+        digest = hashlib.sha256()
+        update_fingerprint(digest, parts)
+    except Exception:
+        # Including artists whose getters differ between Matplotlib versions
+        return None
+    return digest.hexdigest()
+
+
+def update_fingerprint(digest, value):
+    """
+    Adds a value to a fingerprint's hash: arrays by their bytes, and everything else (taking
+    lists, tuples, and dictionaries apart) by its ``repr``.
+
+    :raises NotFingerprintable: If the value includes a function, whose results cannot be known.
+    """
+    import numpy
+    plain = []
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, PLAIN_VALUES) or isinstance(value, numpy.generic):
+            plain.append(value)
+        elif isinstance(value, numpy.ndarray):
+            plain.append(("array", value.dtype.str, value.shape))
+            digest.update(numpy.ascontiguousarray(value).tobytes())
+            if numpy.ma.isMaskedArray(value):
+                digest.update(numpy.ascontiguousarray(numpy.ma.getmaskarray(value)).tobytes())
+        elif isinstance(value, (list, tuple)):
+            plain.append(len(value))
+            stack.extend(reversed(value))
+        elif isinstance(value, dict):
+            plain.append(len(value))
+            stack.extend(reversed([item for pair in sorted(value.items(), key=repr) for item in pair]))
+        elif callable(value):
+            raise NotFingerprintable(f"Cannot fingerprint the function {value!r}")
+        elif hasattr(value, 'vertices'):
+            stack.append((value.vertices, value.codes))
+        elif hasattr(value, 'get_matrix'):
+            stack.append(value.get_matrix())
+        else:
+            # e.g., bounding boxes describe themselves fully (other objects' reprs include their
+            # id, which only makes the fingerprint miss)
+            plain.append(f"{type(value).__name__}:{value!r}")
+    digest.update(repr(plain).encode('utf-8'))
+
+
+def plain_state(value) -> tuple:
+    """ The plain (non-object) attributes of a locator or formatter, which decide where and how ticks are shown. """
+    if value is None:
+        return ()
+    attributes = []
+    for name, attribute in sorted(vars(value).items()):
+        if name in ('axis', '_axis'):
+            continue
+        if callable(attribute):
+            raise NotFingerprintable(f"Cannot fingerprint the function {attribute!r}")
+        if isinstance(attribute, PLAIN_VALUES + (list, tuple)) or hasattr(attribute, 'dtype'):
+            attributes.append((name, attribute))
+    return type(value).__name__, tuple(attributes)
+
+
+def axis_units(axis) -> tuple:
+    """
+    The units of an axis, which decide what its positions stand for. On a categorical axis (e.g., from
+    ``plt.bar(["apples", "pears"], ...)``), the data only holds positions, and the units hold the categories.
+
+    :raises NotFingerprintable: If the units are not understood.
+    """
+    units = axis.get_units()
+    get_converter = getattr(axis, 'get_converter', None)
+    converter = get_converter() if get_converter is not None else axis.converter
+    mapping = getattr(units, '_mapping', None)
+    if isinstance(units, PLAIN_VALUES):
+        described = units
+    elif isinstance(mapping, dict):
+        described = tuple(mapping.items())
+    else:
+        raise NotFingerprintable(f"Cannot fingerprint the units {units!r}")
+    return type(converter).__name__, described
+
+
+def artist_children(artist) -> list:
+    """
+    The artists inside an artist. An axis's ticks are only made when they are first needed, which
+    takes longer than fingerprinting everything else, so they are only included if they were
+    already made (e.g., to change their labels); otherwise, they follow from the axis's own settings.
+    """
+    from matplotlib import axis
+    if not isinstance(artist, axis.Axis):
+        return artist.get_children()
+    made = vars(artist)
+    return [artist.label, artist.offsetText, *made.get('majorTicks', ()), *made.get('minorTicks', ())]
+
+
+def describe_artist(artist) -> tuple:
+    """
+    Lists the properties of a single artist (not including its children) that affect how it is drawn.
+
+    :raises NotFingerprintable: If the kind of artist is not known.
+    """
+    # Making the figure already imported all of these
+    from matplotlib import axes, axis, collections, figure, image, legend, lines, offsetbox, patches, spines, text
+    common = (artist.get_visible(), artist.get_alpha(), artist.get_zorder(), artist.get_clip_on())
+    kind = type(artist)
+    if kind is axes.Axes:
+        return common + (artist.get_xlim(), artist.get_ylim(), artist.get_xscale(), artist.get_yscale(),
+                         artist.get_position(original=True).bounds, artist.get_facecolor(), artist.get_aspect(),
+                         artist.axison, artist.get_frame_on(), artist.get_anchor(), artist.get_adjustable())
+    if isinstance(artist, figure.Figure):
+        layout = artist.get_layout_engine()
+        return common + (tuple(artist.get_size_inches()), artist.dpi, artist.get_facecolor(),
+                         artist.get_edgecolor(), artist.get_frameon(), type(layout).__name__,
+                         layout.get() if layout is not None else None, vars(artist.subplotpars))
+    if isinstance(artist, axis.Axis):
+        return common + (plain_state(artist.get_major_locator()), plain_state(artist.get_minor_locator()),
+                         plain_state(artist.get_major_formatter()), plain_state(artist.get_minor_formatter()),
+                         artist.get_ticks_position(), artist.get_label_position(), artist.get_inverted(),
+                         artist.get_tick_params(which='major'), artist.get_tick_params(which='minor'),
+                         axis_units(artist))
+    if isinstance(artist, axis.Tick):
+        return common + (artist.get_loc(), artist.get_tickdir(), artist.get_pad())
+    if isinstance(artist, lines.Line2D):
+        return common + (artist.get_xydata(), artist.get_color(), artist.get_linestyle(), artist.get_linewidth(),
+                         artist.get_marker(), artist.get_markersize(), artist.get_markerfacecolor(),
+                         artist.get_markeredgecolor(), artist.get_markeredgewidth(), artist.get_drawstyle(),
+                         artist.get_markevery(), artist.get_dash_capstyle(), artist.get_solid_capstyle())
+    if isinstance(artist, text.Text):
+        bbox = artist.get_bbox_patch()
+        extra = (artist.xy, artist.xycoords, artist.anncoords, artist.arrowprops) \
+            if isinstance(artist, text.Annotation) else ()
+        return common + (artist.get_text(), artist.get_position(), artist.get_color(), hash(artist.get_fontproperties()),
+                         artist.get_rotation(), artist.get_horizontalalignment(),
+                         artist.get_verticalalignment(), artist.get_linespacing(),
+                         artist.get_usetex(), artist.get_wrap(),
+                         None if bbox is None else (plain_state(bbox.get_boxstyle()), bbox.get_facecolor(),
+                                                    bbox.get_edgecolor())) + extra
+    if isinstance(artist, spines.Spine):
+        return common + (artist.spine_type, artist.get_position(), artist.get_bounds(), artist.get_edgecolor(),
+                         artist.get_linewidth(), artist.get_linestyle())
+    if isinstance(artist, patches.Patch):
+        try:
+            path = artist.get_path()
+        except Exception as e:
+            raise NotFingerprintable(f"Cannot find the shape of {artist!r}: {e}")
+        return common + (path.vertices, path.codes, artist.get_patch_transform(), artist.get_facecolor(),
+                         artist.get_edgecolor(), artist.get_linewidth(), artist.get_linestyle(),
+                         artist.get_hatch(), artist.get_fill(),
+                         plain_state(artist.get_boxstyle()) if isinstance(artist, patches.FancyBboxPatch) else None)
+    if isinstance(artist, collections.Collection):
+        return common + (artist.get_offsets(), [(path.vertices, path.codes) for path in artist.get_paths()],
+                         artist.get_facecolor(), artist.get_edgecolor(), artist.get_linewidth(),
+                         artist.get_linestyle(), artist.get_array(), artist.get_cmap().name, artist.get_clim(),
+                         getattr(artist, 'get_sizes', lambda: None)(), artist.get_hatch(),
+                         artist.get_transforms())
+    if isinstance(artist, image.AxesImage):
+        return common + (artist.get_array(), artist.get_cmap().name, artist.get_clim(), artist.get_extent(),
+                         artist.get_interpolation(), artist.origin)
+    if isinstance(artist, legend.Legend):
+        return common + (getattr(artist, '_loc', None), getattr(artist, '_bbox_to_anchor', None),
+                         artist.get_frame_on())
+    if type(artist).__module__ == offsetbox.__name__:
+        # The legend's layout boxes, whose contents are their children
+        return common + (getattr(artist, 'width', None), getattr(artist, 'height', None),
+                         getattr(artist, 'pad', None), getattr(artist, 'sep', None), getattr(artist, 'align', None))
+    raise NotFingerprintable(f"Cannot fingerprint a {type(artist).__name__}")
+
+
+class PlotRenderer:
+    """
+    Rasterizes Matplotlib figures, reusing the output of figures that look the same as one drawn
+    recently, and optionally rendering in a pool of worker processes.
+
+    :param max_entries: The most figures whose output is kept; zero means none.
+    :param workers: How many processes rasterize figures; zero renders on the calling thread.
+    :ivar hits: How many figures were served from the cache.
+    :type hits: int
+    :ivar misses: How many figures had to be rasterized.
+    :type misses: int
+    """
+
+    def __init__(self, max_entries: int = 128, workers: int = 0):
+        self.max_entries = max_entries
+        self.workers = workers
+        self.hits = self.misses = 0
+        self._cache: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._pool = None
+        self._exit_registered = False
+        self._lock = RLock()
+
+    def configure(self, max_entries: int, workers: int):
+        """
+        Changes the renderer's settings. Cached output is kept (up to the new limit), but a pool of
+        the wrong size is stopped.
+
+        :param max_entries: The most figures whose output is kept.
+        :param workers: How many processes rasterize figures (ignored where processes cannot be forked).
+        """
+        with self._lock:
+            self.max_entries = max_entries
+            if workers != self.workers:
+                self.shutdown()
+                self.workers = workers
+            self._trim()
+
+    def start(self):
+        """
+        Starts the pool of worker processes, if there should be one. The processes are forked
+        right away, ideally before the server starts any threads of its own.
+        """
+        if self.workers > 0:
+            self.get_pool().submit(int).result()
+
+    def get_pool(self):
+        """
+        Gets the pool of worker processes, starting it if needed.
+
+        :return: The pool, or None if there are no workers or processes cannot be forked here.
+        """
+        with self._lock:
+            if self._pool is None and self.workers > 0:
+                import multiprocessing
+                if 'fork' not in multiprocessing.get_all_start_methods():
+                    # Spawned processes would import (and so run) the site's main file again
+                    return None
+                from concurrent.futures import ProcessPoolExecutor
+                self._pool = ProcessPoolExecutor(self.workers, multiprocessing.get_context('fork'))
+                if not self._exit_registered:
+                    import atexit
+                    atexit.register(self.shutdown)
+                    self._exit_registered = True
+            return self._pool
+
+    def shutdown(self):
+        """ Stops the pool of worker processes (e.g., before forking, or at exit); it is started again when needed. """
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
+
+    def render(self, figure, settings: Dict[str, Any]) -> bytes:
+        """
+        Gets the encoded image of a figure, from the cache if the same figure was drawn recently.
+
+        :param figure: The Matplotlib figure.
+        :param settings: The keyword arguments for ``savefig`` (e.g., ``format``).
+        :return: The encoded image.
+        """
+        key = figure_fingerprint(figure, settings) if self.max_entries > 0 else None
+        if key is not None:
+            with self._lock:
+                output = self._cache.get(key)
+                if output is not None:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    return output
+        self.misses += 1
+        output = self.rasterize(figure, settings)
+        if key is not None:
+            with self._lock:
+                self._cache[key] = output
+                self._trim()
+        return output
+
+    def rasterize(self, figure, settings: Dict[str, Any]) -> bytes:
+        """
+        Rasterizes a figure, in a worker process if there is a pool (and the figure can be pickled).
+
+        :param figure: The Matplotlib figure.
+        :param settings: The keyword arguments for ``savefig``.
+        :return: The encoded image.
+        """
+        pool = self.get_pool() if self.workers > 0 else None
+        if pool is not None:
+            import pickle
+            try:
+                payload = pickle.dumps(figure)
+            except Exception:
+                payload = None
+            if payload is not None:
+                return pool.submit(rasterize_pickled, payload, settings).result()
+        return save_figure(figure, settings)
+
+    def clear(self):
+        """ Forgets all of the cached output. """
+        with self._lock:
+            self._cache.clear()
+
+    def _trim(self):
+        while len(self._cache) > max(0, self.max_entries):
+            self._cache.popitem(last=False)
+
+    def __len__(self):
+        return len(self._cache)
+
+
+PLOT_RENDERER = PlotRenderer()
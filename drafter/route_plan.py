@@ -0,0 +1,111 @@
+"""
+Precompiled information about how to call a route function.
+
+Inspecting a route function's signature, and working out how to convert each of its parameters,
+only needs to be done once, when the route is added. The resulting ``RoutePlan`` is then reused
+for every request to that route.
+"""
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List
+import inspect
+
+from drafter.history import UnchangedRecord
+
+# A converter takes the raw value of a parameter and a list to record the conversion in,
+# and returns the converted value.
+Converter = Callable[[Any, list], Any]
+
+
+@dataclass
+class ParameterPlan:
+    """
+    Everything needed to handle a single parameter of a route function.
+
+    :ivar name: The name of the parameter.
+    :type name: str
+    :ivar kind: The kind of parameter (e.g., ``inspect.Parameter.POSITIONAL_OR_KEYWORD``).
+    :type kind: Any
+    :ivar annotation: The type annotation of the parameter, or ``inspect.Parameter.empty``.
+    :type annotation: Any
+    :ivar show_name: Whether the parameter's name is shown when representing a call.
+    :type show_name: bool
+    :ivar converter: The function that converts incoming values for this parameter.
+    :type converter: Converter
+    """
+    name: str
+    kind: Any
+    annotation: Any
+    show_name: bool
+    converter: Converter
+
+
+@dataclass
+class RoutePlan:
+    """
+    A precompiled description of how to call a route function, built once when the route is added.
+
+    :ivar function: The original route function.
+    :type function: Callable
+    :ivar signature: The signature of the route function.
+    :type signature: inspect.Signature
+    :ivar parameters: The plan for each parameter, in order, by name.
+    :type parameters: Dict[str, ParameterPlan]
+    :ivar names: The names of the parameters, in order.
+    :type names: List[str]
+    :ivar positions: The position of each parameter, by name.
+    :type positions: Dict[str, int]
+    :ivar state_first: Whether the first parameter is named ``state`` (the state slot).
+    :type state_first: bool
+    :ivar state_type: The annotation of the ``state`` parameter, or None if there is no such parameter.
+    :type state_type: Any
+    """
+    function: Callable
+    signature: inspect.Signature
+    parameters: Dict[str, ParameterPlan]
+    names: List[str]
+    positions: Dict[str, int]
+    state_first: bool
+    state_type: Any
+
+    def has_state(self) -> bool:
+        """ Whether the route function has a parameter named ``state``. """
+        return 'state' in self.parameters
+
+    def convert(self, name: str, value: Any, record: list) -> Any:
+        """
+        Converts the incoming value of the named parameter, adding an entry to the record.
+        Parameters that the function does not expect are left unchanged.
+
+        :param name: The name of the parameter.
+        :param value: The raw incoming value.
+        :param record: The list of conversion records for the current request.
+        :return: The converted value.
+        """
+        parameter = self.parameters.get(name)
+        if parameter is None:
+            record.append(UnchangedRecord(name, value))
+            return value
+        return parameter.converter(value, record)
+
+
+def compile_route_plan(function: Callable, make_converter: Callable[[str, Any], Converter]) -> RoutePlan:
+    """
+    Inspects the route function once and builds its plan.
+
+    :param function: The route function.
+    :param make_converter: Makes the converter for a parameter, given its name and annotation.
+    :return: The compiled plan.
+    :rtype: RoutePlan
+    """
+    signature = inspect.signature(function)
+    parameters = {}
+    for name, parameter in signature.parameters.items():
+        show_name = parameter.kind in (inspect.Parameter.KEYWORD_ONLY, inspect.Parameter.VAR_KEYWORD)
+        parameters[name] = ParameterPlan(name, parameter.kind, parameter.annotation, show_name,
+                                         make_converter(name, parameter.annotation))
+    names = list(parameters)
+    state = parameters.get('state')
+    return RoutePlan(function, signature, parameters, names,
+                     positions={name: index for index, name in enumerate(names)},
+                     state_first=bool(names) and names[0] == 'state',
+                     state_type=state.annotation if state is not None else None)
@@ -1,27 +1,46 @@
 import html
 import os
 import traceback
+from contextlib import contextmanager, nullcontext
+from copy import deepcopy
 from dataclasses import dataclass, asdict, replace, field, fields
 from functools import wraps
-from typing import Any, Optional, List, Tuple, Union
+from typing import Any, Optional, List, Tuple, Union, Iterable, Iterator
 import json
 import inspect
 import pathlib
+import typing
+import collections.abc
 
 import bottle
 
 from drafter import friendly_urls, PageContent
 from drafter.configuration import ServerConfiguration
-from drafter.constants import RESTORABLE_STATE_KEY, SUBMIT_BUTTON_KEY, PREVIOUSLY_PRESSED_BUTTON
+from drafter.constants import RESTORABLE_STATE_KEY, RESTORABLE_HISTORY_KEY, SUBMIT_BUTTON_KEY, PREVIOUSLY_PRESSED_BUTTON, SESSION_COOKIE_KEY
 from drafter.debug import DebugInformation
-from drafter.setup import Bottle, abort, request, static_file
+from drafter.setup import Bottle, abort, request, response, static_file
+from drafter.sessions import Session, SessionStore, MemorySessionStore, SQLiteSessionStore, RequestLocal, \
+    SessionLocks, RLock, make_session_store, new_session_id, DEFAULT_SESSION_ID
 from drafter.history import VisitedPage, rehydrate_json, dehydrate_json, ConversionRecord, UnchangedRecord, get_params, \
-    remap_hidden_form_parameters, safe_repr
+    remap_hidden_form_parameters, safe_repr, HistoryBuffer, HistorySpillLog, estimate_visit_size, StateDumpCache
+from drafter.state_codecs import get_codec
+from drafter.deltas import DeltaHistoryBuffer
+from drafter.state_tokens import encode_state_token, decode_state_token, is_state_token, make_secret, as_secret, \
+    StateTokenError
+from drafter.snapshots import take_snapshot, restore_snapshot, snapshot_type, FrozenValue
 from drafter.page import Page
+from drafter.route_plan import RoutePlan, compile_route_plan
 from drafter.files import TEMPLATE_200, TEMPLATE_404, TEMPLATE_500, INCLUDE_STYLES, TEMPLATE_200_WITHOUT_HEADER, \
     TEMPLATE_FOOTER, TEMPLATE_SKULPT_DEPLOY, seek_file_by_line
 from drafter.raw_files import get_raw_files, get_themes
-from drafter.urls import remove_url_query_params, is_external_url
+from drafter.assets import AssetRegistry, ASSET_CACHE_CONTROL
+from drafter.blobs import BLOB_STORE, BLOB_CACHE_CONTROL
+from drafter.plots import PLOT_RENDERER
+from drafter.uploads import Upload, UploadLimits, UploadTooLarge, MalformedUpload, read_uploads, close_uploads
+from drafter.compression import negotiate_encoding, compress, compress_iter
+from drafter.timing import PhaseTimer, format_server_timing, monotonic
+from drafter.metrics import ServerMetrics, PROMETHEUS_CONTENT_TYPE
+from drafter.urls import remove_url_query_params, merge_url_query_params, is_external_url
 from drafter.image_support import HAS_PILLOW, PILImage
 
 import logging
@@ -37,6 +56,53 @@ class SiteInformation:
     planning: SiteInformationType
     links: SiteInformationType
 
+@dataclass
+class PageShell:
+    """
+    The precompiled parts of a page's HTML that surround the route's content and its extra
+    JavaScript. Everything in the shell (headers, styles, theme scripts, title, and footer)
+    depends only on the server's configuration, so it is built once and reused for every page.
+
+    :ivar head: Everything before the page content.
+    :type head: str
+    :ivar middle: Everything between the page content and the extra JavaScript.
+    :type middle: str
+    :ivar tail: Everything after the extra JavaScript.
+    :type tail: str
+    """
+    head: str
+    middle: str
+    tail: str
+
+    CONTENT_MARKER = "\x00drafter-content\x00"
+    EXTRA_JS_MARKER = "\x00drafter-extra-js\x00"
+
+    @classmethod
+    def from_template(cls, template: str, **kwargs) -> 'PageShell':
+        """
+        Fills in the template with everything except the content and extra JavaScript,
+        and then splits it around those two spots.
+
+        :param template: A page template with ``{content}`` and ``{extra_js}`` fields.
+        :param kwargs: The values for the remaining fields of the template.
+        :return: The split-up shell.
+        """
+        filled = template.format(content=cls.CONTENT_MARKER, extra_js=cls.EXTRA_JS_MARKER, **kwargs)
+        head, rest = filled.split(cls.CONTENT_MARKER)
+        middle, tail = rest.split(cls.EXTRA_JS_MARKER)
+        return cls(head, middle, tail)
+
+    def render(self, content: str, extra_js: str) -> str:
+        """
+        Splices the page content and extra JavaScript into the shell.
+
+        :param content: The HTML of the page body.
+        :param extra_js: Any additional script tags for the page.
+        :return: The complete HTML of the page.
+        """
+        return "".join((self.head, content, self.middle, extra_js, self.tail))
+
+
 DEFAULT_ALLOWED_EXTENSIONS = ('py', 'js', 'css', 'txt', 'json', 'csv', 'html', 'md')
 
 def bundle_files_into_js(main_file, root_path, allowed_extensions=DEFAULT_ALLOWED_EXTENSIONS):
@@ -83,6 +149,29 @@ def bundle_files_into_js(main_file, root_path, allowed_extensions=DEFAULT_ALLOWE
     return "\n".join(js_lines), skipped_files, added_files
 
 
+def coalesce_chunks(chunks: Iterable[str], size: int) -> Iterator[str]:
+    """
+    Gathers small fragments of a streamed page into chunks of at least the given size, so that
+    each write to the network carries a useful amount of the page.
+
+    :param chunks: The fragments of the page.
+    :type chunks: Iterable[str]
+    :param size: The smallest chunk (in characters) to send, except for the last one.
+    :type size: int
+    :return: An iterator of larger chunks.
+    :rtype: Iterator[str]
+    """
+    buffer, buffered = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            yield "".join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
 def protect_script_tags(content: str) -> str:
     """
     Protects `<script>` tags in the given HTML content by escaping them. This is
@@ -112,19 +201,40 @@ class Server:
     :type routes: dict
     :ivar _handle_route: Internal mapping for handler functions and their respective URLs.
     :type _handle_route: dict
+    :ivar _route_plans: Precompiled call plans for each original route function.
+    :type _route_plans: dict
+    :ivar _state_secret: Random key for signing state tokens, if no ``state_secret`` is configured.
+    :type _state_secret: bytes or None
     :ivar configuration: The configuration object representing server settings.
     :type configuration: ServerConfiguration
-    :ivar _state: Current state of the application.
+    :ivar _configuration_version: Incremented whenever the configuration changes in a way that affects
+        the page shell, so that stale shells are not reused.
+    :type _configuration_version: int
+    :ivar _page_shells: The precompiled page shells, by style and configuration version.
+    :type _page_shells: Dict[Tuple[str, int], PageShell]
+    :ivar assets: The content-hashed theme files served under ``/--assets/``.
+    :type assets: AssetRegistry
+    :ivar blobs: The content-hashed images served under ``/--blobs/`` (shared by every server in the process).
+    :type blobs: BlobStore
+    :ivar plots: The renderer (and cache) of ``MatPlotLibPlot`` figures (shared by every server in the process).
+    :type plots: PlotRenderer
+    :ivar metrics: The request metrics served at ``/--metrics``.
+    :type metrics: ServerMetrics
+    :ivar sessions: The store holding each visitor's session (created during setup if not provided).
+    :type sessions: SessionStore or None
+    :ivar _session_locks: Makes requests from the same visitor take turns using their session.
+    :type _session_locks: SessionLocks
+    :ivar _state: Current state of the application, for the current session.
     :type _state: Any
     :ivar _initial_state: Serialized representation of the initial application state.
     :type _initial_state: str
     :ivar _initial_state_type: Type of the initial state.
     :type _initial_state_type: type
-    :ivar _state_history: List tracking historical states of the application.
+    :ivar _state_history: Immutable snapshots of the historical states of the current session.
     :type _state_history: list
-    :ivar _state_frozen_history: List storing serialized snapshots of historical states.
+    :ivar _state_frozen_history: List storing serialized snapshots of historical states of the current session.
     :type _state_frozen_history: list
-    :ivar _page_history: History of visited pages.
+    :ivar _page_history: History of visited pages in the current session.
     :type _page_history: list
     :ivar _conversion_record: Internal record tracking parameter conversion processes.
     :type _conversion_record: list
@@ -135,20 +245,29 @@ class Server:
     :ivar _custom_name: Custom name for the server instance, used in string representations.
     :type _custom_name: str or None
     """
-    _page_history: List[Tuple[VisitedPage, Any]]
     _custom_name = None
 
     def __init__(self, _custom_name=None, **kwargs):
         self.routes = {}
         self._handle_route = {}
+        self._route_plans = {}
+        self._state_secret = None
         self.configuration = ServerConfiguration(**kwargs)
-        self._state = None
+        self._configuration_version = 0
+        self._page_shells = {}
+        self.assets = AssetRegistry()
+        self.blobs = BLOB_STORE
+        self.plots = PLOT_RENDERER
+        self.metrics = ServerMetrics(self.count_sessions)
         self._initial_state = None
+        self._initial_state_value = None
         self._initial_state_type = None
-        self._state_history = []
-        self._state_frozen_history = []
-        self._page_history = []
-        self._conversion_record = []
+        self.sessions: Optional[SessionStore] = None
+        self._history_spill: Optional[HistorySpillLog] = None
+        self._history_spill_lock = RLock()
+        self._session_locks = SessionLocks()
+        self._default_session = self.new_session(DEFAULT_SESSION_ID)
+        self._local = RequestLocal()
         self._site_information = None
         self.original_routes = []
         self.app = None
@@ -157,6 +276,14 @@ class Server:
     def set_information(self, **kwargs):
         self._site_information = SiteInformation(**kwargs)
 
+    def configuration_changed(self):
+        """
+        Notes that the configuration has changed (e.g., a new header, CSS, style, or title),
+        so that the page shell will be rebuilt for the next page.
+        """
+        self._configuration_version += 1
+        self._page_shells.clear()
+
     def __repr__(self):
         """
         Provides a string representation of the current server object. If a custom
@@ -172,6 +299,172 @@ class Server:
             return self._custom_name
         return f"Server({self.configuration!r})"
 
+    def current_session(self) -> Session:
+        """
+        Gets the session of the visitor whose request is currently being handled. Outside of
+        a request (e.g., while testing, or when running in Skulpt), this is a single default session.
+
+        :return: The current session.
+        :rtype: Session
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            return self._default_session
+        return session
+
+    @property
+    def _state(self):
+        return self.current_session().state
+
+    @_state.setter
+    def _state(self, value):
+        self.current_session().state = value
+
+    @property
+    def _state_history(self) -> List[Any]:
+        return self.current_session().state_history
+
+    @property
+    def _state_frozen_history(self) -> List[Any]:
+        return self.current_session().state_frozen_history
+
+    @property
+    def _page_history(self) -> List[Tuple[VisitedPage, Any]]:
+        return self.current_session().page_history
+
+    @property
+    def _conversion_record(self) -> List[Any]:
+        return self.current_session().conversion_record
+
+    def set_session_store(self, store: SessionStore):
+        """
+        Replaces the store used to keep track of visitors' sessions. Any existing sessions
+        in the old store are not carried over.
+
+        :param store: The new session store.
+        :type store: SessionStore
+        """
+        self.sessions = store
+
+    def new_session(self, session_id=None) -> Session:
+        """
+        Creates a new session, starting with a fresh copy of the initial state.
+
+        :param session_id: The identifier for the session; a random one is made if not given.
+        :type session_id: str
+        :return: The new session.
+        :rtype: Session
+        """
+        if session_id is None:
+            session_id = new_session_id()
+        return Session(session_id, deepcopy(self._initial_state_value),
+                       state_history=HistoryBuffer(self.configuration.history_max_entries),
+                       page_history=DeltaHistoryBuffer(self.configuration.history_max_entries,
+                                                       self.configuration.history_max_bytes,
+                                                       estimate_visit_size,
+                                                       self.configuration.history_keyframe_interval))
+
+    def spill_history(self, session: Session, evicted):
+        """
+        Handles page history entries that were evicted from a session's history. If the
+        ``history_spill_path`` is configured, they are appended to the compressed history log;
+        otherwise, they are simply dropped.
+
+        :param session: The session that the entries were evicted from.
+        :param evicted: The evicted entries, each a tuple of the visited page and the old state.
+        """
+        if not evicted or not self.configuration.history_spill_path:
+            return
+        with self._history_spill_lock:
+            if self._history_spill is None or self._history_spill.path != self.configuration.history_spill_path:
+                self._history_spill = HistorySpillLog(self.configuration.history_spill_path)
+            spill = self._history_spill
+        for visit, old_state in evicted:
+            spill.write(session.session_id, visit, old_state)
+
+    def requested_session_id(self) -> Optional[str]:
+        """
+        Reads the session identifier from the current request's session cookie.
+
+        :return: The identifier, or None if there is no cookie (or no session store).
+        :rtype: str or None
+        """
+        if self.configuration.skulpt or self.sessions is None:
+            return None
+        return request.get_cookie(SESSION_COOKIE_KEY) or None
+
+    def resolve_session(self, session_id: Optional[str] = None) -> Session:
+        """
+        Finds the session for the visitor making the current request, based on their session
+        cookie. If they do not have a (live) session, then a new one is created and the cookie
+        is set on the response.
+
+        :param session_id: The identifier from the session cookie, if it has already been read.
+        :type session_id: str or None
+        :return: The visitor's session.
+        :rtype: Session
+        """
+        if self.configuration.skulpt or self.sessions is None:
+            return self._default_session
+        if session_id is None:
+            session_id = self.requested_session_id()
+        session = self.sessions.load(session_id) if session_id else None
+        if session is None:
+            session = self.new_session()
+            response.set_cookie(SESSION_COOKIE_KEY, session.session_id, path='/', httponly=True)
+        session.touch()
+        return session
+
+    @contextmanager
+    def session_scope(self, session: Optional[Session] = None):
+        """
+        Binds the current visitor's session for the duration of a request, so that the state and
+        history used while handling it belong to that visitor. The session is saved back to the
+        session store afterwards. Nested scopes (e.g., the reset page rendering the index page)
+        reuse the already bound session.
+
+        The session's lock is held for the whole scope (and taken before the session is loaded),
+        so concurrent requests from the same visitor take turns. This keeps the state and the
+        conversion record scoped to a single request at a time, even when serving with threads.
+
+        :param session: The session to bind; by default, the one for the current request's cookie.
+            Streamed pages use this to rebind their session while the rest of the page is sent.
+        :return: A context manager that provides the bound session.
+        """
+        bound = getattr(self._local, 'session', None)
+        if bound is not None:
+            yield bound
+            return
+        session_id = self.requested_session_id() if session is None else session.session_id
+        if session_id is None and self.sessions is not None and not self.configuration.skulpt:
+            # A visitor without a cookie gets a brand new session, which no other request can be using
+            session_lock = nullcontext()
+        else:
+            session_lock = self._session_locks.get(session_id or DEFAULT_SESSION_ID)
+        with session_lock:
+            if session is None:
+                session = self.resolve_session(session_id)
+            self._local.session = session
+            try:
+                yield session
+            finally:
+                self._local.session = None
+                if session is not self._default_session and self.sessions is not None:
+                    self.sessions.save(session)
+
+    def in_session(self, handler):
+        """
+        Wraps a route handler so that it runs inside of the current visitor's session.
+
+        :param handler: The route handler to wrap.
+        :return: The wrapped handler.
+        """
+        @wraps(handler)
+        def session_handler(*args, **kwargs):
+            with self.session_scope():
+                return handler(*args, **kwargs)
+        return session_handler
+
     def clear_routes(self):
         """
         Clears all stored routes from the `routes` attribute.
@@ -186,25 +479,36 @@ class Server:
     def dump_state(self):
         """
         Converts the current internal state of the State object into a JSON-encoded
-        string. The internal state must be dehydratable using the provided
-        utility function `dehydrate_json`.
+        string, using the codec compiled for the initial state's type (which falls back
+        to the utility function `dehydrate_json` for anything it does not recognize).
 
         :raises TypeError: If any part of the internal state cannot be
             serialized into JSON due to invalid types.
         :raises ValueError: If serialization encounters unexpected value
             constraints or data inconsistencies.
 
+        The result is cached in the session, and reused as long as the state is the
+        same object and no route has been called since (see ``StateDumpCache``).
+
         :return: A JSON string capturing the serialized format of the
             object's state.
         :rtype: str
         """
-        return json.dumps(dehydrate_json(self._state))
+        session = self.current_session()
+        cache = session.dump_cache
+        if cache is None:
+            cache = session.dump_cache = StateDumpCache()
+        hits = cache.hits
+        dumped = cache.dump(session.state, get_codec(self._initial_state_type).encode)
+        self.metrics.state_dumps.inc(("hit",) if cache.hits > hits else ("miss",))
+        return dumped
 
     def load_from_state(self, state, state_type):
         """
         Loads a specific State object from a serialized state based on the given state type.
         This method takes a serialized JSON string representation of a state and
-        rehydrates it into the corresponding Python object according to the given state type.
+        rehydrates it into the corresponding Python object according to the given state type,
+        using the codec compiled for that type.
 
         :param state: The serialized JSON string representation of the object state.
         :type state: str
@@ -213,7 +517,7 @@ class Server:
         :return: The rehydrated Python object based on the state and state_type.
         :rtype: Any
         """
-        return rehydrate_json(json.loads(state), state_type)
+        return get_codec(state_type).decode(json.loads(state))
 
     def restore_state_if_available(self, original_function):
         """
@@ -228,16 +532,56 @@ class Server:
         :return: None
         """
         params = get_params()
-        if RESTORABLE_STATE_KEY in params:
-            # Get state
-            old_state = json.loads(params.pop(RESTORABLE_STATE_KEY))
-            # Get state type
-            parameters = inspect.signature(original_function).parameters
-            if 'state' in parameters:
-                state_type = parameters['state'].annotation
-                self._state = rehydrate_json(old_state, state_type)
+        history_entry = params.pop(RESTORABLE_HISTORY_KEY, None)
+        token = params.pop(RESTORABLE_STATE_KEY, None)
+        stateless = self.configuration.stateless
+        if history_entry is not None:
+            # Reconstruct the state from an entry of the page history
+            old_state = self.state_from_history(history_entry)
+            if old_state is None:
+                return
+        elif token is not None:
+            # Get state, either from a signed token or as raw JSON
+            if is_state_token(token):
+                try:
+                    old_state = self.read_state_token(token)
+                except StateTokenError as e:
+                    self.flash_warning(f"Could not restore the state: {e}")
+                    return
+            elif stateless:
+                self.flash_warning("Could not restore the state: only signed state tokens are accepted in stateless mode.")
+                return
+            else:
+                old_state = token
+        else:
+            return
+        old_state = json.loads(old_state)
+        # Get state type
+        plan = self.get_route_plan(original_function)
+        if plan.has_state():
+            self._state = get_codec(plan.state_type).decode(old_state)
+            if not stateless:
                 self.flash_warning("Successfully restored old state: " + repr(self._state))
 
+    def state_from_history(self, number) -> Optional[str]:
+        """
+        Looks up the state stored with an entry of the current session's page history, which the
+        links in the debug information's history refer to (instead of including the whole state).
+
+        :param number: The entry's number, counting every page load of the session (including
+            the ones that were evicted from the history since).
+        :return: The JSON state, or ``None`` if the entry is no longer (or not yet) in the history.
+        """
+        history = self._page_history
+        try:
+            position = int(number) - getattr(history, 'evicted', 0)
+        except (TypeError, ValueError):
+            position = -1
+        if not 0 <= position < len(history):
+            self.flash_warning(f"Could not restore the state of page load {number!r}: it is no longer in the history.")
+            return None
+        return history[position][1]
+
     def add_route(self, url, func):
         """
         Adds a route to the routing table for URL handling, ensuring the URL is unique
@@ -257,24 +601,50 @@ class Server:
             raise ValueError(f"URL `{url}` already exists for an existing routed function: `{func.__name__}`")
         self.original_routes.append((url, func))
         url = friendly_urls(url)
+        self._route_plans[func] = self.compile_route_plan(func)
         func = self.make_bottle_page(func)
         self.routes[url] = func
         self._handle_route[url] = self._handle_route[func] = func
 
+    def compile_route_plan(self, original_function) -> RoutePlan:
+        """
+        Inspects a route function once, working out its parameters, whether it takes the
+        state, and how to convert the incoming value of each parameter.
+
+        :param original_function: The route function to inspect.
+        :return: The compiled plan for calling the route function.
+        :rtype: RoutePlan
+        """
+        return compile_route_plan(original_function, self.make_converter)
+
+    def get_route_plan(self, original_function) -> RoutePlan:
+        """
+        Gets the precompiled plan for the given route function, compiling (and remembering) it
+        if the function was not added through ``add_route``.
+
+        :param original_function: The route function.
+        :return: The plan for calling the route function.
+        :rtype: RoutePlan
+        """
+        plan = self._route_plans.get(original_function)
+        if plan is None:
+            plan = self._route_plans[original_function] = self.compile_route_plan(original_function)
+        return plan
+
     def reset(self):
         """
-        Resets the current State object to its initial configuration and clears all
-        recorded histories. After resetting, the function returns the result of the
+        Resets the current session's State object to its initial configuration and clears all
+        of its recorded histories. After resetting, the function returns the result of the
         route mapped to '/' (the root index URL).
 
         :return: The result of the '/' route execution.
         :rtype: Page
         """
-        self._state = self.load_from_state(self._initial_state, self._initial_state_type)
-        self._state_history.clear()
-        self._state_frozen_history.clear()
-        self._page_history.clear()
-        self._conversion_record.clear()
+        session = self.current_session()
+        session.state = self.load_from_state(self._initial_state, self._initial_state_type)
+        session.clear_history()
+        if self._history_spill is not None:
+            self._history_spill.flush()
         return self.routes['/']()
 
     # Helper function to render different SiteInformationType values
@@ -363,9 +733,21 @@ class Server:
         :param initial_state: The initial state to set up the application.
         :type initial_state: Any
         """
+        self.configuration_changed()
+        if self.configuration.stateless and not self.configuration.state_secret:
+            logger.warning("Stateless mode is on, but no state_secret (DRAFTER_STATE_SECRET) is set, so each"
+                           " worker only accepts the state tokens that it made itself.")
+        self.blobs.configure(self.configuration.blob_max_bytes, self.configuration.blob_path,
+                             not (self.configuration.inline_images or self.configuration.skulpt))
+        self.plots.configure(self.configuration.plot_cache_size,
+                             0 if self.configuration.skulpt else self.configuration.plot_workers)
+        self._default_session = self.new_session(DEFAULT_SESSION_ID)
         self._state = initial_state
-        self._initial_state = self.dump_state()
         self._initial_state_type = type(initial_state)
+        self._initial_state = self.dump_state()
+        self._initial_state_value = deepcopy(initial_state)
+        if self.sessions is None and not self.configuration.skulpt:
+            self.sessions = make_session_store(self.configuration)
         self.app = Bottle()
 
         # Setup error pages
@@ -410,11 +792,17 @@ class Server:
         # Setup routes
         if not self.routes:
             raise ValueError("No routes have been defined.\nDid you remember the @route decorator?")
-        self.app.route("/--reset", 'GET', self.reset)
-        self.app.route("/--about", "GET", self.about)
+        self.app.route("/--reset", 'GET', self.in_session(self.reset))
+        self.app.route("/--about", "GET", self.in_session(self.about))
         # If not skulpt, then allow them to test the deployment
         if not self.configuration.skulpt:
             self.app.route("/--test-deployment", 'GET', self.test_deployment)
+            self.app.route("/--assets/<filename>", 'GET', self.serve_asset)
+            self.app.route("/--blobs/<filename>", 'GET', self.serve_blob)
+            if self.configuration.metrics:
+                self.app.route("/--metrics", 'GET', self.serve_metrics)
+            self.app.route("/--debug", 'GET', self.in_session(self.debug_page))
+            self.app.route("/--debug/<section>", 'GET', self.in_session(self.debug_section))
         for url, func in self.routes.items():
             self.app.route(url, 'GET', func)
             self.app.route(url, "POST", func)
@@ -440,15 +828,98 @@ class Server:
         safe_kwargs = {key: value for key, value in kwargs.items() if key in safe_key_names}
         updated_configuration = replace(self.configuration, **safe_kwargs)
         self.configuration = updated_configuration
+        self.configuration_changed()
         # Update the final args with the new configuration
         final_args.update(kwargs)
+        from drafter.serving import choose_server_adapter
+        adapter = choose_server_adapter(self.configuration.workers, self.configuration.threads)
+        if adapter is not None:
+            final_args.setdefault('server', adapter)
+            final_args.setdefault('before_fork', self.before_fork)
+            final_args.setdefault('after_fork', self.after_fork)
+            final_args.setdefault('before_exit', self.before_exit)
+        if self.configuration.workers > 1 and isinstance(self.sessions, MemorySessionStore):
+            logger.warning("Each worker process keeps its own sessions in memory, so visitors may lose their state"
+                           " between requests. Consider using session_store='sqlite' with multiple workers.")
+        if self.configuration.workers > 1 and self.blobs.enabled and not self.configuration.blob_path:
+            # Each worker would keep the images it stored to itself, so the others could not serve them
+            logger.warning("Each worker process would keep its own images, so they are inlined into pages instead."
+                           " Set blob_path (DRAFTER_BLOB_PATH) to a shared folder to serve them from /--blobs/.")
+            self.blobs.configure(self.configuration.blob_max_bytes, '', False)
+        if self.configuration.workers <= 1:
+            # Fork the plotting processes before the server starts any threads (workers fork their own)
+            self.plots.start()
         self.app.run(**final_args)
 
+    def wsgi_app(self, initial_state=None):
+        """
+        Sets up the server and returns its WSGI application, without starting a server. This lets
+        the site run under any WSGI server (e.g., ``gunicorn``), which should be pointed at the result.
+        Every request goes through the same pipeline as with ``start_server``.
+
+        :param initial_state: The initial state for every visitor.
+        :type initial_state: Any
+        :return: The WSGI application.
+        :rtype: Bottle
+        """
+        self.setup(initial_state)
+        return self.app
+
+    def asgi_app(self, initial_state=None, executor=None):
+        """
+        Sets up the server and returns an ASGI application for it, without starting a server. This
+        lets the site run under any ASGI server (e.g., ``uvicorn``). Requests are handled by the
+        WSGI application from ``wsgi_app``, on worker threads. Request bodies are spooled to disk past
+        ``upload_spool_size``, and refused past ``upload_max_request_size``.
+
+        :param initial_state: The initial state for every visitor.
+        :type initial_state: Any
+        :param executor: The ``concurrent.futures`` executor to handle requests on; by default,
+            the event loop's default executor.
+        :return: The ASGI application.
+        :rtype: AsgiAdapter
+        """
+        from drafter.serving import AsgiAdapter
+        app = self.wsgi_app(initial_state)
+        return AsgiAdapter(app, executor, self.configuration.upload_max_request_size,
+                           self.configuration.upload_spool_size)
+
+    def before_fork(self):
+        """
+        Called once, before forking the worker processes, to write out anything that the
+        workers should not each write again (e.g., the pending history log entries), and to
+        stop anything that should not be copied into them (e.g., the plotting processes).
+        """
+        if self._history_spill is not None:
+            self._history_spill.flush()
+        self.plots.shutdown()
+
+    def after_fork(self):
+        """
+        Called in each worker process after forking, to replace anything that cannot be shared
+        between processes (e.g., database connections).
+        """
+        if self.sessions is not None:
+            self.sessions.reopen()
+        self.plots.start()
+
+    def before_exit(self):
+        """
+        Called in each worker process before it exits, to write out anything the worker still holds
+        (e.g., the pending history log entries) and stop or remove anything that it started (e.g., its
+        plotting processes and temporary blob folder). Workers leave without running ``atexit`` functions.
+        """
+        if self._history_spill is not None:
+            self._history_spill.flush()
+        self.plots.shutdown()
+        self.blobs.remove_temporary_folder()
+
     def prepare_args(self, original_function, args, kwargs):
         """
         Processes and prepares arguments for the route function call, ensuring compatibility
         with expected parameters, handling state insertion, remapping parameters,
-        and performing type conversion when necessary.
+        and performing type conversion when necessary. The route's precompiled plan
+        provides the expected parameters and the converter for each of them.
 
         :param original_function: The function whose parameters are being prepared.
         :param args: The positional arguments to be passed to the function.
@@ -461,7 +932,9 @@ class Server:
             - A string representation of the final arguments for logging or debugging.
             - The button pressed if detected and processed.
         """
-        self._conversion_record.clear()
+        conversion_record = self._conversion_record
+        conversion_record.clear()
+        plan = self.get_route_plan(original_function)
         args = list(args)
         kwargs = dict(**kwargs)
         button_pressed = ""
@@ -474,14 +947,10 @@ class Server:
         param_keys = list(params.keys())
         for key in param_keys:
             kwargs[key] = params.pop(key)
-        signature_parameters = inspect.signature(original_function).parameters
-        expected_parameters = list(signature_parameters.keys())
-        show_names = {param.name: (param.kind in (inspect.Parameter.KEYWORD_ONLY, inspect.Parameter.VAR_KEYWORD))
-                      for param in signature_parameters.values()}
+        expected_parameters = plan.names
         kwargs = remap_hidden_form_parameters(kwargs, button_pressed)
         # Insert state into the beginning of args
-        if (expected_parameters and expected_parameters[0] == "state") or (
-                len(expected_parameters) - 1 == len(args) + len(kwargs)):
+        if plan.state_first or (len(expected_parameters) - 1 == len(args) + len(kwargs)):
             args.insert(0, self._state)
         # Check if there are too many arguments
         if len(expected_parameters) < len(args) + len(kwargs):
@@ -494,22 +963,20 @@ class Server:
             while len(expected_parameters) < len(args) + len(kwargs) and kwargs:
                 kwargs.pop(list(kwargs.keys())[-1])
         # Type conversion if required
-        expected_types = {name: p.annotation for name, p in
-                          inspect.signature(original_function).parameters.items()}
-        args = [self.convert_parameter(param, val, expected_types)
+        args = [plan.convert(param, val, conversion_record)
                 for param, val in zip(expected_parameters, args)]
-        kwargs = {param: self.convert_parameter(param, val, expected_types)
+        kwargs = {param: plan.convert(param, val, conversion_record)
                   for param, val in kwargs.items()}
         # Verify all arguments are in expected_parameters
         for key, value in kwargs.items():
-            if key not in expected_parameters:
+            if key not in plan.positions:
                 raise ValueError(
                     f"Unexpected parameter {key}={value!r} in {original_function.__name__}. "
                     f"Expected parameters: {expected_parameters}")
         # Final return result
         representation = [safe_repr(arg) for arg in args] + [
-            f"{key}={safe_repr(value)}" if show_names.get(key, False) else safe_repr(value)
-            for key, value in sorted(kwargs.items(), key=lambda item: expected_parameters.index(item[0]))]
+            f"{key}={safe_repr(value)}" if plan.parameters[key].show_name else safe_repr(value)
+            for key, value in sorted(kwargs.items(), key=lambda item: plan.positions[item[0]])]
         return args, kwargs, ", ".join(representation), button_pressed
 
     def handle_images(self):
@@ -538,12 +1005,106 @@ class Server:
         """
         return static_file(path, root='./' + self.configuration.src_image_folder, mimetype='image/png')
 
+    def serve_asset(self, filename):
+        """
+        Serves one of the content-hashed theme files. Since the filename changes whenever the
+        contents do, the browser is told that it can cache the file forever.
+
+        :param filename: The hashed filename of the asset (e.g., ``0123abcd.css``).
+        :type filename: str
+        :return: The contents of the asset, or an empty body if the browser's copy is current.
+        :rtype: bytes
+        """
+        asset = self.assets.get(filename)
+        if asset is None:
+            abort(404, f"Unknown asset {filename!r}")
+        response.set_header('ETag', asset.etag)
+        response.set_header('Cache-Control', ASSET_CACHE_CONTROL)
+        if request.headers.get('If-None-Match') == asset.etag:
+            response.status = 304
+            return b""
+        response.content_type = asset.content_type
+        encoding = self.choose_encoding(len(asset.content))
+        return asset.encoded(encoding, self.configuration.compression_level)
+
+    def serve_blob(self, filename):
+        """
+        Serves one of the content-hashed images (e.g., a PIL image shown on a page). Since the
+        filename changes whenever the contents do, the browser is told that it can cache the file
+        forever. Images are already compressed, so they are sent as they are.
+
+        :param filename: The hashed filename of the blob (e.g., ``0123abcd....png``).
+        :type filename: str
+        :return: The contents of the blob, or an empty body if the browser's copy is current.
+        :rtype: bytes
+        """
+        blob = self.blobs.get(filename)
+        if blob is None:
+            abort(404, f"Unknown blob {filename!r}")
+        response.set_header('ETag', blob.etag)
+        response.set_header('Cache-Control', BLOB_CACHE_CONTROL)
+        if request.headers.get('If-None-Match') == blob.etag:
+            response.status = 304
+            return b""
+        response.content_type = blob.content_type
+        return blob.content
+
+    def choose_encoding(self, size):
+        """
+        Decides how to compress a response of the given size for the current request, based on
+        the browser's ``Accept-Encoding`` header and the compression settings. If the response
+        will be compressed, the ``Content-Encoding`` header is set too.
+
+        :param size: The size of the uncompressed response, in bytes, or None if it is not known
+            ahead of time (e.g., for a streamed page).
+        :type size: int or None
+        :return: The content encoding to use, or None if the response should not be compressed.
+        :rtype: str or None
+        """
+        if self.configuration.skulpt or self.configuration.compression_level <= 0:
+            return None
+        response.add_header('Vary', 'Accept-Encoding')
+        if size is not None and size < self.configuration.compression_min_size:
+            return None
+        encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is not None:
+            response.set_header('Content-Encoding', encoding)
+        return encoding
+
+    def compress_page(self, page):
+        """
+        Compresses the rendered page, if the browser accepts a compressed response and the
+        page is large enough to be worth compressing. Streamed pages are compressed as they
+        are sent, regardless of their size.
+
+        :param page: The complete HTML of the page, or an iterator of its chunks if it is streamed.
+        :type page: str or Iterator[str]
+        :return: The page, either unchanged or compressed.
+        :rtype: str or bytes or Iterator[str] or Iterator[bytes]
+        """
+        if isinstance(page, Iterator):
+            encoding = self.choose_encoding(None)
+            if encoding is None:
+                return page
+            return compress_iter((chunk.encode('utf-8') for chunk in page), encoding,
+                                 self.configuration.compression_level)
+        if not isinstance(page, str):
+            return page
+        body = page.encode('utf-8')
+        encoding = self.choose_encoding(len(body))
+        if encoding is None:
+            return page
+        return compress(body, encoding, self.configuration.compression_level)
+
     def try_special_conversions(self, value, target_type):
         """
         Attempts to convert the input value to the specified target type using various
         specialized conversion methods. This method is designed to handle specific types
         of input, such as `bottle.FileUpload`, supporting conversion to bytes, string,
-        dictionary, and, if available, `PIL.Image`.
+        dictionary, and, if available, `PIL.Image`. Streamed uploads (`Upload`) can also be
+        converted to a file handle (`BinaryIO`), an iterator of chunks (`Iterator[bytes]`), or a
+        `pathlib.Path`, without reading the whole file into memory; those are only usable until
+        the request is finished.
 
         :param value: The input value to be converted. Typically, this is expected
             to be an instance of `bottle.FileUpload`.
@@ -561,6 +1122,16 @@ class Server:
             opened as an image using PIL.Image when `HAS_PILLOW` is `True`.
         """
         if isinstance(value, bottle.FileUpload):
+            if isinstance(value, Upload):
+                target_origin = getattr(target_type, '__origin__', target_type)
+                if target_type in (typing.BinaryIO, typing.IO) or target_origin is typing.IO:
+                    value.file.seek(0)
+                    return value.file
+                elif target_origin in (collections.abc.Iterator, collections.abc.Iterable):
+                    return value.chunks()
+                elif isinstance(target_type, type) and issubclass(target_type, pathlib.PurePath):
+                    return target_type(value.path)
+                value.file.seek(0)
             if target_type == bytes:
                 return target_type(value.file.read())
             elif target_type == str:
@@ -574,11 +1145,17 @@ class Server:
                 try:
                     if not value or not value.file:
                         return None
-                    contents = value.file.read()
-                    if not contents:
+                    if isinstance(value, Upload):
+                        # The size is already known, so the file does not have to be read to check it
+                        if not value.size:
+                            return None
+                    elif not value.file.read():
                         return None
                     value.file.seek(0)
                     image = PILImage.open(value.file)
+                    if isinstance(value, Upload):
+                        # The upload is closed once the request is finished, so the image is read now
+                        image.load()
                     image.filename = value.filename
                     return image
                 except Exception as e:
@@ -586,12 +1163,57 @@ class Server:
                     raise ValueError(f"Could not open image file {value.filename} as a PIL.Image. Perhaps the file is not an image, or the parameter type is inappropriate?") from e
         return target_type(value)
 
+    def make_converter(self, param, expected_type):
+        """
+        Creates the converter for a route parameter with the given type annotation. The
+        converter turns an incoming value into the expected type if possible, and records
+        successful conversions, unchanged parameters, and failed conversion attempts.
+
+        :param param: The name of the parameter to be converted.
+        :type param: str
+        :param expected_type: The type annotation of the parameter, or ``inspect.Parameter.empty``
+            if the parameter does not require conversion.
+        :type expected_type: Any
+        :return: A function that takes the incoming value and the list of conversion records,
+            and returns the converted value.
+        :rtype: Callable[[Any, list], Any]
+        """
+        if expected_type == inspect.Parameter.empty:
+            def convert_unannotated(val, record):
+                record.append(UnchangedRecord(param, val, expected_type))
+                return val
+            return convert_unannotated
+        check_type = expected_type
+        if hasattr(check_type, '__origin__'):
+            # TODO: Ignoring the element type for now, but should really handle that properly
+            check_type = check_type.__origin__
+        try:
+            to_name = expected_type.__name__
+        except AttributeError:
+            to_name = repr(expected_type)
+
+        def convert(val, record):
+            if isinstance(val, check_type):
+                record.append(UnchangedRecord(param, val))
+                return val
+            try:
+                converted_arg = self.try_special_conversions(val, expected_type)
+            except Exception as e:
+                raise ValueError(
+                    f"Could not convert {param} ({val!r}) from {type(val).__name__} to {to_name}\n") from e
+            record.append(ConversionRecord(param, val, expected_type, converted_arg))
+            return converted_arg
+        return convert
+
     def convert_parameter(self, param, val, expected_types):
         """
         Converts a given parameter value to a specified target type if possible, based
         on the expected types provided. Records successful conversions, unchanged
         parameters, and failed conversion attempts with detailed information.
 
+        Route requests use the converters precompiled by ``make_converter`` instead; this
+        method remains for converting one-off values.
+
         :param param: The name of the parameter to be converted.
         :type param: str
         :param val: The value of the parameter to be converted.
@@ -608,28 +1230,7 @@ class Server:
             type, providing detailed information about the attempted conversion.
         """
         if param in expected_types:
-            expected_type = expected_types[param]
-            if expected_type == inspect.Parameter.empty:
-                self._conversion_record.append(UnchangedRecord(param, val, expected_types[param]))
-                return val
-            if hasattr(expected_type, '__origin__'):
-                # TODO: Ignoring the element type for now, but should really handle that properly
-                expected_type = expected_type.__origin__
-            if not isinstance(val, expected_type):
-                try:
-                    target_type = expected_types[param]
-                    converted_arg = self.try_special_conversions(val, target_type)
-                    self._conversion_record.append(ConversionRecord(param, val, expected_types[param], converted_arg))
-                except Exception as e:
-                    try:
-                        from_name = type(val).__name__
-                        to_name = expected_types[param].__name__
-                    except:
-                        from_name = repr(type(val))
-                        to_name = repr(expected_types[param])
-                    raise ValueError(
-                        f"Could not convert {param} ({val!r}) from {from_name} to {to_name}\n") from e
-                return converted_arg
+            return self.make_converter(param, expected_types[param])(val, self._conversion_record)
         # Fall through
         self._conversion_record.append(UnchangedRecord(param, val))
         return val
@@ -639,7 +1240,8 @@ class Server:
         A decorator that wraps a given function to create and manage a Bottle web
         page environment. This includes processing request parameters, building
         the page, verifying its content, and rendering it to the client. It also
-        maintains state and history for the page creation and execution process.
+        maintains state and history for the page creation and execution process,
+        inside of the current visitor's session.
 
         :param original_function: The original callable function to be wrapped
             and executed to construct the page.
@@ -648,47 +1250,259 @@ class Server:
         """
         @wraps(original_function)
         def bottle_page(*args, **kwargs):
-            # TODO: Handle non-bottle backends
-            url = remove_url_query_params(request.url, {RESTORABLE_STATE_KEY, SUBMIT_BUTTON_KEY})
-            self.restore_state_if_available(original_function)
-            original_state = self.dump_state()
+            started = monotonic()
+            timer = PhaseTimer()
             try:
-                args, kwargs, arguments, button_pressed = self.prepare_args(original_function, args, kwargs)
-            except Exception as e:
-                return self.make_error_page("Error preparing arguments for page", e, original_function)
-            # Actually start building up the page
-            visiting_page = VisitedPage(url, original_function, arguments, "Creating Page", button_pressed)
-            self._page_history.append((visiting_page, original_state))
+                self.read_uploads()
+                with self.session_scope():
+                    page = self.build_page(original_function, args, kwargs, timer)
+            except bottle.HTTPResponse as error_page:
+                # Error pages replace the response's headers with their own
+                self.send_server_timing(error_page, timer)
+                self.record_request(original_function.__name__, started)
+                raise
+            finally:
+                close_uploads(request.environ)
+            self.send_server_timing(response, timer)
+            return self.record_request(original_function.__name__, started, self.compress_page(page))
+        return bottle_page
+
+    def read_uploads(self):
+        """
+        Streams the current request's uploaded files (if any) into memory or temporary files, within
+        the configured size limits. Requests that are too large are refused with a ``413`` response,
+        and ones that cannot be parsed with a ``400`` response.
+        """
+        if self.configuration.skulpt:
+            return
+        limits = UploadLimits(self.configuration.upload_max_request_size, self.configuration.upload_max_file_size,
+                              self.configuration.upload_spool_size, self.configuration.upload_hash)
+        try:
+            read_uploads(request.environ, limits)
+        except UploadTooLarge as e:
+            abort(413, str(e))
+        except MalformedUpload as e:
+            abort(400, str(e))
+
+    def record_request(self, route_name, started, body=None):
+        """
+        Counts a request to a route in the server's metrics, along with how long it took and how
+        big the response was. A streamed response is measured once it has been completely sent.
+
+        :param route_name: The name of the route function.
+        :type route_name: str
+        :param started: When the request started, from ``drafter.timing.monotonic``.
+        :type started: float
+        :param body: The body of the response, if there is one.
+        :type body: str or bytes or Iterator
+        :return: The body, wrapped so that it is measured as it is sent if it is streamed.
+        """
+        metrics = self.metrics
+        labels = (route_name,)
+        metrics.requests.inc(labels)
+        if isinstance(body, Iterator):
+            def measure(chunks):
+                size = 0
+                try:
+                    for chunk in chunks:
+                        size += len(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+                        yield chunk
+                finally:
+                    metrics.latency.observe(monotonic() - started, labels)
+                    metrics.response_size.observe(size, labels)
+            return measure(body)
+        metrics.latency.observe(monotonic() - started, labels)
+        if isinstance(body, str):
+            metrics.response_size.observe(len(body.encode('utf-8')), labels)
+        elif isinstance(body, bytes):
+            metrics.response_size.observe(len(body), labels)
+        return body
+
+    def record_history_size(self, session, state):
+        """
+        Updates the metrics' gauges with the size of the visitor's history and state.
+
+        :param session: The current visitor's session.
+        :type session: Session
+        :param state: The visitor's state, as serialized by ``dump_state``.
+        :type state: str
+        """
+        self.metrics.history_entries.set(len(session.page_history))
+        self.metrics.history_bytes.set(getattr(session.page_history, 'total_bytes', 0))
+        self.metrics.state_bytes.set(len(state) if isinstance(state, str) else 0)
+
+    def count_sessions(self):
+        """
+        Counts the sessions currently kept by the server, for the metrics.
+
+        :return: The number of sessions in the session store (or one, if there is no store).
+        :rtype: int
+        """
+        return len(self.sessions) if self.sessions is not None else 1
+
+    def serve_metrics(self):
+        """
+        Serves the request metrics in the Prometheus text format, for monitoring tools to collect.
+
+        :return: The current value of every metric.
+        :rtype: str
+        """
+        response.content_type = PROMETHEUS_CONTENT_TYPE
+        response.set_header('Cache-Control', 'no-store')
+        return self.metrics.render()
+
+    def send_server_timing(self, target, timer):
+        """
+        Adds the timings of the request's phases to the response as a ``Server-Timing`` header.
+
+        :param target: The response (or error response) to add the header to.
+        :param timer: The timer that measured the request's phases.
+        :type timer: PhaseTimer
+        """
+        timer.stop()
+        if not self.configuration.skulpt:
+            target.set_header('Server-Timing', format_server_timing(timer.timings))
+
+    def build_page(self, original_function, args, kwargs, timer=None):
+        """
+        Builds the page for a single request to a route, within the current visitor's session:
+        restores and prepares the arguments, calls the route function, verifies the result, and
+        renders it to a complete HTML page. Each of those phases is timed, and the timings are
+        kept with the page's entry in the page history.
+
+        :param original_function: The route function being visited.
+        :param args: The positional arguments provided by Bottle.
+        :param kwargs: The keyword arguments provided by Bottle.
+        :param timer: The timer to record the phases with; a new one is used if not given.
+        :type timer: PhaseTimer
+        :return: The rendered HTML of the page.
+        :rtype: str
+        """
+        if timer is None:
+            timer = PhaseTimer()
+        # TODO: Handle non-bottle backends
+        url = remove_url_query_params(request.url, {RESTORABLE_STATE_KEY, RESTORABLE_HISTORY_KEY, SUBMIT_BUTTON_KEY})
+        # In production, none of the history is kept, so it does not need to be captured either
+        production = self.configuration.production
+        timer.start("restore_state_if_available")
+        self.restore_state_if_available(original_function)
+        original_state = None
+        if not production:
+            timer.start("dump_state")
             try:
-                page = original_function(*args, **kwargs)
+                original_state = self.dump_state()
             except Exception as e:
-                additional_details = (f"  Arguments: {args!r}\n"
-                                      f"  Keyword Arguments: {kwargs!r}\n"
-                                      f"  Button Pressed: {button_pressed!r}\n"
-                                      f"  Function Signature: {inspect.signature(original_function)}")
-                return self.make_error_page("Error creating page", e, original_function, additional_details)
+                return self.make_error_page("Error saving state", e, original_function)
+        timer.start("prepare_args")
+        try:
+            args, kwargs, arguments, button_pressed = self.prepare_args(original_function, args, kwargs)
+        except Exception as e:
+            return self.make_error_page("Error preparing arguments for page", e, original_function)
+        # Actually start building up the page
+        visiting_page = VisitedPage(url, original_function, arguments, "Creating Page", button_pressed,
+                                    timings=timer.timings)
+        session = self.current_session()
+        if not production:
+            self.spill_history(session, session.page_history.append((visiting_page, original_state)))
+            self.record_history_size(session, original_state)
+        timer.start("route")
+        if session.dump_cache is not None:
+            # The route may change the state in place, so its earlier dump cannot be reused
+            session.dump_cache.clear()
+        try:
+            page = original_function(*args, **kwargs)
+        except Exception as e:
+            additional_details = (f"  Arguments: {args!r}\n"
+                                  f"  Keyword Arguments: {kwargs!r}\n"
+                                  f"  Button Pressed: {button_pressed!r}\n"
+                                  f"  Function Signature: {self.get_route_plan(original_function).signature}")
+            return self.make_error_page("Error creating page", e, original_function, additional_details)
+        timer.start("verify_page_result")
+        if not production:
             visiting_page.update("Verifying Page Result", original_page_content=page)
-            verification_status = self.verify_page_result(page, original_function)
-            if verification_status:
-                return verification_status
-            try:
-                page.verify_content(self)
-            except Exception as e:
-                return self.make_error_page("Error verifying content", e, original_function)
-            self._state_history.append(page.state)
-            self._state = page.state
-            visiting_page.update("Rendering Page Content")
+            if isinstance(session.page_history, HistoryBuffer):
+                self.spill_history(session, session.page_history.remeasure_last())
+        verification_status = self.verify_page_result(page, original_function)
+        if verification_status:
+            return verification_status
+        timer.start("verify_content")
+        try:
+            page.verify_content(self)
+        except Exception as e:
+            return self.make_error_page("Error verifying content", e, original_function)
+        if not production:
+            visiting_page.state_snapshot = self.snapshot_state(page.state)
+            self._state_history.append(visiting_page.state_snapshot)
+        self._state = page.state
+        visiting_page.update("Rendering Page Content")
+        if self.configuration.stream_pages and not self.configuration.skulpt:
+            timer.stop()
+            return self.stream_page(page, visiting_page, original_function, PhaseTimer(timer.timings))
+        timer.start("render_content")
+        try:
+            content, js = page.render_content(self.rendered_state(), self.configuration)
+        except Exception as e:
+            return self.make_error_page("Error rendering content", e, original_function)
+        visiting_page.finish("Finished Page Load")
+        if self.shows_debug_information():
+            timer.start("make_debug_page")
+            content = content + self.make_debug_page()
+        timer.start("wrap_page")
+        content = self.wrap_page(content, js)
+        timer.stop()
+        return content
+
+    def stream_page(self, page, visiting_page, original_function, timer=None):
+        """
+        Starts streaming the rendered page. The page shell's head (with the theme's styles) is
+        sent right away, and the page's content is rendered and sent in chunks as the browser
+        reads it. Since the response has already started by the time the content is rendered,
+        an error while rendering is shown at that spot in the page, rather than as an error page.
+        For the same reason, the time spent rendering is only recorded in the page history, and
+        not in the ``Server-Timing`` header.
+
+        :param page: The verified page returned by the route function.
+        :param visiting_page: The history entry for this visit, finished once the page is sent.
+        :param original_function: The route function being visited.
+        :param timer: The timer to record the rendering phases with.
+        :type timer: PhaseTimer
+        :return: An iterator of chunks of the page's HTML.
+        :rtype: Iterator[str]
+        """
+        if timer is None:
+            timer = PhaseTimer(visiting_page.timings)
+        session = self.current_session()
+        shell = self.get_page_shell()
+        js = page.render_js()
+        try:
+            state = self.rendered_state()
+        except Exception as e:
+            return self.make_error_page("Error saving state", e, original_function)
+        fragments = page.render_iter(state, self.configuration)
+
+        def render_fragments():
+            timer.start("render_content")
             try:
-                content, js = page.render_content(self.dump_state(), self.configuration)
+                yield from fragments
             except Exception as e:
-                return self.make_error_page("Error rendering content", e, original_function)
-            visiting_page.finish("Finished Page Load")
-            if self.configuration.debug:
-                content = content + self.make_debug_page()
-            content = self.wrap_page(content, js)
-            return content
-
-        return bottle_page
+                logger.exception("Error rendering content in %s", original_function.__name__)
+                self.metrics.errors.inc(("Error rendering content",))
+                yield (f"<pre class='btlw-error'>Error rendering content.\n"
+                       f"Error in {original_function.__name__}:\n{html.escape(str(e))}</pre>")
+                visiting_page.finish("Error rendering content")
+            else:
+                visiting_page.finish("Finished Page Load")
+            if self.shows_debug_information():
+                timer.start("make_debug_page")
+                yield self.make_debug_page()
+            timer.stop()
+
+        def stream():
+            yield shell.head + "<div class='btlw'>"
+            with self.session_scope(session):
+                yield from coalesce_chunks(render_fragments(), self.configuration.stream_chunk_size)
+            yield "</div>" + shell.middle + js + shell.tail
+        return stream()
 
     def verify_page_result(self, page, original_function):
         """
@@ -754,27 +1568,47 @@ class Server:
         if message:
             return self.make_error_page("Error after creating page", ValueError(message), original_function)
 
+    def snapshot_state(self, state):
+        """
+        Takes an immutable snapshot of the given state for the history, sharing every part that
+        has not changed with the snapshot of the previous state (see ``drafter.snapshots``).
+        States that cannot be frozen (e.g., because they refer to themselves, or are nested too
+        deeply) are copied instead, or, failing that, kept as they are.
+
+        :param state: The state returned by a route.
+        :return: The snapshot to keep in the state history.
+        """
+        previous = self._state_history[-1] if self._state_history else None
+        try:
+            return take_snapshot(state, previous)
+        except (ValueError, RecursionError):
+            try:
+                return FrozenValue(deepcopy(state))
+            except Exception:
+                return FrozenValue(state)
+
     def verify_page_state_history(self, page, original_function):
         """
         Validates the consistency of the state object's type in the provided `page`
-        against the most recent state stored in the `self._state_history`. If any
+        against the most recent state snapshot stored in the `self._state_history`. If any
         discrepancy is found in the type of the state object, it constructs an error
         message highlighting the inconsistency and generates an error page.
 
         :param page: The page object containing the state to be verified.
         :param original_function: The name of the function that created the page.
         :return: Returns an error page if a validation issue arises, otherwise none.
+            In production, no state history is kept, so nothing is checked.
         """
-        if not self._state_history:
+        if self.configuration.production or not self._state_history:
             return
         message = ""
-        last_type = self._state_history[-1].__class__
+        last_type = snapshot_type(self._state_history[-1])
         if not isinstance(page.state, last_type):
             message = (
                 f"The server did not return a valid Page() object from {original_function}. The state object's type changed from its previous type. The new value is:\n"
                 f" {page.state!r}\n"
                 f"The most recent value was:\n"
-                f" {self._state_history[-1]!r}\n"
+                f" {restore_snapshot(self._state_history[-1])!r}\n"
                 f"The expected type was:\n"
                 f" {last_type}\n"
                 f"Make sure you return the same type each time.")
@@ -785,10 +1619,14 @@ class Server:
     def wrap_page(self, content, js):
         """
         Wraps provided content in a styled HTML template, applying additional headers,
-        scripts, styles, and any configuration-specific content.
+        scripts, styles, and any configuration-specific content. The surrounding HTML
+        is precompiled once per style and configuration version (see ``get_page_shell``),
+        so only the content and extra JavaScript are spliced in for each page.
 
         :param content: The content to be wrapped in the HTML template.
         :type content: str
+        :param js: Any additional script tags for the page.
+        :type js: str
 
         :raises ValueError: If the specified style in the configuration is not found
             in the list of included styles.
@@ -798,7 +1636,35 @@ class Server:
             and selected style.
         :rtype: str
         """
-        content = f"<div class='btlw'>{content}</div>"
+        return self.get_page_shell().render(f"<div class='btlw'>{content}</div>", js)
+
+    def get_page_shell(self) -> PageShell:
+        """
+        Retrieves the precompiled page shell for the current style and configuration version,
+        building it if this is the first page since the configuration changed.
+
+        :raises ValueError: If the specified style in the configuration is not found
+            in the list of included styles.
+        :return: The page shell.
+        :rtype: PageShell
+        """
+        key = (self.configuration.style, self._configuration_version)
+        shell = self._page_shells.get(key)
+        if shell is None:
+            shell = self._page_shells[key] = self.build_page_shell()
+        return shell
+
+    def build_page_shell(self) -> PageShell:
+        """
+        Joins together the theme's scripts and styles, the additional headers and CSS, and the title
+        and footer into the HTML that surrounds every page. Unless ``inline_assets`` is turned off,
+        the theme's files are inlined; otherwise, they are linked to their ``/--assets/`` URLs.
+
+        :raises ValueError: If the specified style in the configuration is not found
+            in the list of included styles.
+        :return: A new page shell.
+        :rtype: PageShell
+        """
         style = self.configuration.style
         global_files = get_raw_files("global")
         style_files = get_raw_files(style)
@@ -806,8 +1672,13 @@ class Server:
             possible_themes = ", ".join(get_themes())
             raise ValueError(f"Unknown style {style}. Please choose from {possible_themes}, or add a custom style tag with add_website_header.")
 
-        scripts = "\n".join([*global_files.scripts.values(), *style_files.scripts.values()])
-        styles = "\n".join([*global_files.styles.values(), *style_files.styles.values()])
+        if self.configuration.inline_assets or self.configuration.skulpt:
+            scripts = "\n".join([*global_files.scripts.values(), *style_files.scripts.values()])
+            styles = "\n".join([*global_files.styles.values(), *style_files.styles.values()])
+        else:
+            global_assets, style_assets = self.assets.get_theme("global"), self.assets.get_theme(style)
+            scripts = "\n".join(asset.to_tag() for asset in [*global_assets.scripts, *style_assets.scripts])
+            styles = "\n".join(asset.to_tag() for asset in [*global_assets.styles, *style_assets.styles])
         credit = "\n".join(c for c in [
             style_files.metadata.get('credit', ''),
             global_files.metadata.get('credit', ''),
@@ -820,15 +1691,17 @@ class Server:
             additional_css = "\n".join(self.configuration.additional_css_content)
             styles = f"{styles}\n<style>{additional_css}</style>"
         if self.configuration.skulpt:
-            return TEMPLATE_200_WITHOUT_HEADER.format(
-                header=header_content, styles=styles, scripts=scripts, content=content,
-                title=json.dumps(self.configuration.title), extra_js=js)
+            return PageShell.from_template(
+                TEMPLATE_200_WITHOUT_HEADER,
+                header=header_content, styles=styles, scripts=scripts,
+                title=json.dumps(self.configuration.title))
         else:
             footer = TEMPLATE_FOOTER.format(credit=credit) if credit else ""
-            return TEMPLATE_200.format(
-                header=header_content, styles=styles, scripts=scripts, content=content,
+            return PageShell.from_template(
+                TEMPLATE_200,
+                header=header_content, styles=styles, scripts=scripts,
                 title=html.escape(self.configuration.title),
-                footer=footer, extra_js=js)
+                footer=footer)
 
 
     def make_error_page(self, title, error, original_function, additional_details=""):
@@ -852,6 +1725,7 @@ class Server:
         :return: Does not return any value as it raises an HTTP 500 error with the formatted message.
         :rtype: None
         """
+        self.metrics.errors.inc((title,))
         tb = html.escape(traceback.format_exc())
         new_message = (f"""{title}.\n"""
                        f"""Error in {original_function.__name__}:\n"""
@@ -867,11 +1741,26 @@ class Server:
 
         TODO: This should actually append to a list that gets shown in the debug area.
 
+        In production, the message is logged instead of printed.
+
         :param message: The warning message to be displayed to the user.
         :type message: str
         :return: None
         """
-        print(message)
+        if self.configuration.production:
+            logger.warning(message)
+        else:
+            print(message)
+
+    def shows_debug_information(self):
+        """
+        Checks whether pages include the debug information. It is never shown in production, since
+        no history is kept there.
+
+        :return: Whether the debug information is enabled.
+        :rtype: bool
+        """
+        return self.configuration.debug and not self.configuration.production
 
     def make_debug_page(self):
         """
@@ -879,17 +1768,146 @@ class Server:
         informational data.
 
         This method collects the page history, current state, routes, configuration,
-        and conversion record to create a representation of a debug page. It utilizes
-        these components to generate a structured output that represents the debug
-        information.
+        and conversion record to create a representation of a debug page. Outside of
+        Skulpt, only a small placeholder is included in the page, and each section is
+        loaded from ``/--debug/<section>`` when it is opened.
 
         :return: Debug information page content generated based on the current internal
                  state and history of the application.
         :rtype: str
         """
-        content = DebugInformation(self._page_history, self._state, self.routes, self._conversion_record,
-                                   self.configuration)
-        return content.generate()
+        content = self.make_debug_information()
+        if self.configuration.skulpt:
+            return content.generate()
+        return content.placeholder()
+
+    def make_debug_information(self):
+        """
+        Collects the current visitor's history and state, along with the routes and configuration,
+        for the debug information.
+
+        :return: The debug information for the current session.
+        :rtype: DebugInformation
+        """
+        session = self.current_session()
+        share_state = None if self.configuration.skulpt else self.share_state_link
+        return DebugInformation(session.page_history, session.state, self.routes, session.conversion_record,
+                                self.configuration, self._route_plans, share_state)
+
+    def get_state_secret(self) -> bytes:
+        """
+        Gets the key that state tokens are signed with: the configured ``state_secret``, or else a
+        random key made (once) for this server.
+
+        :return: The key.
+        :rtype: bytes
+        """
+        if self.configuration.state_secret:
+            return as_secret(self.configuration.state_secret)
+        if self._state_secret is None:
+            self._state_secret = make_secret()
+        return self._state_secret
+
+    def make_state_token(self, dumped_state: Optional[str] = None) -> str:
+        """
+        Packs a state into a compact, signed token (see ``drafter.state_tokens``) that can be given
+        as the ``--restorable-state`` parameter of any route to restore it.
+
+        :param dumped_state: The JSON of the state; by default, the current state.
+        :return: The token.
+        :rtype: str
+        """
+        if dumped_state is None:
+            dumped_state = self.dump_state()
+        return encode_state_token(dumped_state, self.get_state_secret())
+
+    def read_state_token(self, token: str) -> str:
+        """
+        Checks and unpacks a state token made by ``make_state_token``.
+
+        :param token: The token.
+        :return: The JSON of the state.
+        :rtype: str
+        :raises StateTokenError: If the token is invalid, or was not made with this server's key.
+        """
+        return decode_state_token(token, self.get_state_secret(), self.configuration.state_token_max_size)
+
+    def rendered_state(self) -> str:
+        """
+        Gets the state that a page is rendered with: its JSON, or in stateless mode a signed state
+        token, which the page then includes in its form and links. A warning is shown if the token
+        is longer than the configured ``stateless_token_budget``.
+
+        :return: The JSON or token of the current state.
+        :rtype: str
+        """
+        dumped = self.dump_state()
+        if not self.configuration.stateless or self.configuration.skulpt:
+            return dumped
+        token = self.make_state_token(dumped)
+        budget = self.configuration.stateless_token_budget
+        if 0 < budget < len(token):
+            self.flash_warning(f"The state token is {len(token)} characters long, which is over the budget of "
+                               f"{budget} characters. Links this long may not work in some browsers and proxies,"
+                               f" so consider keeping less information in the state.")
+        return token
+
+    def share_state_link(self) -> str:
+        """
+        Makes a link to the most recently visited page that restores the current state, so that the
+        page can be shared (or bookmarked) as it is now.
+
+        :return: The URL.
+        :rtype: str
+        """
+        history = self._page_history
+        url = history.stored(-1)[0].url if isinstance(history, HistoryBuffer) and len(history) else "/"
+        return merge_url_query_params(url, {RESTORABLE_STATE_KEY: self.make_state_token()})
+
+    def requested_debug_page(self):
+        """
+        Reads which page of the page load history was requested from the ``page`` query parameter.
+
+        :return: The requested page, starting from zero.
+        :rtype: int
+        """
+        try:
+            return max(0, int(request.query.get('page', 0)))
+        except ValueError:
+            return 0
+
+    def debug_page(self):
+        """
+        Serves all of the debug information for the current visitor as its own page, with one page of
+        the page load history at a time.
+
+        :return: The complete debug information page.
+        :rtype: str
+        """
+        if not self.shows_debug_information():
+            abort(404, "Debug information is not available.")
+        response.set_header('Cache-Control', 'no-store')
+        return self.wrap_page(self.make_debug_information().generate(self.requested_debug_page()), "")
+
+    def debug_section(self, section):
+        """
+        Serves the body of one section of the debug information, to be loaded into the placeholder
+        at the bottom of each page when that section is opened.
+
+        :param section: The name of the section (e.g., ``history``).
+        :type section: str
+        :return: An HTML fragment with the section's contents.
+        :rtype: str
+        """
+        if not self.shows_debug_information():
+            abort(404, "Debug information is not available.")
+        response.set_header('Cache-Control', 'no-store')
+        information = self.make_debug_information()
+        try:
+            body = information.section(section, self.requested_debug_page())
+        except KeyError:
+            abort(404, f"Unknown debug section {section!r}")
+        return "".join(body)
 
     def test_deployment(self):
         """
@@ -1017,6 +2035,10 @@ def start_server(initial_state=None, server: Server = MAIN_SERVER, skip=False, *
     :Keyword Arguments:
         * *port* (``int``) --
           The port to run the server on. Defaults to ``8080``
+        * *threads* (``int``) --
+          How many requests each process can handle at the same time. Defaults to ``1``
+        * *workers* (``int``) --
+          How many processes should handle requests. Defaults to ``1``
     """
     if server.configuration.must_have_site_information:
         if not server._site_information:
@@ -0,0 +1,394 @@
+"""
+Servers that can handle more than one request at a time.
+
+By default, Bottle serves requests one at a time with the standard library's ``wsgiref`` server,
+so one slow route (e.g., a big image filter or a plot) makes every other visitor wait. Setting
+``threads`` in the server configuration handles requests on a pool of threads instead, and setting
+``workers`` starts several processes that all accept connections on the same listening socket.
+
+Each worker process keeps its own memory, so with more than one worker, visitors' sessions should
+be kept somewhere all of the workers can see them (e.g., ``session_store="sqlite"``).
+
+To run under some other server instead, ``Server.wsgi_app`` provides a ready-to-mount WSGI application,
+and ``Server.asgi_app`` wraps the same application with an ``AsgiAdapter``.
+"""
+from typing import Callable, Optional
+import os
+import signal
+import logging
+
+from bottle import ServerAdapter
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+logger = logging.getLogger('drafter')
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """ A request handler that skips reverse DNS lookups, and only logs requests when asked to. """
+    quiet = False
+
+    def address_string(self):
+        return self.client_address[0]
+
+    def log_request(self, *args, **kwargs):
+        if not self.quiet:
+            super().log_request(*args, **kwargs)
+
+
+class ThreadPoolWSGIServer(WSGIServer):
+    """
+    A ``wsgiref`` server that hands each connection to a fixed pool of threads, instead of
+    handling them one at a time. The pool is created for the first request, so
+    that each worker process gets its own.
+
+    :cvar threads: How many requests can be handled at the same time.
+    :type threads: int
+    """
+    threads: int = 8
+    _pool = None
+
+    def get_request(self):
+        connection, address = super().get_request()
+        # The listening socket may be non-blocking, but each connection should not be
+        connection.setblocking(True)
+        return connection, address
+
+    def process_request(self, request, client_address):
+        if self._pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="drafter-request")
+        self._pool.submit(self.process_request_in_thread, request, client_address)
+
+    def process_request_in_thread(self, request, client_address):
+        """
+        Handles a single connection on one of the pool's threads.
+
+        :param request: The connection's socket.
+        :param client_address: The address of the visitor.
+        """
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+
+
+def make_server_class(threads: int, ipv6: bool = False):
+    """
+    Chooses the ``wsgiref`` server class to use for the given number of threads.
+
+    :param threads: How many requests each process can handle at the same time.
+    :param ipv6: Whether the server is listening on an IPv6 address.
+    :return: A subclass of ``WSGIServer``.
+    """
+    import socket
+    base = ThreadPoolWSGIServer if threads > 1 else WSGIServer
+    attributes = {'address_family': socket.AF_INET6} if ipv6 else {}
+    if threads > 1:
+        attributes['threads'] = threads
+    return type(base.__name__, (base,), attributes)
+
+
+class ThreadedServer(ServerAdapter):
+    """
+    A Bottle server adapter that handles requests on a pool of ``threads`` threads, in a single process.
+    """
+
+    def run(self, app):  # pragma: no cover
+        threads = int(self.options.get('threads', 1) or 1)
+        handler_class = type('RequestHandler', (QuietRequestHandler,), {'quiet': self.quiet})
+        self.srv = make_server(self.host, self.port, app, make_server_class(threads, ':' in self.host), handler_class)
+        self.port = self.srv.server_port
+        try:
+            self.srv.serve_forever()
+        except KeyboardInterrupt:
+            self.srv.server_close()
+            raise
+
+
+class PreforkServer(ThreadedServer):
+    """
+    A Bottle server adapter that opens the listening socket once, and then forks ``workers``
+    processes that all accept connections from it (each with its own pool of ``threads``
+    threads). The ``before_fork`` and ``after_fork`` options can be given functions to call in
+    the original process before forking, and in each worker afterwards; ``before_exit`` is called
+    in each worker just before it exits.
+
+    Forking is not available on Windows; there, a single process is used instead.
+    """
+
+    def run(self, app):  # pragma: no cover
+        workers = int(self.options.get('workers', 1) or 1)
+        if workers <= 1 or not hasattr(os, 'fork'):
+            if workers > 1:
+                logger.warning("Multiple worker processes are not supported on this platform; using one process.")
+            return super().run(app)
+        threads = int(self.options.get('threads', 1) or 1)
+        before_fork: Optional[Callable[[], None]] = self.options.get('before_fork')
+        after_fork: Optional[Callable[[], None]] = self.options.get('after_fork')
+        before_exit: Optional[Callable[[], None]] = self.options.get('before_exit')
+        handler_class = type('RequestHandler', (QuietRequestHandler,), {'quiet': self.quiet})
+        self.srv = make_server(self.host, self.port, app, make_server_class(threads, ':' in self.host), handler_class)
+        self.port = self.srv.server_port
+        # Workers that lose the race to accept a connection should go back to waiting, not block
+        self.srv.socket.setblocking(False)
+        if before_fork is not None:
+            before_fork()
+        children = []
+        for _ in range(workers):
+            pid = os.fork()
+            if pid == 0:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                try:
+                    if after_fork is not None:
+                        after_fork()
+                    self.srv.serve_forever()
+                except KeyboardInterrupt:
+                    pass
+                finally:
+                    try:
+                        if before_exit is not None:
+                            before_exit()
+                    finally:
+                        os._exit(0)
+            children.append(pid)
+        logger.info("Started %d worker processes", workers)
+        # Stopping the main process (e.g., with ``kill``) should stop the workers too
+        signal.signal(signal.SIGTERM, stop_on_signal)
+        try:
+            for pid in children:
+                os.waitpid(pid, 0)
+        except (KeyboardInterrupt, SystemExit):
+            for pid in children:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            for pid in children:
+                try:
+                    os.waitpid(pid, 0)
+                except ChildProcessError:
+                    pass
+            raise
+        finally:
+            self.srv.server_close()
+
+
+def stop_on_signal(signum, frame):
+    """ Turns a termination signal into a ``SystemExit``, so that cleanup code gets to run. """
+    raise SystemExit(128 + signum)
+
+
+def choose_server_adapter(workers: int, threads: int):
+    """
+    Picks the Bottle server adapter for the given number of worker processes and threads.
+
+    :param workers: How many processes should accept connections.
+    :param threads: How many requests each process can handle at the same time.
+    :return: A ``ServerAdapter`` subclass, or None to use Bottle's default server.
+    """
+    if workers > 1:
+        return PreforkServer
+    if threads > 1:
+        return ThreadedServer
+    return None
+
+
+class AsgiAdapter:
+    """
+    Wraps a WSGI application (like the one from ``Server.wsgi_app``) so that it can be mounted in an
+    ASGI server. Each request is handled by the same WSGI pipeline, on a worker thread; the entire
+    request (including iterating a streamed response) stays on that one thread, since the server
+    keeps track of the current request and session with thread-local storage.
+
+    The request body is read completely before the WSGI application is called. It is kept in memory
+    up to ``spool_size`` bytes, and moved into a temporary file beyond that, so large uploads are not
+    held in memory. A body larger than ``max_body_size`` is refused (with ``413``) as soon as it is
+    announced or has arrived that far.
+
+    :param wsgi_app: The WSGI application to wrap.
+    :param executor: The ``concurrent.futures`` executor to run requests on; by default, the event
+        loop's default executor.
+    :param max_body_size: Largest request body (in bytes); zero (or less) means no limit.
+    :param spool_size: Largest request body (in bytes) kept in memory.
+    """
+
+    def __init__(self, wsgi_app, executor=None, max_body_size: int = 0, spool_size: int = 1024 * 1024):
+        self.wsgi_app = wsgi_app
+        self.executor = executor
+        self.max_body_size = max_body_size
+        self.spool_size = spool_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.handle_lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f"Drafter can only handle HTTP requests, not {scope['type']!r}.")
+        import asyncio
+        import tempfile
+        if self.too_large(declared_length(scope)):
+            await self.refuse(send)
+            return
+        body = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        try:
+            received = 0
+            more_body = True
+            while more_body:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                chunk = message.get('body', b'')
+                received += len(chunk)
+                if self.too_large(received):
+                    await self.refuse(send)
+                    return
+                body.write(chunk)
+                more_body = message.get('more_body', False)
+            body.seek(0)
+            environ = make_wsgi_environ(scope, body, received)
+            loop = asyncio.get_running_loop()
+
+            def send_from_thread(message):
+                asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+            await loop.run_in_executor(self.executor, self.run_wsgi, environ, send_from_thread)
+        finally:
+            body.close()
+
+    def too_large(self, length: int) -> bool:
+        """ Checks whether a request body of the given length is over the limit. """
+        return 0 < self.max_body_size < length
+
+    async def refuse(self, send):
+        """ Answers a request whose body is too large with ``413``, without reading the rest of it. """
+        message = f"The request is larger than the limit of {self.max_body_size} bytes.".encode('utf-8')
+        await send({'type': 'http.response.start', 'status': 413,
+                    'headers': [(b'content-type', b'text/plain; charset=utf-8'),
+                                (b'content-length', str(len(message)).encode('latin-1'))]})
+        await send({'type': 'http.response.body', 'body': message, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b"", 'more_body': False})
+
+    def run_wsgi(self, environ, send_from_thread):
+        """
+        Calls the WSGI application and sends its response, all on the current (worker) thread.
+        Data given to the ``write`` callable returned by ``start_response`` is sent as it is written.
+
+        :param environ: The WSGI environment for the request.
+        :param send_from_thread: Sends an ASGI message, waiting until it has been sent.
+        """
+        response_start = {}
+        started = False
+
+        def send_body(chunk: bytes):
+            nonlocal started
+            if not started:
+                send_from_thread(response_start)
+                started = True
+            send_from_thread({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+        def write(data: bytes):
+            # The legacy write() callable sends its data right away, ahead of the returned iterable
+            if data:
+                send_body(data)
+
+        def start_response(status, headers, exc_info=None):
+            response_start.update({
+                'type': 'http.response.start',
+                'status': int(status.split(" ", 1)[0]),
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+            })
+            return write
+
+        iterable = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in iterable:
+                if chunk:
+                    send_body(chunk)
+            if not started:
+                send_from_thread(response_start)
+            send_from_thread({'type': 'http.response.body', 'body': b"", 'more_body': False})
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+    async def handle_lifespan(self, receive, send):
+        """
+        Answers the ASGI server's startup and shutdown messages. The Drafter server is already set up
+        by the time the adapter is made, so there is nothing else to do.
+        """
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def declared_length(scope) -> int:
+    """ The ``Content-Length`` announced in an ASGI connection scope, or -1 if there is none. """
+    for name, value in scope.get('headers', []):
+        if name.lower() == b'content-length':
+            try:
+                return int(value)
+            except ValueError:
+                return -1
+    return -1
+
+
+def make_wsgi_environ(scope, body, length: Optional[int] = None) -> dict:
+    """
+    Translates an ASGI HTTP connection scope into a WSGI environment.
+
+    :param scope: The ASGI connection scope.
+    :param body: The complete body of the request, as bytes or as a binary file positioned at its start.
+    :param length: The length of the body, if it is given as a file.
+    :return: The WSGI environment.
+    """
+    import io
+    import sys
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b"").decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(len(body) if isinstance(body, bytes) else length),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body) if isinstance(body, bytes) else body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = str(scope['client'][0])
+    for raw_name, raw_value in scope.get('headers', []):
+        name = raw_name.decode('latin-1').upper().replace('-', '_')
+        value = raw_value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+            continue
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = 'HTTP_' + name
+        if key in environ:
+            separator = '; ' if key == 'HTTP_COOKIE' else ','
+            value = environ[key] + separator + value
+        environ[key] = value
+    return environ
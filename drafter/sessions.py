@@ -0,0 +1,353 @@
+"""
+Per-visitor sessions for the Drafter server.
+
+Each visitor to a Drafter site gets their own ``Session``, which holds their current state and
+their page/state history. Sessions are identified by a cookie, and kept in a ``SessionStore``.
+Two stores are provided: an in-memory store with least-recently-used eviction (the default),
+and a SQLite-backed store that keeps sessions on disk.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Optional, List, Callable
+import time
+
+try:
+    from threading import local as RequestLocal, RLock
+except ImportError:
+    # Skulpt does not provide threading, but it only ever serves one visitor anyway
+    class RequestLocal:  # type: ignore
+        pass
+
+    class RLock:  # type: ignore
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+            return False
+
+try:
+    from weakref import WeakValueDictionary
+except ImportError:
+    WeakValueDictionary = dict  # type: ignore
+
+from drafter.configuration import ServerConfiguration
+
+DEFAULT_SESSION_ID = "--default-session"
+
+
+def new_session_id() -> str:
+    """
+    Creates a new, unguessable session identifier that is safe to put in a cookie.
+
+    :return: A random url-safe string.
+    :rtype: str
+    """
+    import secrets
+    return secrets.token_urlsafe(24)
+
+
+class SessionLock:
+    """
+    A lock held while a request is using a session, so that two requests from the same visitor
+    (e.g., from two tabs) take turns instead of changing the session's state at the same time.
+    """
+    __slots__ = ('_lock', '__weakref__')
+
+    def __init__(self):
+        self._lock = RLock()
+
+    def __enter__(self):
+        self._lock.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return self._lock.__exit__(exc_type, exc_val, exc_tb)
+
+
+class SessionLocks:
+    """
+    Hands out one ``SessionLock`` per session identifier. A lock only lives as long as some request
+    is holding on to it, so this does not grow with the number of sessions.
+    """
+
+    def __init__(self):
+        self._locks = WeakValueDictionary()
+        self._guard = RLock()
+
+    def get(self, session_id: str) -> SessionLock:
+        """
+        Gets the lock for the given session, creating it if no request currently has it.
+
+        :param session_id: The identifier of the session.
+        :return: The session's lock.
+        """
+        with self._guard:
+            lock = self._locks.get(session_id)
+            if lock is None:
+                lock = self._locks[session_id] = SessionLock()
+            return lock
+
+
+@dataclass
+class Session:
+    """
+    All of the server-side information about a single visitor: their current state, and the
+    history of states and pages that they have visited.
+
+    :ivar session_id: The identifier stored in the visitor's session cookie.
+    :type session_id: str
+    :ivar state: The visitor's current state.
+    :type state: Any
+    :ivar state_history: Immutable snapshots of the historical states of the visitor (see ``drafter.snapshots``).
+    :type state_history: list or HistoryBuffer
+    :ivar state_frozen_history: List storing serialized snapshots of historical states.
+    :type state_frozen_history: list
+    :ivar page_history: History of visited pages, paired with the state before each visit.
+    :type page_history: list or HistoryBuffer
+    :ivar conversion_record: Record of the parameter conversions for the most recent request.
+    :type conversion_record: list
+    :ivar last_accessed: When the session was last used, in seconds since the epoch.
+    :type last_accessed: float
+    :ivar dump_cache: The most recent serialized state, reused until the next route is called.
+    :type dump_cache: StateDumpCache or None
+    """
+    session_id: str
+    state: Any = None
+    state_history: List[Any] = field(default_factory=list)
+    state_frozen_history: List[Any] = field(default_factory=list)
+    page_history: List[Any] = field(default_factory=list)
+    conversion_record: List[Any] = field(default_factory=list)
+    last_accessed: float = field(default_factory=time.time)
+    dump_cache: Any = field(default=None, repr=False, compare=False)
+
+    def touch(self):
+        """ Marks the session as having just been used. """
+        self.last_accessed = time.time()
+
+    def clear_history(self):
+        """ Forgets all of the recorded history for this session, but keeps the current state. """
+        self.state_history.clear()
+        self.state_frozen_history.clear()
+        self.page_history.clear()
+        self.conversion_record.clear()
+
+
+class SessionStore:
+    """
+    Base class for places to keep sessions between requests. Subclasses must implement
+    ``load``, ``save``, ``delete``, ``clear``, and ``__len__``.
+
+    :ivar idle_timeout: Number of seconds a session can go unused before it is discarded.
+        A value of zero (or less) means that sessions never expire.
+    :type idle_timeout: float
+    """
+    idle_timeout: float = 0
+
+    def load(self, session_id: str) -> Optional[Session]:
+        """
+        Retrieves the session with the given identifier, if it exists and has not expired.
+
+        :param session_id: The identifier from the visitor's cookie.
+        :return: The matching session, or None if there is no such (live) session.
+        """
+        raise NotImplementedError()
+
+    def save(self, session: Session):
+        """
+        Stores the session so that it can be loaded by later requests.
+
+        :param session: The session to store.
+        """
+        raise NotImplementedError()
+
+    def delete(self, session_id: str):
+        """
+        Removes the session with the given identifier, if it exists.
+
+        :param session_id: The identifier of the session to remove.
+        """
+        raise NotImplementedError()
+
+    def clear(self):
+        """ Removes every session from the store. """
+        raise NotImplementedError()
+
+    def __len__(self) -> int:
+        raise NotImplementedError()
+
+    def reopen(self):
+        """
+        Called in each worker process after the server forks, so that stores with open
+        connections can replace them with their own. By default, does nothing.
+        """
+
+    def is_expired(self, last_accessed: float, now: Optional[float] = None) -> bool:
+        """
+        Checks whether a session last used at the given time has been idle for too long.
+
+        :param last_accessed: When the session was last used, in seconds since the epoch.
+        :param now: The current time; defaults to ``time.time()``.
+        :return: Whether the session should be discarded.
+        """
+        if self.idle_timeout <= 0:
+            return False
+        if now is None:
+            now = time.time()
+        return now - last_accessed > self.idle_timeout
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Keeps sessions in memory, in least-recently-used order. When there are more than
+    ``max_sessions`` sessions, the least recently used one is discarded. Sessions that
+    have been idle for longer than ``idle_timeout`` seconds are also discarded.
+
+    :param max_sessions: The most sessions to keep at once; zero (or less) means no limit.
+    :param idle_timeout: Seconds of inactivity before a session expires; zero (or less) means never.
+    """
+
+    def __init__(self, max_sessions: int = 1000, idle_timeout: float = 3600):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = RLock()
+
+    def load(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if self.is_expired(session.last_accessed):
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def save(self, session):
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._sessions.move_to_end(session.session_id)
+            self.evict()
+
+    def evict(self):
+        """
+        Discards idle sessions, and then the least recently used sessions beyond the limit.
+        Since the sessions are kept in order of use, this only ever looks at the oldest ones.
+        """
+        with self._lock:
+            now = time.time()
+            while self._sessions:
+                oldest = next(iter(self._sessions.values()))
+                if not self.is_expired(oldest.last_accessed, now):
+                    break
+                self._sessions.popitem(last=False)
+            if self.max_sessions > 0:
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Keeps sessions in a SQLite database, so that they survive server restarts and do not
+    take up memory between requests. Sessions are serialized with ``pickle`` by default, so
+    the state (and any route functions in the history) must be picklable; you can provide
+    your own ``serializer`` and ``deserializer`` functions to change that.
+
+    :param path: The filename of the database, or ``":memory:"`` for a temporary database.
+    :param idle_timeout: Seconds of inactivity before a session expires; zero (or less) means never.
+    :param serializer: Function that turns a ``Session`` into bytes.
+    :param deserializer: Function that turns bytes back into a ``Session``.
+    """
+
+    def __init__(self, path: str = "drafter_sessions.sqlite3", idle_timeout: float = 3600,
+                 serializer: Optional[Callable[[Session], bytes]] = None,
+                 deserializer: Optional[Callable[[bytes], Session]] = None):
+        import sqlite3
+        import pickle
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.serializer = serializer or pickle.dumps
+        self.deserializer = deserializer or pickle.loads
+        self._lock = RLock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS drafter_sessions ("
+                                     "session_id TEXT PRIMARY KEY, "
+                                     "last_accessed REAL NOT NULL, "
+                                     "data BLOB NOT NULL)")
+
+    def load(self, session_id):
+        with self._lock:
+            row = self._connection.execute("SELECT last_accessed, data FROM drafter_sessions WHERE session_id = ?",
+                                           (session_id,)).fetchone()
+        if row is None:
+            return None
+        last_accessed, data = row
+        if self.is_expired(last_accessed):
+            self.delete(session_id)
+            return None
+        return self.deserializer(data)
+
+    def save(self, session):
+        data = self.serializer(session)
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO drafter_sessions (session_id, last_accessed, data) "
+                                     "VALUES (?, ?, ?)", (session.session_id, session.last_accessed, data))
+        self.evict()
+
+    def evict(self):
+        """ Deletes every session that has been idle for longer than the timeout. """
+        if self.idle_timeout <= 0:
+            return
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM drafter_sessions WHERE last_accessed < ?",
+                                     (time.time() - self.idle_timeout,))
+
+    def delete(self, session_id):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM drafter_sessions WHERE session_id = ?", (session_id,))
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM drafter_sessions")
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM drafter_sessions").fetchone()[0]
+
+    def close(self):
+        """ Closes the underlying database connection. """
+        self._connection.close()
+
+    def reopen(self):
+        """ Opens a new connection to the database, since connections cannot be shared across processes. """
+        import sqlite3
+        self._lock = RLock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+
+
+def make_session_store(configuration: ServerConfiguration) -> SessionStore:
+    """
+    Creates the session store described by the server configuration.
+
+    :param configuration: The server's configuration.
+    :return: A new session store.
+    :raises ValueError: If the configured ``session_store`` is not a known kind of store.
+    """
+    kind = configuration.session_store.lower()
+    if kind == "memory":
+        return MemorySessionStore(configuration.session_max_count, configuration.session_idle_timeout)
+    if kind == "sqlite":
+        return SQLiteSessionStore(configuration.session_path, configuration.session_idle_timeout)
+    raise ValueError(f"Unknown session store {configuration.session_store!r}. Please choose 'memory' or 'sqlite'.")
@@ -0,0 +1,247 @@
+"""
+Immutable snapshots of states, for keeping the history of a visitor's states.
+
+Routes often change the state in place, so keeping the state objects themselves in the history
+would make every entry show the latest values. Copying the whole state for every request fixes
+that, but costs memory in proportion to the size of the state times the length of the history.
+
+Instead, ``take_snapshot`` freezes the state into immutable parts, reusing the parts of the
+previous snapshot that did not change: a dataclass whose fields are all unchanged is the same
+snapshot as before, and long lists (and dictionaries and sets) are split into segments, so that
+only the segments containing changes are new. Consecutive snapshots of a large state that changed
+in a few places therefore share almost everything.
+
+``restore_snapshot`` turns a snapshot back into ordinary (new, mutable) values.
+"""
+from copy import deepcopy
+from dataclasses import fields, is_dataclass
+from typing import Any, Optional, Tuple
+
+from drafter.history import field_names
+from drafter.image_support import HAS_PILLOW, PILImage
+
+SEGMENT_SIZE = 32
+ATOMIC_TYPES = (int, float, str, bool, bytes, complex, type(None))
+
+
+class Frozen:
+    """ Base class for the parts of a snapshot, which cannot be changed once they are made. """
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} objects are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} objects are immutable")
+
+
+class FrozenDataclass(Frozen):
+    """
+    A snapshot of a dataclass instance.
+
+    :ivar kind: The dataclass.
+    :type kind: type
+    :ivar values: The snapshots of its fields, in order.
+    :type values: tuple
+    """
+    __slots__ = ('kind', 'values')
+
+    def __init__(self, kind: type, values: tuple):
+        object.__setattr__(self, 'kind', kind)
+        object.__setattr__(self, 'values', values)
+
+    def __reduce__(self):
+        return FrozenDataclass, (self.kind, self.values)
+
+    def __repr__(self):
+        return f"FrozenDataclass({self.kind.__name__}, {self.values!r})"
+
+
+class FrozenCollection(Frozen):
+    """
+    A snapshot of a list, tuple, set, frozenset, or dictionary. The items (for a dictionary, pairs
+    of keys and values) are stored in segments of ``SEGMENT_SIZE``, so that an unchanged segment
+    can be shared with the previous snapshot.
+
+    :ivar kind: The type of the collection (e.g., ``list``).
+    :type kind: type
+    :ivar segments: Tuples of the snapshots of the items.
+    :type segments: tuple
+    """
+    __slots__ = ('kind', 'segments')
+
+    def __init__(self, kind: type, segments: Tuple[tuple, ...]):
+        object.__setattr__(self, 'kind', kind)
+        object.__setattr__(self, 'segments', segments)
+
+    def __reduce__(self):
+        return FrozenCollection, (self.kind, self.segments)
+
+    def __iter__(self):
+        for segment in self.segments:
+            yield from segment
+
+    def __len__(self):
+        return sum(len(segment) for segment in self.segments)
+
+    def __repr__(self):
+        return f"FrozenCollection({self.kind.__name__}, {list(self)!r})"
+
+
+class FrozenValue(Frozen):
+    """
+    A snapshot of any other kind of value, kept as a private copy that is only ever copied again.
+
+    :ivar value: The copy of the value.
+    :type value: Any
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        object.__setattr__(self, 'value', value)
+
+    def __reduce__(self):
+        return FrozenValue, (self.value,)
+
+    def __repr__(self):
+        return f"FrozenValue({self.value!r})"
+
+
+class CircularSnapshotError(ValueError):
+    """ Raised when a state refers to itself, which snapshots cannot represent. """
+
+
+def same_snapshot(new, old) -> bool:
+    """ Checks whether two snapshots can be shared (they are the same object, or equal atomic values). """
+    return new is old or (new.__class__ is old.__class__ and new.__class__ in ATOMIC_TYPES and new == old)
+
+
+def take_snapshot(value, previous=None, path: Optional[set] = None):
+    """
+    Freezes a value into an immutable snapshot, sharing every unchanged part with the previous one.
+
+    :param value: The value (e.g., the current state) to take a snapshot of.
+    :param previous: The snapshot of the previous version of the value, if there is one.
+    :param path: The ids of the containers currently being frozen, to detect circular references.
+    :return: The snapshot; atomic values (numbers, strings, ...) are their own snapshots.
+    :raises CircularSnapshotError: If the value contains itself.
+    """
+    if value.__class__ in ATOMIC_TYPES:
+        return value
+    if path is None:
+        path = set()
+    if id(value) in path:
+        raise CircularSnapshotError(f"Cannot take a snapshot of a circular reference in {value!r}")
+    path.add(id(value))
+    try:
+        if is_dataclass(value) and not isinstance(value, type):
+            return freeze_dataclass(value, previous, path)
+        if isinstance(value, (list, tuple, set, frozenset)):
+            return freeze_collection(value.__class__, list(value), previous, path)
+        if isinstance(value, dict):
+            return freeze_collection(value.__class__, list(value.items()), previous, path)
+        if HAS_PILLOW and isinstance(value, PILImage.Image):
+            if isinstance(previous, FrozenValue) and isinstance(previous.value, PILImage.Image) and \
+                    previous.value.mode == value.mode and previous.value.size == value.size and \
+                    previous.value.tobytes() == value.tobytes():
+                return previous
+            return FrozenValue(value.copy())
+        return FrozenValue(deepcopy(value))
+    finally:
+        path.discard(id(value))
+
+
+def freeze_dataclass(value, previous, path: set) -> FrozenDataclass:
+    names = field_names(value)
+    old_values = previous.values if isinstance(previous, FrozenDataclass) and previous.kind is value.__class__ \
+        and len(previous.values) == len(names) else None
+    if old_values is None:
+        return FrozenDataclass(value.__class__, tuple(take_snapshot(getattr(value, name), None, path)
+                                                      for name in names))
+    values = tuple(take_snapshot(getattr(value, name), old, path) for name, old in zip(names, old_values))
+    if all(same_snapshot(new, old) for new, old in zip(values, old_values)):
+        return previous
+    # Keep the previous (equal) atomic values, so that the next snapshot can share them by identity
+    return FrozenDataclass(value.__class__, tuple(old if same_snapshot(new, old) else new
+                                                  for new, old in zip(values, old_values)))
+
+
+def freeze_collection(kind: type, items: list, previous, path: set) -> FrozenCollection:
+    is_mapping = issubclass(kind, dict)
+    matches = isinstance(previous, FrozenCollection) and previous.kind is kind
+    old_segments = previous.segments if matches else ()
+    segments = []
+    changed = not matches or len(old_segments) != (len(items) + SEGMENT_SIZE - 1) // SEGMENT_SIZE
+    for index, start in enumerate(range(0, len(items), SEGMENT_SIZE)):
+        chunk = items[start:start + SEGMENT_SIZE]
+        old_segment = old_segments[index] if index < len(old_segments) else ()
+        if len(old_segment) != len(chunk):
+            old_segment = ()
+        if is_mapping:
+            segment = tuple(freeze_pair(pair, old_segment[offset] if old_segment else None, path)
+                            for offset, pair in enumerate(chunk))
+        else:
+            segment = tuple(take_snapshot(item, old_segment[offset] if old_segment else None, path)
+                            for offset, item in enumerate(chunk))
+        if old_segment and all(same_snapshot(new, old) for new, old in zip(segment, old_segment)):
+            segment = old_segment
+        else:
+            changed = True
+        segments.append(segment)
+    if not changed:
+        return previous
+    return FrozenCollection(kind, tuple(segments))
+
+
+def freeze_pair(pair: tuple, previous: Optional[tuple], path: set) -> tuple:
+    key, value = pair
+    if previous is None:
+        return take_snapshot(key, None, path), take_snapshot(value, None, path)
+    new_key = take_snapshot(key, previous[0], path)
+    new_value = take_snapshot(value, previous[1], path)
+    if same_snapshot(new_key, previous[0]) and same_snapshot(new_value, previous[1]):
+        return previous
+    return new_key, new_value
+
+
+def snapshot_type(snapshot) -> type:
+    """
+    Finds the type of the value that a snapshot was taken of, without restoring it.
+
+    :param snapshot: The snapshot.
+    :return: The type of the original value.
+    """
+    if isinstance(snapshot, (FrozenDataclass, FrozenCollection)):
+        return snapshot.kind
+    if isinstance(snapshot, FrozenValue):
+        return snapshot.value.__class__
+    return snapshot.__class__
+
+
+def restore_snapshot(snapshot):
+    """
+    Turns a snapshot back into an ordinary value. The result is new every time, so changing it
+    does not affect the snapshot.
+
+    :param snapshot: The snapshot to restore.
+    :return: A value equal to the one the snapshot was taken of.
+    """
+    if isinstance(snapshot, FrozenDataclass):
+        result = object.__new__(snapshot.kind)
+        for f, value in zip(fields(snapshot.kind), snapshot.values):
+            object.__setattr__(result, f.name, restore_snapshot(value))
+        return result
+    if isinstance(snapshot, FrozenCollection):
+        if issubclass(snapshot.kind, dict):
+            restored = [(restore_snapshot(key), restore_snapshot(value)) for key, value in snapshot]
+        else:
+            restored = [restore_snapshot(item) for item in snapshot]
+        if hasattr(snapshot.kind, '_fields'):
+            # Named tuples take their items as separate arguments
+            return snapshot.kind(*restored)
+        return snapshot.kind(restored)
+    if isinstance(snapshot, FrozenValue):
+        if HAS_PILLOW and isinstance(snapshot.value, PILImage.Image):
+            return snapshot.value.copy()
+        return deepcopy(snapshot.value)
+    return snapshot
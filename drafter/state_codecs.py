@@ -0,0 +1,449 @@
+"""
+Compiled, type-directed codecs for saving and restoring states.
+
+``dehydrate_json`` and ``rehydrate_json`` work out what to do at every value they visit. When the
+type of the state is known (from the initial state, or from a route's ``state`` annotation), all of
+those decisions can be made once instead: ``get_codec`` inspects the type (including dataclass
+fields and ``typing`` generics) and builds a pair of functions specialized to it, which are cached
+per type.
+
+Codecs also restore values that ``rehydrate_json`` cannot: tuples, sets, ``Optional`` and ``Union``
+values, dictionaries with non-string keys, nested generics, and enums. Values without a usable
+annotation (or that do not match their annotation) fall back to the generic functions.
+
+The compiled functions call each other, so a state nested more deeply than Python's recursion limit
+allows is encoded by ``dehydrate_json`` instead, which walks it without recursing. Circular references
+are reported with the same ``ValueError`` as ``dehydrate_json``.
+"""
+from dataclasses import dataclass, fields, is_dataclass, MISSING
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+import inspect
+import typing
+
+from drafter.history import dehydrate_json, rehydrate_json, report_circular_reference
+from drafter.blobs import BLOB_STORE
+from drafter.image_support import HAS_PILLOW, PILImage
+
+PRIMITIVE_TYPES = (int, float, str, bool)
+NONE_TYPE = type(None)
+
+
+@dataclass
+class Codec:
+    """
+    A pair of functions that turn values of a single type into JSON-compatible data and back.
+
+    :ivar target: The type that the codec was compiled for.
+    :type target: Any
+    :ivar encode_nested: Turns a value into JSON-compatible data (lists, dictionaries, and
+        primitives), given the ids of the containers that are being encoded around it.
+    :type encode_nested: Callable[[Any, set], Any]
+    :ivar decode: Turns JSON-compatible data back into a value of the type.
+    :type decode: Callable[[Any], Any]
+    """
+    target: Any
+    encode_nested: Callable[[Any, set], Any] = None  # type: ignore
+    decode: Callable[[Any], Any] = None  # type: ignore
+
+    def encode(self, value):
+        """
+        Turns a value into JSON-compatible data. Values that are nested too deeply for the compiled
+        functions are encoded by ``dehydrate_json`` instead.
+
+        :param value: The value to encode.
+        :return: The JSON-compatible data.
+        :raises ValueError: If the value contains itself, or cannot be serialized.
+        """
+        try:
+            return self.encode_nested(value, set())
+        except RecursionError:
+            return dehydrate_json(value)
+
+
+_CODECS: Dict[Any, Codec] = {}
+
+
+def get_codec(target) -> Codec:
+    """
+    Gets the codec for the given type, compiling it the first time the type is seen.
+
+    :param target: A type annotation (e.g., a dataclass, ``List[int]``, or ``Optional[str]``).
+        Missing annotations (``None`` or ``inspect.Parameter.empty``) get the generic codec.
+    :return: The codec for the type.
+    """
+    try:
+        codec = _CODECS.get(target)
+    except TypeError:
+        # Some annotations cannot be hashed; they are compiled every time
+        return compile_codec(target, {})
+    if codec is None:
+        codec = compile_codec(target, _CODECS)
+    return codec
+
+
+def type_origin(target):
+    """ The generic class of a ``typing`` annotation (e.g., ``list`` for ``List[int]``), if any. """
+    get_origin = getattr(typing, 'get_origin', None)
+    if get_origin is not None:
+        return get_origin(target)
+    return getattr(target, '__origin__', None)
+
+
+def type_arguments(target) -> tuple:
+    """ The type arguments of a ``typing`` annotation (e.g., ``(int,)`` for ``List[int]``). """
+    get_args = getattr(typing, 'get_args', None)
+    if get_args is not None:
+        return get_args(target)
+    return getattr(target, '__args__', ()) or ()
+
+
+def field_types(cls) -> Dict[str, Any]:
+    """
+    Finds the annotation of each field of a dataclass, resolving string annotations if possible.
+
+    :param cls: The dataclass.
+    :return: The type of each field, by name.
+    """
+    try:
+        hints = typing.get_type_hints(cls)
+    except Exception:
+        hints = {}
+    return {f.name: hints.get(f.name, f.type) for f in fields(cls)}
+
+
+def generic_encode(value, path):
+    """ Encodes a value without any type information. """
+    return dehydrate_json(value, path)
+
+
+def generic_decode(value):
+    """ Decodes a value without any type information, leaving it as it is. """
+    return value
+
+
+def compile_codec(target, cache: Dict[Any, Codec]) -> Codec:
+    """
+    Builds the codec for a type. The codec is added to the cache before its parts are compiled,
+    so that recursive types (e.g., a tree of dataclasses) can refer to themselves.
+
+    :param target: The type annotation to compile.
+    :param cache: The cache to add the codec (and the codecs of any types it contains) to.
+    :return: The new codec.
+    """
+    codec = Codec(target)
+    try:
+        cache[target] = codec
+    except TypeError:
+        pass
+    origin = type_origin(target)
+    arguments = type_arguments(target)
+    if target is None or target is inspect.Parameter.empty or target is Any or isinstance(target, (str, typing.TypeVar)):
+        codec.encode_nested, codec.decode = generic_encode, generic_decode
+    elif target is NONE_TYPE:
+        codec.encode_nested, codec.decode = generic_encode, generic_decode
+    elif target in PRIMITIVE_TYPES:
+        codec.encode_nested, codec.decode = compile_primitive(target)
+    elif isinstance(target, type) and issubclass(target, Enum):
+        codec.encode_nested, codec.decode = compile_enum(target)
+    elif origin is Union or (origin is not None and type(target).__name__ == 'UnionType'):
+        codec.encode_nested, codec.decode = compile_union(arguments, cache)
+    elif origin in (list, List, set, frozenset, typing.Set, typing.FrozenSet) or target in (list, set, frozenset):
+        container = origin if origin is not None else target
+        if container is typing.Set:
+            container = set
+        elif container is typing.FrozenSet:
+            container = frozenset
+        elif container is List:
+            container = list
+        element = get_codec(arguments[0]) if arguments else get_codec(None)
+        codec.encode_nested, codec.decode = compile_sequence(container, element)
+    elif origin in (tuple, Tuple) or target is tuple:
+        codec.encode_nested, codec.decode = compile_tuple(arguments)
+    elif origin in (dict, Dict) or target is dict:
+        key_type, value_type = arguments if len(arguments) == 2 else (None, None)
+        codec.encode_nested, codec.decode = compile_dict(key_type, value_type)
+    elif isinstance(target, type) and is_dataclass(target):
+        codec.encode_nested, codec.decode = compile_dataclass(target)
+    elif HAS_PILLOW and isinstance(target, type) and issubclass(target, PILImage.Image):
+        codec.encode_nested = lambda value, path: BLOB_STORE.dump_image(value)
+        codec.decode = lambda value: BLOB_STORE.load_image(value) if isinstance(value, str) else value
+    else:
+        codec.encode_nested = generic_encode
+        codec.decode = lambda value: rehydrate_json(value, target)
+    return codec
+
+
+def compile_primitive(target):
+    def encode(value, path):
+        if value.__class__ in PRIMITIVE_TYPES or value is None:
+            return value
+        return dehydrate_json(value, path)
+    if target is float:
+        def decode(value):
+            return float(value) if value.__class__ is int else value
+        return encode, decode
+    return encode, generic_decode
+
+
+def compile_enum(target):
+    members = list(target)
+    by_key = {}
+    for member in members:
+        key = member.value if isinstance(member.value, str) else repr(member.value)
+        by_key[key] = member
+
+    def encode(value, path):
+        if isinstance(value, target):
+            return dehydrate_json(value.value, path)
+        return dehydrate_json(value, path)
+
+    def decode(value):
+        if isinstance(value, list):
+            value = tuple(value)
+        try:
+            return target(value)
+        except ValueError:
+            # Keys of dictionaries come back as strings
+            if isinstance(value, str) and value in by_key:
+                return by_key[value]
+            raise
+    return encode, decode
+
+
+def compile_sequence(container, element: Codec):
+    def encode(value, path):
+        if not isinstance(value, container):
+            return dehydrate_json(value, path)
+        key = id(value)
+        if key in path:
+            report_circular_reference(value)
+        path.add(key)
+        element_encode = element.encode_nested
+        result = [element_encode(item, path) for item in value]
+        path.discard(key)
+        return result
+
+    def decode(value):
+        if not isinstance(value, list):
+            return value
+        element_decode = element.decode
+        if container is list:
+            return [element_decode(item) for item in value]
+        return container(element_decode(item) for item in value)
+    return encode, decode
+
+
+def compile_tuple(arguments):
+    if not arguments or (len(arguments) == 2 and arguments[1] is Ellipsis):
+        element = get_codec(arguments[0] if arguments else None)
+
+        def encode(value, path):
+            if not isinstance(value, tuple):
+                return dehydrate_json(value, path)
+            key = id(value)
+            if key in path:
+                report_circular_reference(value)
+            path.add(key)
+            element_encode = element.encode_nested
+            result = [element_encode(item, path) for item in value]
+            path.discard(key)
+            return result
+
+        def decode(value):
+            if not isinstance(value, list):
+                return value
+            element_decode = element.decode
+            return tuple(element_decode(item) for item in value)
+        return encode, decode
+    elements = [get_codec(argument) for argument in arguments]
+
+    def encode_fixed(value, path):
+        if not isinstance(value, tuple) or len(value) != len(elements):
+            return dehydrate_json(value, path)
+        key = id(value)
+        if key in path:
+            report_circular_reference(value)
+        path.add(key)
+        result = [element.encode_nested(item, path) for element, item in zip(elements, value)]
+        path.discard(key)
+        return result
+
+    def decode_fixed(value):
+        if not isinstance(value, list) or len(value) != len(elements):
+            return value
+        return tuple(element.decode(item) for element, item in zip(elements, value))
+    return encode_fixed, decode_fixed
+
+
+def compile_key_from_string(key_type) -> Callable[[str], Any]:
+    """
+    Builds the function that turns a JSON object's (string) key back into a key of the given type.
+    JSON turns numbers and booleans used as keys into strings.
+    """
+    if key_type is bool:
+        return lambda key: key == 'true' if isinstance(key, str) else key
+    if key_type in (int, float):
+        return lambda key: key_type(key) if isinstance(key, str) else key
+    if isinstance(key_type, type) and issubclass(key_type, Enum):
+        return get_codec(key_type).decode
+    return lambda key: key
+
+
+def compile_dict(key_type, value_type):
+    keys = get_codec(key_type)
+    values = get_codec(value_type)
+    object_keys = key_type is None or key_type is Any or key_type in PRIMITIVE_TYPES or \
+        (isinstance(key_type, type) and issubclass(key_type, Enum))
+    key_from_string = compile_key_from_string(key_type)
+    if object_keys:
+        # Keys that JSON can represent are kept in a JSON object
+        def encode(value, path):
+            if not isinstance(value, dict):
+                return dehydrate_json(value, path)
+            marker = id(value)
+            if marker in path:
+                report_circular_reference(value)
+            path.add(marker)
+            key_encode, value_encode = keys.encode_nested, values.encode_nested
+            result = {key_encode(key, path): value_encode(item, path) for key, item in value.items()}
+            path.discard(marker)
+            return result
+    else:
+        # Other keys (e.g., tuples or dataclasses) are kept as a list of key/value pairs
+        def encode(value, path):
+            if not isinstance(value, dict):
+                return dehydrate_json(value, path)
+            marker = id(value)
+            if marker in path:
+                report_circular_reference(value)
+            path.add(marker)
+            key_encode, value_encode = keys.encode_nested, values.encode_nested
+            result = [[key_encode(key, path), value_encode(item, path)] for key, item in value.items()]
+            path.discard(marker)
+            return result
+
+    def decode(value):
+        key_decode, value_decode = keys.decode, values.decode
+        if isinstance(value, dict):
+            return {key_decode(key_from_string(key)): value_decode(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return {hashable(key_decode(key)): value_decode(item) for key, item in value}
+        return value
+    return encode, decode
+
+
+def hashable(value):
+    """ Turns lists (e.g., keys that were tuples without a more specific annotation) into tuples. """
+    if isinstance(value, list):
+        return tuple(hashable(item) for item in value)
+    return value
+
+
+def compile_union(arguments, cache):
+    options = [argument for argument in arguments if argument is not NONE_TYPE]
+    allows_none = len(options) != len(arguments)
+    codecs = [get_codec(option) for option in options]
+    if len(codecs) == 1:
+        only = codecs[0]
+
+        def encode_optional(value, path):
+            return None if value is None else only.encode_nested(value, path)
+
+        def decode_optional(value):
+            return None if value is None else only.decode(value)
+        return encode_optional, decode_optional
+
+    def encode(value, path):
+        if value is None:
+            return None
+        for option, codec in zip(options, codecs):
+            if matches_type(value, option):
+                return codec.encode_nested(value, path)
+        return dehydrate_json(value, path)
+
+    def decode(value):
+        if value is None and allows_none:
+            return None
+        for option, codec in zip(options, codecs):
+            if could_decode(value, option):
+                return codec.decode(value)
+        return value
+    return encode, decode
+
+
+def matches_type(value, target) -> bool:
+    """ Checks whether a value is an instance of an annotation (ignoring any type arguments). """
+    origin = type_origin(target) or target
+    if origin is List:
+        origin = list
+    elif origin is Dict:
+        origin = dict
+    elif origin is Tuple:
+        origin = tuple
+    if not isinstance(origin, type):
+        return False
+    if origin is int and isinstance(value, bool):
+        return False
+    return isinstance(value, origin)
+
+
+def could_decode(data, target) -> bool:
+    """
+    Guesses whether JSON-compatible data was encoded from the given annotation, by its shape.
+    This is how the members of a ``Union`` are told apart.
+    """
+    origin = type_origin(target) or target
+    if data.__class__ is bool:
+        return origin is bool
+    if data.__class__ is int:
+        return origin in (int, float) or (isinstance(origin, type) and issubclass(origin, Enum))
+    if data.__class__ is float:
+        return origin is float or (isinstance(origin, type) and issubclass(origin, Enum))
+    if isinstance(data, str):
+        return origin is str or (isinstance(origin, type) and issubclass(origin, Enum)) or \
+            (HAS_PILLOW and isinstance(origin, type) and issubclass(origin, PILImage.Image))
+    if isinstance(data, list):
+        return origin in (list, List, tuple, Tuple, set, frozenset, typing.Set, typing.FrozenSet, dict, Dict)
+    if isinstance(data, dict):
+        if isinstance(origin, type) and is_dataclass(origin):
+            names = {f.name for f in fields(origin)}
+            required = {f.name for f in fields(origin)
+                        if f.init and f.default is MISSING and f.default_factory is MISSING}
+            return set(data) <= names and required <= set(data)
+        return origin in (dict, Dict)
+    return False
+
+
+def compile_dataclass(cls):
+    types = field_types(cls)
+    all_fields = [(f.name, get_codec(types[f.name])) for f in fields(cls)]
+    init_fields = {f.name for f in fields(cls) if f.init}
+
+    def encode(value, path):
+        if value.__class__ is not cls:
+            return dehydrate_json(value, path)
+        key = id(value)
+        if key in path:
+            report_circular_reference(value)
+        path.add(key)
+        result = {name: codec.encode_nested(getattr(value, name), path) for name, codec in all_fields}
+        path.discard(key)
+        return result
+
+    def decode(value):
+        if not isinstance(value, dict):
+            return rehydrate_json(value, cls)
+        arguments = {}
+        later = {}
+        for name, codec in all_fields:
+            if name in value:
+                if name in init_fields:
+                    arguments[name] = codec.decode(value[name])
+                else:
+                    later[name] = codec.decode(value[name])
+        result = cls(**arguments)
+        for name, item in later.items():
+            setattr(result, name, item)
+        return result
+    return encode, decode
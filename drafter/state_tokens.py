@@ -0,0 +1,132 @@
+"""
+Compact, signed tokens that carry a state in a URL or form field.
+
+A raw ``json.dumps`` of a large state makes URLs too long for browsers and proxies, and lets
+anyone edit the state. A state token is instead::
+
+    "~" + urlsafe_base64(version + signature + zlib(json))
+
+* ``version`` is a single byte (``TOKEN_VERSION``), so the format can change later.
+* ``signature`` is an HMAC-SHA256 (cut to ``SIGNATURE_SIZE`` bytes) of the version and the
+  compressed JSON, keyed by the server's secret, so only tokens made by the server are accepted.
+* The ``~`` prefix is not a valid start of JSON, which tells tokens apart from raw JSON states.
+
+Both directions work on chunks: ``encode_state_token`` accepts the JSON as an iterable of strings
+(e.g., from ``json.JSONEncoder.iterencode``), compressing and signing each chunk as it comes, and
+decoding decompresses with a limit on the output, so a small token cannot expand into a huge state.
+"""
+from typing import Iterable, Union
+
+TOKEN_PREFIX = "~"
+TOKEN_VERSION = 1
+SIGNATURE_SIZE = 16
+DEFAULT_MAX_STATE_SIZE = 16 * 1024 * 1024
+DECOMPRESS_CHUNK_SIZE = 64 * 1024
+
+
+class StateTokenError(ValueError):
+    """ Raised when a state token is malformed, too large, or was not signed with the server's secret. """
+
+
+def make_secret() -> bytes:
+    """
+    Makes a new random secret for signing state tokens. Tokens signed with it are only accepted by
+    the same process, so sites with several workers should share a secret through the
+    ``DRAFTER_STATE_SECRET`` environment variable instead.
+
+    :return: 32 random bytes.
+    """
+    import secrets
+    return secrets.token_bytes(32)
+
+
+def as_secret(secret: Union[str, bytes]) -> bytes:
+    return secret.encode('utf-8') if isinstance(secret, str) else secret
+
+
+def is_state_token(value) -> bool:
+    """ Checks whether a value (e.g., a query parameter) looks like a state token, rather than raw JSON. """
+    return isinstance(value, str) and value.startswith(TOKEN_PREFIX)
+
+
+def encode_state_token(json_chunks: Union[str, Iterable[str]], secret: Union[str, bytes],
+                       level: int = 6) -> str:
+    """
+    Packs a JSON state into a signed, compressed, url-safe token.
+
+    :param json_chunks: The JSON text of the state, either whole or as an iterable of pieces.
+    :param secret: The key that the token is signed with.
+    :param level: The zlib compression level (1-9).
+    :return: The token, which is safe to use in URLs and form fields without further escaping.
+    """
+    import base64
+    import hashlib
+    import hmac
+    import zlib
+    if isinstance(json_chunks, str):
+        json_chunks = (json_chunks,)
+    version = bytes([TOKEN_VERSION])
+    signer = hmac.new(as_secret(secret), version, hashlib.sha256)
+    compressor = zlib.compressobj(level)
+    body = []
+    for chunk in json_chunks:
+        compressed = compressor.compress(chunk.encode('utf-8'))
+        if compressed:
+            signer.update(compressed)
+            body.append(compressed)
+    compressed = compressor.flush()
+    signer.update(compressed)
+    body.append(compressed)
+    token = version + signer.digest()[:SIGNATURE_SIZE] + b"".join(body)
+    return TOKEN_PREFIX + base64.urlsafe_b64encode(token).rstrip(b"=").decode('ascii')
+
+
+def decode_state_token(token: str, secret: Union[str, bytes], max_size: int = DEFAULT_MAX_STATE_SIZE) -> str:
+    """
+    Checks a token's signature and unpacks the JSON state inside it.
+
+    :param token: A token made by ``encode_state_token``.
+    :param secret: The key that the token must have been signed with.
+    :param max_size: The largest JSON text (in bytes) that the token may expand into.
+    :return: The JSON text of the state.
+    :raises StateTokenError: If the token is malformed, has an unknown version, was signed with a
+        different secret (or changed since), or expands into more than ``max_size`` bytes.
+    """
+    import base64
+    import binascii
+    import hashlib
+    import hmac
+    import zlib
+    if not is_state_token(token):
+        raise StateTokenError("Not a state token.")
+    encoded = token[len(TOKEN_PREFIX):]
+    try:
+        raw = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+    except (binascii.Error, ValueError) as e:
+        raise StateTokenError(f"The state token is not valid base64: {e}")
+    if len(raw) < 1 + SIGNATURE_SIZE:
+        raise StateTokenError("The state token is too short.")
+    if raw[0] != TOKEN_VERSION:
+        raise StateTokenError(f"Unknown state token version {raw[0]}.")
+    signature, body = raw[1:1 + SIGNATURE_SIZE], raw[1 + SIGNATURE_SIZE:]
+    expected = hmac.new(as_secret(secret), raw[:1] + body, hashlib.sha256).digest()[:SIGNATURE_SIZE]
+    if not hmac.compare_digest(signature, expected):
+        raise StateTokenError("The state token's signature does not match; it was changed or made by another server.")
+    decompressor = zlib.decompressobj()
+    pieces = []
+    size = 0
+    try:
+        data = body
+        while data:
+            piece = decompressor.decompress(data, DECOMPRESS_CHUNK_SIZE)
+            size += len(piece)
+            if size > max_size:
+                raise StateTokenError(f"The state token expands to more than {max_size} bytes.")
+            pieces.append(piece)
+            data = decompressor.unconsumed_tail
+        pieces.append(decompressor.flush())
+    except zlib.error as e:
+        raise StateTokenError(f"The state token could not be decompressed: {e}")
+    if not decompressor.eof:
+        raise StateTokenError("The state token is truncated.")
+    return b"".join(pieces).decode('utf-8')
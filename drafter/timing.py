@@ -0,0 +1,77 @@
+"""
+Timing of the phases of handling a request.
+
+Each request to a route goes through the same phases (restoring the state, preparing the arguments,
+calling the route function, verifying its result, rendering, and so on). A ``PhaseTimer`` measures
+how long each of them took with a monotonic clock, so that the times are not thrown off by changes
+to the system clock. The timings are sent to the browser in a ``Server-Timing`` header (shown in the
+browser's developer tools) and kept with the page load history for the debug information, which
+makes it easy to tell whether a slow page is spending its time in the route function or in Drafter.
+"""
+from typing import Dict, Optional
+import time
+
+# Skulpt may not provide a high resolution clock
+monotonic = getattr(time, 'perf_counter', time.time)
+
+
+class PhaseTimer:
+    """
+    Measures consecutive phases of a request. Starting a phase stops the previous one, and a phase
+    that is started more than once accumulates its durations.
+
+    :param timings: The dictionary to record the durations in, in milliseconds, by phase name.
+    :ivar timings: The duration of each phase so far, in milliseconds, in the order they first started.
+    :type timings: Dict[str, float]
+    """
+
+    def __init__(self, timings: Optional[Dict[str, float]] = None):
+        self.timings: Dict[str, float] = {} if timings is None else timings
+        self._phase: Optional[str] = None
+        self._started = 0.0
+
+    def start(self, phase: str):
+        """
+        Starts timing the given phase, stopping the current one (if any).
+
+        :param phase: The name of the phase (e.g., ``prepare_args``).
+        """
+        self.stop()
+        self._phase = phase
+        self._started = monotonic()
+
+    def stop(self):
+        """ Stops timing the current phase, if there is one, and records its duration. """
+        if self._phase is None:
+            return
+        elapsed = (monotonic() - self._started) * 1000
+        self.timings[self._phase] = self.timings.get(self._phase, 0.0) + elapsed
+        self._phase = None
+
+    @property
+    def total(self) -> float:
+        """ The total duration of all of the recorded phases, in milliseconds. """
+        return sum(self.timings.values())
+
+
+def format_server_timing(timings: Dict[str, float]) -> str:
+    """
+    Formats phase durations as the value of a ``Server-Timing`` header, followed by their total.
+
+    :param timings: The duration of each phase, in milliseconds, by phase name.
+    :return: The header value (e.g., ``prepare_args;dur=0.120, route;dur=3.400, total;dur=3.520``).
+    """
+    metrics = [f"{name};dur={duration:.3f}" for name, duration in timings.items()]
+    metrics.append(f"total;dur={sum(timings.values()):.3f}")
+    return ", ".join(metrics)
+
+
+def format_timings_html(timings: Dict[str, float]) -> str:
+    """
+    Formats phase durations as a short HTML summary for the debug information.
+
+    :param timings: The duration of each phase, in milliseconds, by phase name.
+    :return: A line of HTML listing each phase and its duration.
+    """
+    phases = ", ".join(f"<code>{name}</code> {duration:.2f} ms" for name, duration in timings.items())
+    return f"Timing: {phases} (total {sum(timings.values()):.2f} ms)"
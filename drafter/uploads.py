@@ -0,0 +1,354 @@
+"""
+Streaming, size-limited handling of uploaded files.
+
+Without this, an uploaded file passed through memory several times: Bottle copied the request body
+(to a temporary file, once it was big enough), parsed it into parts (another copy), and then the
+route's parameter was made by reading the whole part into ``bytes`` (and maybe decoding it again
+into a ``str``). Instead, ``read_multipart`` parses the request body as it arrives, in chunks:
+
+* Every file is written straight into an ``Upload``, which keeps it in memory only up to
+  ``spool_size`` bytes, and moves it into a temporary file after that.
+* Each file's hash is computed as it is written, so it never has to be read again to be hashed.
+* The whole request and every single file are limited in size; going over a limit stops the
+  upload right away (with a ``413`` response), instead of after all of it has been received.
+
+Besides ``bytes``, ``str``, ``dict``, and ``PIL.Image``, route parameters for files can then be
+annotated as an ``Upload`` itself, a file handle (``BinaryIO``), an iterator of chunks
+(``Iterator[bytes]``), or a ``pathlib.Path`` to the (temporary) file, none of which read the whole
+file into memory. The temporary files are deleted once the request is finished, so files that
+should be kept must be copied (e.g., with ``Upload.save``).
+"""
+import io
+import os
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+import bottle
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MAX_HEADER_SIZE = 16 * 1024
+MAX_FIELDS_SIZE = 1024 * 1024
+UPLOADS_ENVIRON_KEY = 'drafter.uploads'
+# Where Bottle caches the parsed form of a request; filling it in means Bottle never parses the body again
+BOTTLE_POST_ENVIRON_KEY = 'bottle.request.post'
+
+
+class UploadTooLarge(ValueError):
+    """ Raised when a request, or a single file in it, is larger than its configured limit. """
+
+
+class MalformedUpload(ValueError):
+    """ Raised when a ``multipart/form-data`` request body cannot be parsed. """
+
+
+@dataclass
+class UploadLimits:
+    """
+    The limits on uploaded files.
+
+    :ivar max_request_size: Largest request body (in bytes); zero (or less) means no limit.
+    :type max_request_size: int
+    :ivar max_file_size: Largest single uploaded file (in bytes); zero (or less) means no limit.
+    :type max_file_size: int
+    :ivar spool_size: Largest file (in bytes) kept in memory, rather than in a temporary file.
+    :type spool_size: int
+    :ivar hash_name: The ``hashlib`` algorithm that every file is hashed with (empty for none).
+    :type hash_name: str
+    """
+    max_request_size: int = 1024 * 1024 * 1024
+    max_file_size: int = 0
+    spool_size: int = 1024 * 1024
+    hash_name: str = 'sha256'
+
+
+class Upload(bottle.FileUpload):
+    """
+    An uploaded file, kept in memory while it is small and in a temporary file once it is not.
+    It works anywhere a ``bottle.FileUpload`` does (e.g., ``file``, ``filename``, and ``save``).
+
+    :param name: The name of the form field that the file was uploaded with.
+    :param filename: The file's original name, as given by the browser.
+    :param headers: The headers of the file's part of the request.
+    :param limits: The limits that the file must stay within.
+    :ivar size: The size of the file, in bytes.
+    :type size: int
+    :ivar hash_name: The algorithm of ``digest`` (e.g., ``sha256``), or empty if it was not hashed.
+    :type hash_name: str
+    """
+
+    def __init__(self, name: str, filename: str, headers: Optional[List[Tuple[str, str]]] = None,
+                 limits: Optional[UploadLimits] = None):
+        super().__init__(io.BytesIO(), name, filename, headers)
+        self.limits = limits or UploadLimits()
+        self.size = 0
+        self.hash_name = self.limits.hash_name
+        self._hash = None
+        if self.hash_name:
+            import hashlib
+            self._hash = hashlib.new(self.hash_name)
+        self._path: Optional[str] = None
+
+    def write(self, data: bytes):
+        """
+        Adds the next piece of the file, moving the file into a temporary file once it is larger
+        than ``spool_size``.
+
+        :param data: The next piece of the file.
+        :raises UploadTooLarge: If the file grows beyond ``max_file_size``.
+        """
+        self.size += len(data)
+        if 0 < self.limits.max_file_size < self.size:
+            raise UploadTooLarge(f"The file {self.raw_filename!r} is larger than the limit of "
+                                 f"{self.limits.max_file_size} bytes.")
+        if self._hash is not None:
+            self._hash.update(data)
+        if self._path is None and self.size > self.limits.spool_size:
+            self.spool()
+        self.file.write(data)
+
+    def spool(self) -> str:
+        """
+        Moves the file into a temporary file (if it is not already in one).
+
+        :return: The path of the temporary file.
+        """
+        if self._path is None:
+            import tempfile
+            in_memory = self.file
+            handle, self._path = tempfile.mkstemp(prefix="drafter-upload-")
+            self.file = os.fdopen(handle, 'w+b')
+            self.file.write(in_memory.getvalue())
+            in_memory.close()
+        return self._path
+
+    def finish(self):
+        """ Marks the end of the file, so that it is read from the beginning. """
+        self.file.flush()
+        self.file.seek(0)
+
+    @property
+    def digest(self) -> Optional[str]:
+        """ The (hexadecimal) hash of the file's contents, or None if it was not hashed. """
+        return self._hash.hexdigest() if self._hash is not None else None
+
+    @property
+    def path(self) -> str:
+        """ The path of a temporary file with the file's contents, which is made if needed. """
+        position = self.file.tell()
+        path = self.spool()
+        self.file.flush()
+        self.file.seek(position)
+        return path
+
+    def read(self) -> bytes:
+        """ Reads the entire file into memory. """
+        self.file.seek(0)
+        return self.file.read()
+
+    def chunks(self, size: int = UPLOAD_CHUNK_SIZE) -> Iterator[bytes]:
+        """
+        Reads the file a piece at a time, from the beginning.
+
+        :param size: The largest piece to read at a time.
+        :return: An iterator of the pieces.
+        """
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        """ Closes the file, deleting its temporary file (if any). """
+        self.file.close()
+        if self._path is not None:
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+
+    def __repr__(self):
+        return f"Upload({self.raw_filename!r}, size={self.size})"
+
+
+def parse_part_headers(block: bytes) -> Tuple[List[Tuple[str, str]], Optional[str], Optional[str]]:
+    """
+    Parses the headers of a single part of a ``multipart/form-data`` body.
+
+    :param block: The raw headers, one per line.
+    :return: The headers, along with the part's field name and filename (None if not a file).
+    :raises MalformedUpload: If a header cannot be parsed, or the part has no field name.
+    """
+    from email.message import Message
+    from email.utils import collapse_rfc2231_value
+    headers = []
+    for line in block.decode('utf-8', 'replace').split("\r\n"):
+        if not line:
+            continue
+        if ":" not in line:
+            raise MalformedUpload(f"The upload has a malformed header {line!r}.")
+        key, value = line.split(":", 1)
+        headers.append((key.strip(), value.strip()))
+    disposition = Message()
+    for key, value in headers:
+        if key.lower() == 'content-disposition':
+            disposition['Content-Disposition'] = value
+    name = disposition.get_param('name', header='Content-Disposition')
+    if name is None:
+        raise MalformedUpload("A part of the upload has no field name.")
+    filename = disposition.get_param('filename', header='Content-Disposition')
+    return headers, collapse_rfc2231_value(name), filename and collapse_rfc2231_value(filename)
+
+
+def read_multipart(read, boundary: str, limits: UploadLimits) -> Tuple[List[Tuple[str, str]], List[Upload]]:
+    """
+    Parses a ``multipart/form-data`` request body as it is read, streaming each file into an
+    ``Upload``.
+
+    :param read: Reads up to the given number of bytes of the body (e.g., ``wsgi.input.read``),
+        returning an empty result at the end.
+    :param boundary: The boundary between parts, from the request's ``Content-Type``.
+    :param limits: The limits on the request and its files.
+    :return: The form fields (as pairs of name and value), and the uploaded files.
+    :raises UploadTooLarge: If the request, a file, or the form fields are too large.
+    :raises MalformedUpload: If the body is not valid ``multipart/form-data``.
+    """
+    delimiter = b"\r\n--" + boundary.encode('latin1')
+    # The first boundary is not preceded by a line break, so one is added to find it the same way
+    buffer = b"\r\n"
+    received = 0
+    fields: List[Tuple[str, str]] = []
+    uploads: List[Upload] = []
+    fields_size = 0
+
+    def fill() -> bool:
+        nonlocal buffer, received
+        chunk = read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return False
+        received += len(chunk)
+        if 0 < limits.max_request_size < received:
+            raise UploadTooLarge(f"The request is larger than the limit of {limits.max_request_size} bytes.")
+        buffer += chunk
+        return True
+
+    part: Optional[Upload] = None
+    value: Optional[io.BytesIO] = None
+    name = None
+    try:
+        while True:
+            index = buffer.find(delimiter)
+            if index < 0:
+                # Everything but a possible start of the delimiter belongs to the current part
+                keep = len(delimiter) - 1
+                if len(buffer) > keep:
+                    piece, buffer = buffer[:-keep], buffer[-keep:]
+                    if part is not None:
+                        part.write(piece)
+                    elif value is not None:
+                        fields_size += len(piece)
+                        if fields_size > MAX_FIELDS_SIZE:
+                            raise UploadTooLarge(f"The form's fields are larger than {MAX_FIELDS_SIZE} bytes.")
+                        value.write(piece)
+                if not fill():
+                    raise MalformedUpload("The upload ended before its final boundary.")
+                continue
+            piece, buffer = buffer[:index], buffer[index + len(delimiter):]
+            if part is not None:
+                part.write(piece)
+                part.finish()
+                part = None
+            elif value is not None:
+                fields_size += len(piece)
+                if fields_size > MAX_FIELDS_SIZE:
+                    raise UploadTooLarge(f"The form's fields are larger than {MAX_FIELDS_SIZE} bytes.")
+                value.write(piece)
+                fields.append((name, value.getvalue().decode('utf-8', 'replace')))
+                value = None
+            while len(buffer) < 2 and fill():
+                pass
+            if buffer.startswith(b"--"):
+                # The final boundary; anything after it is ignored
+                return fields, uploads
+            end = buffer.find(b"\r\n\r\n")
+            while end < 0:
+                if len(buffer) > MAX_HEADER_SIZE:
+                    raise MalformedUpload("A part of the upload has headers that are too long.")
+                if not fill():
+                    raise MalformedUpload("The upload ended inside a part's headers.")
+                end = buffer.find(b"\r\n\r\n")
+            # The first line is the rest of the boundary's line
+            headers, name, filename = parse_part_headers(buffer[:end].partition(b"\r\n")[2])
+            buffer = buffer[end + 4:]
+            if filename:
+                part = Upload(name, filename, headers, limits)
+                uploads.append(part)
+            else:
+                value = io.BytesIO()
+    except Exception:
+        for upload in uploads:
+            upload.close()
+        raise
+
+
+def read_uploads(environ, limits: UploadLimits) -> Optional[List[Upload]]:
+    """
+    Parses the current request's uploaded files (if it has any), within the given limits. The
+    result is given to Bottle as the request's parsed form, so ``request.forms``, ``request.files``,
+    and ``request.params`` work as usual.
+
+    :param environ: The WSGI environment of the request.
+    :param limits: The limits on the request and its files.
+    :return: The uploaded files, or None if the request is not ``multipart/form-data``.
+    :raises UploadTooLarge: If the request (by its ``Content-Length``, or once read), a file, or the
+        form fields are too large.
+    :raises MalformedUpload: If the body is not valid ``multipart/form-data``.
+    """
+    if UPLOADS_ENVIRON_KEY in environ:
+        return environ[UPLOADS_ENVIRON_KEY]
+    from email.message import Message
+    content_type = Message()
+    content_type['Content-Type'] = environ.get('CONTENT_TYPE', '')
+    if content_type.get_content_type() != 'multipart/form-data' or 'wsgi.input' not in environ \
+            or BOTTLE_POST_ENVIRON_KEY in environ:
+        return None
+    boundary = content_type.get_param('boundary')
+    if not boundary:
+        raise MalformedUpload("The upload has no boundary.")
+    length = int(environ.get('CONTENT_LENGTH') or -1)
+    if 0 < limits.max_request_size < length:
+        raise UploadTooLarge(f"The request is larger than the limit of {limits.max_request_size} bytes.")
+    stream = environ['wsgi.input']
+    remaining = [length]
+
+    def read(size):
+        # Never read past the Content-Length, since some servers would wait for more
+        if remaining[0] >= 0:
+            size = min(size, remaining[0])
+            if not size:
+                return b""
+        chunk = stream.read(size)
+        remaining[0] -= len(chunk)
+        return chunk
+
+    fields, uploads = read_multipart(read, boundary, limits)
+    post = bottle.FormsDict()
+    post.recode_unicode = False
+    for name, value in fields:
+        post[name] = value
+    for upload in uploads:
+        post[upload.name] = upload
+    environ[BOTTLE_POST_ENVIRON_KEY] = post
+    environ[UPLOADS_ENVIRON_KEY] = uploads
+    return uploads
+
+
+def close_uploads(environ):
+    """
+    Closes the current request's uploaded files, deleting their temporary files.
+
+    :param environ: The WSGI environment of the request.
+    """
+    for upload in environ.pop(UPLOADS_ENVIRON_KEY, None) or ():
+        upload.close()
@@ -1,3 +1,5 @@
+from dataclasses import dataclass
+
 from drafter import *
 from threading import Thread
 from bottle import ServerAdapter, Bottle
@@ -55,4 +57,51 @@ class TestServer:
         self.thread.join()
 
     def run_server(self):
-        self.server.run(server=self.wsgi, **self.run_kwargs)
\ No newline at end of file
+        self.server.run(server=self.wsgi, **self.run_kwargs)
+
+
+@dataclass
+class Counter:
+    count: int
+
+
+def make_counter_server(name, *routes, initial_state=0, setup=True, **kwargs):
+    """
+    Makes a test server whose ``index`` page shows a count, with a button to the ``add`` route
+    that adds one to it. The count is kept as an ``int``, or in a ``Counter`` if the initial
+    state is one.
+
+    :param name: The custom name of the server.
+    :param routes: More route functions for the test; one named ``index`` or ``add`` replaces the
+        default one (the default ``add`` shows whichever ``index`` is used).
+    :param initial_state: The state that the server is set up with.
+    :param setup: Whether to set up the server, or leave it to the test (e.g., to add routes later).
+    :param kwargs: The configuration of the server.
+    :return: The server.
+    """
+    server = Server(_custom_name=name, **kwargs)
+    replaced = {function.__name__: function for function in routes}
+
+    if isinstance(initial_state, Counter):
+        def index(state: Counter) -> Page:
+            return Page(state, [f"Count is {state.count}", Button("Add", "add")])
+
+        def add(state: Counter) -> Page:
+            state.count += 1
+            return shown(state)
+    else:
+        def index(state: int) -> Page:
+            return Page(state, [f"Count is {state}", Button("Add", "add")])
+
+        def add(state: int) -> Page:
+            return shown(state + 1)
+
+    shown = replaced.get('index', index)
+    for function in [index, add]:
+        if function.__name__ not in replaced:
+            route(server=server)(function)
+    for function in routes:
+        route(server=server)(function)
+    if setup:
+        server.setup(initial_state)
+    return server
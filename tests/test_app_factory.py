@@ -0,0 +1,159 @@
+"""
+Tests for running a Drafter site under another WSGI or ASGI server.
+"""
+import asyncio
+
+from webtest import TestApp
+
+from drafter import *
+from drafter.serving import make_wsgi_environ, AsgiAdapter
+from tests.helpers import make_counter_server
+
+
+def make_server(**kwargs):
+    return make_counter_server("TEST_APP_FACTORY", setup=False, debug=False, **kwargs)
+
+
+async def asgi_request(app, method, path, headers=(), body=b"", query_string=b""):
+    scope = {'type': 'http', 'method': method, 'path': path, 'root_path': '', 'query_string': query_string,
+             'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+             'http_version': '1.1', 'scheme': 'http', 'server': ('testserver', 80), 'client': ('127.0.0.1', 1234)}
+    chunks = body if isinstance(body, list) else [body]
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': index < len(chunks) - 1}
+                for index, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    start = sent[0]
+    assert start['type'] == 'http.response.start'
+    assert sent[-1] == {'type': 'http.response.body', 'body': b"", 'more_body': False}
+    headers = [(name.decode('latin-1'), value.decode('latin-1')) for name, value in start['headers']]
+    return start['status'], headers, [message['body'] for message in sent[1:]]
+
+
+def test_wsgi_app_is_ready_to_mount():
+    app = make_server().wsgi_app(5)
+    visitor = TestApp(app)
+    assert "Count is 5" in visitor.get("/").text
+    assert "Count is 6" in visitor.get("/add").text
+
+
+def test_asgi_app_matches_wsgi_app():
+    server = make_server()
+    app = server.asgi_app(0)
+
+    async def visit():
+        status, headers, _ = await asgi_request(app, 'GET', '/')
+        assert status == 200
+        cookie = dict(headers)['set-cookie'].split(";")[0]
+        _, _, body = await asgi_request(app, 'GET', '/add', headers=[('cookie', cookie)])
+        assert b"Count is 1" in b"".join(body)
+        _, _, body = await asgi_request(app, 'POST', '/add', headers=[('cookie', cookie)])
+        assert b"Count is 2" in b"".join(body)
+        status, _, _ = await asgi_request(app, 'GET', '/missing')
+        assert status == 404
+
+    asyncio.run(visit())
+
+
+def test_asgi_app_streams_pages():
+    server = make_server(stream_pages=True, stream_chunk_size=64)
+
+    async def visit():
+        _, _, body = await asgi_request(server.asgi_app(3), 'GET', '/')
+        assert len(body) > 2
+        assert b"Count is 3" in b"".join(body)
+
+    asyncio.run(visit())
+
+
+def test_asgi_app_supports_write_callable():
+    def legacy_app(environ, start_response):
+        write = start_response("200 OK", [("Content-Type", "text/plain")])
+        write(b"Written, ")
+        return [b"then returned"]
+
+    async def visit():
+        status, headers, body = await asgi_request(AsgiAdapter(legacy_app), 'GET', '/')
+        assert status == 200
+        assert body == [b"Written, ", b"then returned", b""]
+
+    asyncio.run(visit())
+
+
+def test_asgi_uploads_are_spooled_and_limited(monkeypatch):
+    import tempfile
+    server = make_server(upload_max_request_size=100000, upload_spool_size=1000)
+
+    @route(server=server)
+    def receive(state: int, data: bytes) -> Page:
+        return Page(state, [f"Received {len(data)} bytes"])
+
+    app = server.asgi_app(0)
+    spooled = []
+    spool = tempfile.SpooledTemporaryFile
+
+    def track(*args, **kwargs):
+        spooled.append(spool(*args, **kwargs))
+        return spooled[-1]
+    monkeypatch.setattr(tempfile, "SpooledTemporaryFile", track)
+
+    def upload(data: bytes, length=None):
+        body = (b"--x\r\nContent-Disposition: form-data; name=\"data\"; filename=\"d.bin\"\r\n\r\n" +
+                data + b"\r\n--x--\r\n")
+        headers = [('content-type', 'multipart/form-data; boundary=x')]
+        if length is not None:
+            headers.append(('content-length', str(length)))
+        chunks = [body[start:start + 4096] for start in range(0, len(body), 4096)]
+        return asgi_request(app, 'POST', '/receive', headers=headers, body=chunks)
+
+    async def visit():
+        status, _, body = await upload(b"a" * 50000)
+        assert status == 200
+        assert b"Received 50000 bytes" in b"".join(body)
+        # The body went into a temporary file instead of staying in memory
+        assert spooled[-1]._rolled and spooled[-1].closed
+        status, _, body = await upload(b"a" * 200000)
+        assert status == 413
+        assert b"limit of 100000 bytes" in b"".join(body)
+        status, _, _ = await upload(b"a", length=200000)
+        assert status == 413
+
+    asyncio.run(visit())
+
+
+def test_asgi_lifespan():
+    app = make_server().asgi_app(0)
+    messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message['type'])
+
+    asyncio.run(app({'type': 'lifespan'}, receive, send))
+    assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+
+
+def test_make_wsgi_environ():
+    environ = make_wsgi_environ({
+        'type': 'http', 'method': 'POST', 'path': '/site/add', 'root_path': '/site', 'query_string': b"a=1",
+        'headers': [(b'content-type', b'text/plain'), (b'cookie', b'a=1'), (b'cookie', b'b=2'),
+                    (b'x-thing', b'one'), (b'x-thing', b'two')],
+    }, b"hello")
+    assert environ['SCRIPT_NAME'] == '/site'
+    assert environ['PATH_INFO'] == '/add'
+    assert environ['QUERY_STRING'] == 'a=1'
+    assert environ['CONTENT_TYPE'] == 'text/plain'
+    assert environ['CONTENT_LENGTH'] == '5'
+    assert environ['HTTP_COOKIE'] == 'a=1; b=2'
+    assert environ['HTTP_X_THING'] == 'one,two'
+    assert environ['wsgi.input'].read() == b"hello"
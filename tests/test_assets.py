@@ -0,0 +1,62 @@
+"""
+Tests for serving theme files as content-hashed assets.
+"""
+import re
+
+from webtest import TestApp
+
+from drafter import *
+from drafter.assets import AssetRegistry, make_asset, ASSET_CACHE_CONTROL
+from tests.helpers import make_counter_server
+
+
+def index(state: int) -> Page:
+    return Page(state, ["Hello"])
+
+
+def make_server(**kwargs):
+    return make_counter_server("TEST_ASSETS", index, **kwargs)
+
+
+def test_asset_hash_depends_on_content():
+    first, second = make_asset("a.css", "p {}", "css"), make_asset("b.css", "p {}", "css")
+    assert first.filename == second.filename
+    assert make_asset("a.css", "div {}", "css").digest != first.digest
+    assert first.to_tag() == f'<link rel="stylesheet" href="/--assets/{first.digest}.css">'
+    assert make_asset("a.js", "1", "js").to_tag().startswith('<script src="/--assets/')
+
+
+def test_registry_hashes_themes_once():
+    registry = AssetRegistry()
+    skeleton = registry.get_theme("skeleton")
+    assert registry.get_theme("skeleton") is skeleton
+    assert [asset.name for asset in skeleton.styles] == ["skeleton.css"]
+    assert registry.get(skeleton.styles[0].filename) is skeleton.styles[0]
+    assert registry.get_theme("missing") is None
+
+
+def test_pages_inline_assets_by_default():
+    visitor = TestApp(make_server().app)
+    page = visitor.get("/").text
+    assert "/--assets/" not in page
+    assert "<style>" in page
+
+
+def test_pages_link_to_cacheable_assets():
+    visitor = TestApp(make_server(inline_assets=False).app)
+    page = visitor.get("/").text
+    urls = re.findall(r'(?:href|src)="(/--assets/[0-9a-f]+\.(?:css|js))"', page)
+    assert any(url.endswith(".css") for url in urls)
+    assert any(url.endswith(".js") for url in urls)
+    assert len(page) < 20000
+
+    for url in urls:
+        asset = visitor.get(url)
+        assert asset.headers['Cache-Control'] == ASSET_CACHE_CONTROL
+        etag = asset.headers['ETag']
+        assert etag.strip('"') in url
+        cached = visitor.get(url, headers={'If-None-Match': etag}, status=304)
+        assert cached.body == b""
+    stylesheet = visitor.get(urls[0])
+    assert stylesheet.content_type in ("text/css", "application/javascript")
+    visitor.get("/--assets/0000.css", status=404)
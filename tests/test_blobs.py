@@ -0,0 +1,153 @@
+import io
+import re
+from dataclasses import dataclass
+
+import pytest
+from webtest import TestApp
+
+from drafter import *
+from drafter.server import Server
+from drafter.blobs import BlobStore, BLOB_HANDLE_PREFIX
+from drafter.image_support import HAS_PILLOW, PILImage
+
+pytestmark = pytest.mark.skipif(not HAS_PILLOW, reason="Pillow is not installed")
+
+
+@dataclass
+class Canvas:
+    name: str
+    picture: PILImage.Image if HAS_PILLOW else object
+
+
+def test_images_are_encoded_once(monkeypatch):
+    import drafter.blobs
+    encoded = []
+    original = drafter.blobs.encode_png
+    monkeypatch.setattr(drafter.blobs, "encode_png", lambda image: encoded.append(image) or original(image))
+    store = BlobStore()
+    red = PILImage.new("RGB", (8, 8), "red")
+    first = store.add_image(red)
+    # A different object with the same pixels is the same blob
+    assert store.add_image(PILImage.new("RGB", (8, 8), "red")) is first
+    assert len(encoded) == 1
+    red.putpixel((0, 0), (0, 0, 255))
+    assert store.add_image(red).digest != first.digest
+    assert len(encoded) == 2
+    assert store.get(first.filename).content == first.content
+    assert store.get("../../etc/passwd") is None
+
+
+def test_old_blobs_move_to_disk(tmp_path):
+    store = BlobStore(max_bytes=1)
+    blobs = [store.add(bytes([i]) * 100, 'png') for i in range(3)]
+    assert len(store) == 1 and store.total_bytes == 100
+    assert store.get(blobs[0].filename).content == blobs[0].content
+    shared = BlobStore(path=str(tmp_path))
+    blob = shared.add(b"shared", 'png')
+    # Another worker using the same folder can serve the blob
+    assert BlobStore(path=str(tmp_path)).get(blob.filename).content == b"shared"
+
+
+def test_temporary_folder_is_removed_at_exit(tmp_path, monkeypatch):
+    import atexit
+    import os
+    at_exit = []
+    monkeypatch.setattr(atexit, "register", at_exit.append)
+    store = BlobStore(max_bytes=1)
+    for i in range(3):
+        store.add(bytes([i]) * 100, 'png')
+    folder = store._temporary_folder
+    assert len(os.listdir(folder)) == 2
+    assert at_exit == [store.remove_temporary_folder]
+    store.remove_temporary_folder()
+    assert not os.path.exists(folder)
+    # A folder that was configured is kept
+    shared = BlobStore(max_bytes=1, path=str(tmp_path))
+    shared.add(b"first", 'png')
+    shared.add(b"second", 'png')
+    shared.remove_temporary_folder()
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_pages_and_states_link_to_blobs():
+    server = Server(_custom_name="TEST_BLOBS")
+
+    @route(server=server)
+    def index(state: Canvas) -> Page:
+        return Page(state, [f"Canvas {state.name}", Image(state.picture),
+                            Download("Save", "canvas.png", state.picture), Button("Flip", "flip")])
+
+    @route(server=server)
+    def flip(state: Canvas) -> Page:
+        state.picture = state.picture.transpose(PILImage.Transpose.FLIP_LEFT_RIGHT)
+        return index(state)
+
+    picture = PILImage.new("RGB", (64, 64), "white")
+    picture.putpixel((0, 0), (255, 0, 0))
+    server.setup(Canvas("Ada", picture))
+    visitor = TestApp(server.app)
+    page = visitor.get("/")
+    assert "data:image" not in page.text
+    urls = set(re.findall(r"(/--blobs/[0-9a-f]+\.png)", page.text))
+    assert len(urls) == 1
+    url = urls.pop()
+    image = visitor.get(url)
+    assert image.content_type == "image/png"
+    assert PILImage.open(io.BytesIO(image.body)).getpixel((0, 0)) == (255, 0, 0)
+    assert visitor.get(url, headers={"If-None-Match": image.headers["ETag"]}, status=304).body == b""
+    visitor.get("/--blobs/0123.png", status=404)
+    assert BLOB_HANDLE_PREFIX in server.dump_state()
+    flipped = visitor.get("/flip")
+    assert url not in flipped.text
+    session = next(iter(server.sessions._sessions.values()))
+    assert session.state.picture.getpixel((63, 0)) == (255, 0, 0)
+
+
+def test_images_can_still_be_inlined():
+    server = Server(_custom_name="TEST_INLINE_IMAGES", inline_images=True)
+
+    @route(server=server)
+    def index(state: str) -> Page:
+        return Page(state, [Image(PILImage.new("RGB", (4, 4), "blue"))])
+
+    server.setup("")
+    try:
+        assert "data:image/png;base64," in TestApp(server.app).get("/").text
+    finally:
+        server.blobs.enabled = True
+
+
+def test_several_workers_without_a_blob_path_inline_images(caplog):
+    server = Server(_custom_name="TEST_BLOBS_WITH_WORKERS")
+
+    @route(server=server)
+    def index(state: str) -> Page:
+        return Page(state, [Image(PILImage.new("RGB", (4, 4), "green"))])
+
+    server.setup("")
+    # Stop before any process is forked
+    server.app.run = lambda **kwargs: None
+    try:
+        with caplog.at_level("WARNING", logger="drafter"):
+            server.run(workers=2)
+        assert "blob_path" in caplog.text
+        assert "data:image/png;base64," in TestApp(server.app).get("/").text
+    finally:
+        server.blobs.enabled = True
+
+
+def test_several_workers_with_a_blob_path_link_to_blobs(tmp_path):
+    server = Server(_custom_name="TEST_SHARED_BLOBS", blob_path=str(tmp_path))
+
+    @route(server=server)
+    def index(state: str) -> Page:
+        return Page(state, [Image(PILImage.new("RGB", (4, 4), "purple"))])
+
+    server.setup("")
+    server.app.run = lambda **kwargs: None
+    try:
+        server.run(workers=2)
+        assert "/--blobs/" in TestApp(server.app).get("/").text
+        assert list(tmp_path.iterdir())
+    finally:
+        server.blobs.configure(server.blobs.max_bytes, '', True)
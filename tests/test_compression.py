@@ -0,0 +1,93 @@
+"""
+Tests for negotiated response compression.
+"""
+import gzip
+import io
+import zlib
+
+import pytest
+from webtest import TestApp
+
+from drafter import *
+from drafter.compression import negotiate_encoding, compress
+from tests.helpers import make_counter_server
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("gzip", "gzip"),
+    ("deflate", "deflate"),
+    ("gzip, deflate, br", "gzip"),
+    ("gzip;q=0.5, deflate", "deflate"),
+    ("gzip;q=0, deflate;q=0", None),
+    ("identity", None),
+    ("*", "gzip"),
+    ("*;q=0.1, gzip;q=0", "deflate"),
+    ("GZIP;q=bad", None),
+])
+def test_negotiate_encoding(header, expected):
+    assert negotiate_encoding(header) == expected
+
+
+def test_compress_round_trips():
+    data = b"<p>Hello</p>" * 100
+    assert gzip.decompress(compress(data, "gzip")) == data
+    assert compress(data, "gzip") == compress(data, "gzip")
+    assert zlib.decompress(compress(data, "deflate", 1)) == data
+    with pytest.raises(ValueError):
+        compress(data, "br")
+
+
+def raw_get(server, path, accept_encoding=None):
+    """ Makes a request without WebTest, which would otherwise decompress the response for us. """
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+               'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO()}
+    if accept_encoding is not None:
+        environ['HTTP_ACCEPT_ENCODING'] = accept_encoding
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started.update(headers)
+
+    return started, b"".join(server.app(environ, start_response))
+
+
+def index(state: int) -> Page:
+    return Page(state, ["Hello " * 10])
+
+
+def make_server(**kwargs):
+    return make_counter_server("TEST_COMPRESSION", index, **kwargs)
+
+
+def test_pages_are_compressed_when_accepted():
+    server = make_server()
+    headers, plain = raw_get(server, "/")
+    assert 'Content-Encoding' not in headers
+    assert headers['Vary'] == 'Accept-Encoding'
+    headers, compressed = raw_get(server, "/", "gzip, deflate")
+    assert headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(compressed) == plain
+    assert len(compressed) * 3 < len(plain)
+    # WebTest decompresses the response on its own
+    assert "Hello Hello" in TestApp(server.app).get("/", headers={'Accept-Encoding': 'gzip'}).text
+
+
+def test_compression_settings():
+    headers, _ = raw_get(make_server(compression_min_size=10 ** 9), "/", "gzip")
+    assert 'Content-Encoding' not in headers
+    headers, _ = raw_get(make_server(compression_level=0), "/", "gzip")
+    assert 'Content-Encoding' not in headers and 'Vary' not in headers
+
+
+def test_assets_are_compressed_once():
+    server = make_server(inline_assets=False)
+    raw_get(server, "/")
+    asset = server.assets.get_theme("skeleton").styles[0]
+    headers, body = raw_get(server, asset.url, "deflate")
+    assert headers['Content-Encoding'] == 'deflate'
+    assert zlib.decompress(body) == asset.content
+    first = asset.compressed['deflate']
+    raw_get(server, asset.url, "deflate")
+    assert asset.compressed['deflate'] is first
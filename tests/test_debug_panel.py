@@ -0,0 +1,62 @@
+from webtest import TestApp
+
+from drafter import *
+from tests.helpers import make_counter_server
+
+
+def make_server(**kwargs):
+    return make_counter_server("TEST_DEBUG_PANEL", **kwargs)
+
+
+def test_main_page_only_has_placeholder():
+    visitor = TestApp(make_server().app)
+    for _ in range(30):
+        visitor.get("/add")
+    page = visitor.get("/add").text
+    assert "data-debug-section='history'" in page
+    assert "Page Load History" in page
+    assert "Loading..." in page
+    assert "assert_equal(" not in page
+    # Only the current route starts open, and it comes with the page instead of being fetched
+    assert page.count("<details open data-debug-section=") == 1
+    assert "<details open data-debug-section='route'>" in page
+    assert "Route function: <code>add</code>" in page
+
+
+def test_debug_sections_are_served_separately():
+    visitor = TestApp(make_server().app)
+    visitor.get("/add")
+    state = visitor.get("/--debug/state")
+    assert state.headers['Cache-Control'] == 'no-store'
+    assert "<code>1</code>" in state.text
+    routes = visitor.get("/--debug/routes").text
+    assert "add(state)" in routes
+    combined = visitor.get("/--debug/combined").text
+    assert "assert_equal(" in combined
+    visitor.get("/--debug/nonsense", status=404)
+
+
+def test_debug_history_is_paginated():
+    visitor = TestApp(make_server(debug_page_size=5).app)
+    for _ in range(12):
+        visitor.get("/add")
+    first = visitor.get("/--debug/history").text
+    assert first.count("<li>") == 5
+    assert "index(state=12)" in first or "Count is 12" in first
+    assert "data-debug-page='1'" in first
+    assert "data-debug-page='-1'" not in first
+    last = visitor.get("/--debug/history?page=2").text
+    assert last.count("<li>") == 2
+    assert "data-debug-page='1'" in last
+    assert "Older" not in last
+    full = visitor.get("/--debug?page=1").text
+    assert "Debug Information" in full
+    assert "<ol start='6'>" in full
+
+
+def test_debug_endpoints_hidden_without_debug():
+    visitor = TestApp(make_server(debug=False).app)
+    page = visitor.get("/").text
+    assert "Debug Information" not in page
+    visitor.get("/--debug", status=404)
+    visitor.get("/--debug/history", status=404)
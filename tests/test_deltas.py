@@ -0,0 +1,122 @@
+import json
+import re
+
+from webtest import TestApp
+
+from drafter import *
+from drafter.server import Server
+from drafter.deltas import diff_json, patch_json, DeltaHistoryBuffer, StateDelta
+from drafter.history import HistoryBuffer, estimate_visit_size, VisitedPage
+
+
+def make_state(step: int) -> str:
+    return json.dumps({"owner": "Ada", "count": step, "flag": step % 2 == 0,
+                       "items": [{"name": f"Item {i}", "quantity": i} for i in range(20 + step % 3)],
+                       "notes": {f"note {i}": "x" * 20 for i in range(step % 4)}})
+
+
+def make_visit(step: int) -> VisitedPage:
+    return VisitedPage(f"/page{step}", make_state, str(step), "Finished Page Load", "")
+
+
+def test_patches_turn_old_values_into_new_ones():
+    pairs = [
+        ({"a": 1, "b": [1, 2, 3]}, {"a": 1, "b": [1, 5, 3, 4], "c": None}),
+        ({"a": 1, "b": 2}, {"b": 2}),
+        ([1, 2, 3], [1]),
+        ({"x": 1}, {"x": True}),
+        ({"x": 1.0}, {"x": 1}),
+        ("text", {"now": "dict"}),
+        ([[1, 2], [3]], [[1, 2], [3, 4]]),
+    ]
+    for old, new in pairs:
+        patch = json.loads(json.dumps(diff_json(old, new)))
+        restored = patch_json(json.loads(json.dumps(old)), patch)
+        assert json.dumps(restored) == json.dumps(new)
+    assert diff_json({"a": [1, {"b": 2}]}, {"a": [1, {"b": 2}]}) is None
+
+
+def test_buffer_reconstructs_every_state():
+    buffer = DeltaHistoryBuffer(keyframe_interval=4)
+    states = [make_state(step) for step in range(10)]
+    for step, state in enumerate(states):
+        buffer.append((make_visit(step), state))
+    assert [state for _, state in buffer] == states
+    assert [buffer[index][1] for index in range(10)] == states
+    assert buffer[-1][1] == states[-1]
+    assert [isinstance(buffer.stored(index)[1], StateDelta) for index in range(5)] == [False, True, True, True, False]
+
+
+def test_eviction_keeps_a_keyframe_first():
+    buffer = DeltaHistoryBuffer(max_entries=3, keyframe_interval=10)
+    states = [make_state(step) for step in range(6)]
+    evicted = []
+    for step, state in enumerate(states):
+        evicted.extend(buffer.append((make_visit(step), state)))
+    assert [state for _, state in evicted] == states[:3]
+    assert not isinstance(buffer.stored(0)[1], StateDelta)
+    assert [state for _, state in buffer] == states[3:]
+
+
+def test_deltas_take_much_less_memory():
+    plain = HistoryBuffer(1000, 10 ** 9, estimate_visit_size)
+    deltas = DeltaHistoryBuffer(1000, 10 ** 9, estimate_visit_size, keyframe_interval=32)
+    state = {"owner": "Ada", "count": 0, "items": [{"name": f"Item {i}", "quantity": i} for i in range(50)]}
+    for step in range(1000):
+        # Like most routes, each step only changes a couple of fields
+        state["count"] = step
+        state["items"][step % 50]["quantity"] += 1
+        entry = (VisitedPage("/", make_state, "", "", ""), json.dumps(state))
+        plain.append(entry)
+        deltas.append(entry)
+    assert deltas.total_bytes * 10 < plain.total_bytes
+
+
+def test_history_links_restore_reconstructed_states(capsys):
+    server = Server(_custom_name="TEST_DELTAS", history_keyframe_interval=3)
+
+    @route(server=server)
+    def index(state: int) -> Page:
+        return Page(state, [f"Count is {state}", Button("Add", "add")])
+
+    @route(server=server)
+    def add(state: int) -> Page:
+        return index(state + 1)
+
+    server.setup(0)
+    visitor = TestApp(server.app)
+    for _ in range(8):
+        visitor.get("/add")
+    history = visitor.get("/--debug/history").text
+    links = re.findall(r"<a href='([^']*--restore-history=[^']*)'>", history)
+    assert len(links) == 8
+    assert "--restorable-state" not in history
+    # The oldest page load started from the initial state, the newest from a count of 7
+    assert "Count is 1" in visitor.get(links[-1].replace("&amp;", "&"))
+    assert "Count is 8" in visitor.get(links[0].replace("&amp;", "&"))
+    assert "Count is 9" in visitor.get("/add?--restore-history=999")
+    assert "no longer in the history" in capsys.readouterr().out
+
+
+def test_current_route_does_not_reconstruct_states(monkeypatch):
+    server = Server(_custom_name="TEST_DELTAS", history_keyframe_interval=3)
+
+    @route(server=server)
+    def index(state: int) -> Page:
+        return Page(state, [f"Count is {state}", Button("Add", "add")])
+
+    @route(server=server)
+    def add(state: int) -> Page:
+        return index(state + 1)
+
+    server.setup(0)
+    visitor = TestApp(server.app)
+    for _ in range(5):
+        visitor.get("/add")
+    reconstructed = []
+    state_at = DeltaHistoryBuffer.state_at
+    monkeypatch.setattr(DeltaHistoryBuffer, "state_at",
+                        lambda self, index: reconstructed.append(index) or state_at(self, index))
+    assert "Route function: <code>add</code>" in visitor.get("/add")
+    assert "Route function: <code>add</code>" in visitor.get("/--debug/route")
+    assert reconstructed == []
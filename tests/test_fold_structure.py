@@ -0,0 +1,65 @@
+import json
+from dataclasses import dataclass, field
+from typing import List
+
+import pytest
+
+from drafter.history import dehydrate_json, safe_repr, fold_structure, expand_for_json, \
+    expand_for_dumps, dump_json
+
+
+@dataclass
+class Link:
+    name: str
+    links: List['Link'] = field(default_factory=list)
+
+
+def make_chain(depth: int) -> list:
+    root = current = []
+    for i in range(depth):
+        child = [i]
+        current.append(child)
+        current = child
+    return root
+
+
+def test_deep_structures_do_not_hit_recursion_limit():
+    chain = make_chain(50000)
+    dumped = dehydrate_json(chain)[0]
+    for _ in range(1000):
+        dumped = dumped[1]
+    assert dumped[0] == 1000
+    assert safe_repr(chain).startswith("[[0, [1, [2, ")
+
+
+def test_cycles_are_detected():
+    first = Link("first")
+    second = Link("second", [first])
+    first.links.append(second)
+    with pytest.raises(ValueError, match="Circular reference"):
+        dehydrate_json(first)
+    assert "<strong>Circular Reference</strong>" in safe_repr(first)
+    cycle = {}
+    cycle["self"] = cycle
+    assert safe_repr(cycle) == "{&#x27;self&#x27;: <strong>Circular Reference</strong>}"
+
+
+def test_shared_values_are_not_cycles():
+    shared = Link("shared")
+    parent = Link("parent", [shared, shared])
+    assert dehydrate_json(parent) == {"name": "parent", "links": [{"name": "shared", "links": []}] * 2}
+    assert "Circular" not in safe_repr([parent, parent])
+
+
+def test_results_match_structure():
+    assert dehydrate_json({"a": (1, {2}), "b": Link("x")}) == {"a": [1, [2]], "b": {"name": "x", "links": []}}
+    assert safe_repr([(1, "a"), {2: None}, frozenset({3})]) == \
+        "[(1, &#x27;a&#x27;), {2: None}, frozenset({3})]"
+    assert fold_structure([], expand_for_json, lambda value: None) == []
+
+
+def test_deep_json_is_dumped_without_recursion():
+    data = {"a": [1, 2.5, None, True, "é"], 3: {"b": []}, None: {}, 1.5: "f", False: 0}
+    assert fold_structure(data, expand_for_dumps, lambda value: None) == json.dumps(data)
+    assert dump_json(data) == json.dumps(data)
+    assert dump_json(dehydrate_json(make_chain(5000))).startswith("[[0, [1, [2, ")
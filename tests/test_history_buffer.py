@@ -0,0 +1,101 @@
+"""
+Tests for the bounded page and state history.
+"""
+from webtest import TestApp
+
+from drafter import *
+from drafter.history import HistoryBuffer, VisitedPage, estimate_visit_size, read_history_log
+
+
+def test_buffer_keeps_newest_entries():
+    buffer = HistoryBuffer(max_entries=3)
+    evicted = []
+    for i in range(5):
+        evicted.extend(buffer.append(i))
+    assert list(buffer) == [2, 3, 4]
+    assert evicted == [0, 1]
+    assert buffer.evicted == 2
+    assert buffer[-1] == 4
+    assert list(reversed(buffer)) == [4, 3, 2]
+    buffer.clear()
+    assert len(buffer) == 0 and buffer.evicted == 0
+
+
+def test_buffer_respects_byte_budget():
+    buffer = HistoryBuffer(max_bytes=10, sizer=len)
+    buffer.append("aaaa")
+    buffer.append("bbbb")
+    assert buffer.append("cccc") == ["aaaa"]
+    assert buffer.total_bytes == 8
+    # The newest entry is always kept, even if it is too big on its own
+    assert buffer.append("d" * 20) == ["bbbb", "cccc"]
+    assert list(buffer) == ["d" * 20]
+
+
+def test_buffer_remeasures_growing_entries():
+    buffer = HistoryBuffer(max_bytes=10, sizer=lambda entry: len(entry[0]))
+    buffer.append(["aaaa"])
+    buffer.append(["b"])
+    buffer[-1][0] = "bbbbbbbb"
+    assert buffer.remeasure_last() == [["aaaa"]]
+    assert buffer.total_bytes == 8
+
+
+def test_estimate_visit_size():
+    visit = VisitedPage("/index", print, "1, 2", "Finished", "", original_page_content="x" * 10)
+    assert estimate_visit_size((visit, "{}")) == 2 + 10 + 4 + 6
+
+
+def test_server_history_is_bounded_and_spilled(tmp_path):
+    spill_path = str(tmp_path / "history.log.gz")
+    server = Server(_custom_name="TEST_HISTORY", history_max_entries=3, history_spill_path=spill_path)
+
+    @route(server=server)
+    def index(state: int) -> Page:
+        return Page(state, [f"Count is {state}", Button("Add", "add")])
+
+    @route(server=server)
+    def add(state: int) -> Page:
+        return index(state + 1)
+
+    server.setup(0)
+    visitor = TestApp(server.app)
+    for _ in range(5):
+        visitor.get("/add")
+    session = next(iter(server.sessions._sessions.values()))
+    assert len(session.page_history) == 3
+    assert len(session.state_history) == 3
+    visitor.get("/add")
+    page = visitor.get("/--debug/history").text
+    assert "3 earlier page loads are no longer kept" in page
+
+    server._history_spill.flush()
+    spilled = list(read_history_log(spill_path))
+    assert [entry["old_state"] for entry in spilled] == ["0", "1", "2"]
+    assert all(entry["function"] == "add" for entry in spilled)
+    assert all(entry["session"] == session.session_id for entry in spilled)
+
+
+def test_pending_spilled_entries_are_written_at_exit(tmp_path, monkeypatch):
+    import atexit
+    at_exit = []
+    monkeypatch.setattr(atexit, "register", at_exit.append)
+    spill_path = str(tmp_path / "history.log.gz")
+    server = Server(_custom_name="TEST_HISTORY", history_max_entries=1, history_spill_path=spill_path)
+
+    @route(server=server)
+    def index(state: int) -> Page:
+        return Page(state, [f"Count is {state}", Button("Add", "add")])
+
+    @route(server=server)
+    def add(state: int) -> Page:
+        return index(state + 1)
+
+    server.setup(0)
+    visitor = TestApp(server.app)
+    for _ in range(3):
+        visitor.get("/add")
+    assert at_exit == [server._history_spill.flush]
+    # Prefork workers exit without running atexit functions, so they write out the log themselves
+    server.before_exit()
+    assert [entry["old_state"] for entry in read_history_log(spill_path)] == ["0", "1"]
@@ -0,0 +1,27 @@
+from benchmarks.load_test import run_load_test, percentile, WsgiVisitor, Step
+from benchmarks.sites import inventory_site
+
+
+def test_percentile():
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 0.5) == 50
+    assert percentile(values, 0.95) == 95
+    assert percentile(values, 0.99) == 99
+    assert percentile([], 0.5) == 0
+
+
+def test_visitor_keeps_its_session():
+    visitor = WsgiVisitor(inventory_site(debug=False).app)
+    assert visitor.request(Step("/add_item"))[0] == 200
+    assert visitor.session_id is not None
+    status, size = visitor.request(Step("/rename", {"name": "Grace"}, "POST"))
+    assert status == 200 and size > 0
+
+
+def test_threaded_load_test():
+    result = run_load_test(concurrency=3, iterations=2, site_options={'debug': False})
+    assert result.requests == 3 * 2 * 6
+    assert result.errors == 0
+    assert result.requests_per_second > 0
+    assert 0 < result.p50 <= result.p95 <= result.p99
+    assert result.allocated_bytes_per_request > 0
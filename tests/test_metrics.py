@@ -0,0 +1,96 @@
+import threading
+
+from webtest import TestApp
+
+from drafter import *
+from drafter.server import Server
+from drafter.metrics import Counter, Histogram, Gauge, MetricsRegistry, escape_label_value
+from tests.helpers import make_counter_server
+
+
+def test_counter_across_threads():
+    counter = Counter("things_total", "Things.", ["kind"])
+
+    def count():
+        for _ in range(1000):
+            counter.inc(("a",))
+        counter.inc(("b",), 5)
+
+    threads = [threading.Thread(target=count) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counter.values() == {("a",): 4000, ("b",): 20}
+    assert 'things_total{kind="a"} 4000' in counter.render()
+
+
+def test_histogram_buckets():
+    histogram = Histogram("latency_seconds", "Latency.", [0.1, 1.0])
+    for value in [0.05, 0.1, 0.5, 3]:
+        histogram.observe(value)
+    lines = histogram.render().splitlines()
+    assert lines[:2] == ["# HELP latency_seconds Latency.", "# TYPE latency_seconds histogram"]
+    assert lines[2:] == ['latency_seconds_bucket{le="0.1"} 2',
+                         'latency_seconds_bucket{le="1"} 3',
+                         'latency_seconds_bucket{le="+Inf"} 4',
+                         'latency_seconds_sum 3.65',
+                         'latency_seconds_count 4']
+
+
+def test_gauge_and_registry():
+    registry = MetricsRegistry()
+    gauge = registry.register(Gauge("size", "Size."))
+    registry.register(Gauge("computed", "Computed.", lambda: 7))
+    gauge.set(3)
+    rendered = registry.render()
+    assert "size 3\n" in rendered
+    assert "computed 7\n" in rendered
+    registry.reset()
+    assert "size 0\n" in registry.render()
+
+
+def test_escape_label_value():
+    assert escape_label_value('a "b"\\\n') == 'a \\"b\\"\\\\\\n'
+
+
+def broken(state: int) -> Page:
+    raise ValueError("oops")
+
+
+def make_server(**kwargs):
+    kwargs.setdefault('metrics', True)
+    return make_counter_server("TEST_METRICS", broken, **kwargs)
+
+
+def test_metrics_endpoint():
+    visitor = TestApp(make_server().app)
+    visitor.get("/")
+    visitor.get("/add")
+    visitor.get("/add")
+    visitor.get("/broken", expect_errors=True)
+    response = visitor.get("/--metrics")
+    assert response.content_type == "text/plain"
+    text = response.text
+    assert 'drafter_requests_total{route="add"} 2' in text
+    assert 'drafter_requests_total{route="broken"} 1' in text
+    assert 'drafter_errors_total{phase="Error creating page"} 1' in text
+    assert 'drafter_request_duration_seconds_count{route="add"} 2' in text
+    assert 'drafter_response_size_bytes_count{route="add"} 2' in text
+    assert 'drafter_history_entries 4' in text
+    assert 'drafter_sessions 1' in text
+
+
+def test_metrics_for_streamed_pages():
+    server = make_server(stream_pages=True)
+    visitor = TestApp(server.app)
+    page = visitor.get("/")
+    histogram = server.metrics.response_size.values()[("index",)]
+    assert histogram[-1] == len(page.body)
+
+
+def test_metrics_are_off_unless_turned_on():
+    visitor = TestApp(make_counter_server("TEST_METRICS").app)
+    visitor.get("/--metrics", status=404)
+    visitor = TestApp(make_server(metrics=False).app)
+    visitor.get("/--metrics", status=404)
@@ -0,0 +1,29 @@
+import json
+
+from benchmarks.micro import BENCHMARKS, run_benchmarks, compare, main
+
+
+def test_every_benchmark_runs():
+    results = run_benchmarks(sizes=[2], min_time=0.0001, repeat=1, report=lambda line: None)
+    assert set(results['results']) == {f"{bench.name}[2]" for bench in BENCHMARKS}
+    assert all(result['best'] > 0 for result in results['results'].values())
+    json.dumps(results)
+
+
+def test_compare_finds_regressions():
+    baseline = {'results': {'a[10]': {'best': 1.0}, 'b[10]': {'best': 1.0}}}
+    current = {'results': {'a[10]': {'best': 1.2}, 'b[10]': {'best': 2.0}, 'c[10]': {'best': 5.0}}}
+    regressions = compare(baseline, current, threshold=0.25)
+    assert [regression['benchmark'] for regression in regressions] == ['b[10]']
+    assert regressions[0]['ratio'] == 2.0
+
+
+def test_main_writes_and_compares(tmp_path):
+    output = tmp_path / "results.json"
+    arguments = ["--filter", "table.str", "--sizes", "5", "--min-time", "0.0001", "--repeat", "1"]
+    assert main(arguments + ["--output", str(output)]) == 0
+    saved = json.loads(output.read_text())
+    assert list(saved['results']) == ["table.str[5]"]
+    saved['results']["table.str[5]"]['best'] /= 100
+    output.write_text(json.dumps(saved))
+    assert main(arguments + ["--compare", str(output)]) == 1
@@ -0,0 +1,65 @@
+"""
+Tests for the precompiled page shell used by ``Server.wrap_page``.
+"""
+import html
+
+from webtest import TestApp
+
+from drafter import *
+from drafter.files import TEMPLATE_200, TEMPLATE_200_WITHOUT_HEADER, TEMPLATE_FOOTER
+from drafter.raw_files import get_raw_files
+from drafter.server import PageShell
+
+
+def naive_wrap_page(server, content, js):
+    configuration = server.configuration
+    global_files, style_files = get_raw_files("global"), get_raw_files(configuration.style)
+    scripts = "\n".join([*global_files.scripts.values(), *style_files.scripts.values()])
+    styles = "\n".join([*global_files.styles.values(), *style_files.styles.values()])
+    if configuration.additional_css_content:
+        styles += "\n<style>" + "\n".join(configuration.additional_css_content) + "</style>"
+    header = "\n".join(configuration.additional_header_content)
+    credit = style_files.metadata.get('credit', '')
+    footer = TEMPLATE_FOOTER.format(credit=credit) if credit else ""
+    return TEMPLATE_200.format(header=header, styles=styles, scripts=scripts,
+                               content=f"<div class='btlw'>{content}</div>",
+                               title=html.escape(configuration.title), footer=footer, extra_js=js)
+
+
+def test_page_shell_splits_template():
+    shell = PageShell.from_template(TEMPLATE_200_WITHOUT_HEADER, header="<meta>", styles="", scripts="",
+                                    title='"Title"')
+    assert shell.render("BODY", "JS") == TEMPLATE_200_WITHOUT_HEADER.format(
+        header="<meta>", styles="", scripts="", title='"Title"', content="BODY", extra_js="JS")
+
+
+def test_wrap_page_matches_template():
+    server = Server(_custom_name="TEST_SHELL", title="Shell <Test>")
+    server.configuration.additional_header_content.append("<meta name='x'>")
+    server.configuration.additional_css_content.append("body {color: red}\n")
+    server.configuration_changed()
+    assert server.wrap_page("<p>Hi</p>", "<script>1</script>") == naive_wrap_page(server, "<p>Hi</p>", "<script>1</script>")
+    assert get_raw_files("global") is get_raw_files("global")
+
+
+def test_page_shell_is_reused_until_configuration_changes():
+    server = Server(_custom_name="TEST_SHELL")
+
+    @route(server=server)
+    def index(state: int) -> Page:
+        return Page(state, ["Hello"])
+
+    server.setup(0)
+    visitor = TestApp(server.app)
+    visitor.get("/")
+    shell = server.get_page_shell()
+    visitor.get("/")
+    assert server.get_page_shell() is shell
+
+    server.configuration.style = "none"
+    server.configuration.additional_css_content.append("p {color: blue}\n")
+    server.configuration_changed()
+    page = visitor.get("/").text
+    assert server.get_page_shell() is not shell
+    assert "p {color: blue}" in page
+    assert "Skeleton" not in page
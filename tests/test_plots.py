@@ -0,0 +1,122 @@
+import multiprocessing
+import re
+
+import pytest
+from webtest import TestApp
+
+from drafter import *
+from drafter.server import Server
+from drafter.plots import PlotRenderer, figure_fingerprint, save_figure
+
+plt = pytest.importorskip("matplotlib.pyplot")
+
+SETTINGS = {"format": "png", "bbox_inches": "tight"}
+
+
+def make_figure(values, title="Sales"):
+    figure = plt.figure()
+    plt.plot([1, 2, 3], values, color="red", label="this year")
+    plt.bar(["a", "b"], [3, 4])
+    plt.title(title)
+    plt.legend()
+    return figure
+
+
+def test_fingerprints_follow_what_is_drawn():
+    figures = [make_figure([1, 2, 3]), make_figure([1, 2, 3]), make_figure([1, 2, 4]), make_figure([1, 2, 3], "Costs")]
+    first, same, other_data, other_title = [figure_fingerprint(figure, SETTINGS) for figure in figures]
+    assert first is not None and first == same
+    assert len({first, other_data, other_title}) == 3
+    assert figure_fingerprint(figures[0], {**SETTINGS, "dpi": 50}) != first
+    plt.xticks(rotation=45)
+    assert figure_fingerprint(figures[-1], SETTINGS) != other_title
+    polar = plt.figure()
+    polar.add_subplot(projection="polar").plot([0, 1], [1, 2])
+    # Polar axes are not understood, so they are never served from the cache
+    assert figure_fingerprint(polar, SETTINGS) is None
+    plt.close("all")
+
+
+def test_fingerprints_follow_categories():
+    fingerprints = []
+    for categories in (["apples", "pears"], ["cars", "bikes"], ["apples", "pears"]):
+        figure = plt.figure()
+        plt.bar(categories, [1, 2])
+        fingerprints.append(figure_fingerprint(figure, SETTINGS))
+    for categories in (["x", "y"], ["p", "q"]):
+        figure = plt.figure()
+        plt.plot(categories, [1, 2])
+        fingerprints.append(figure_fingerprint(figure, SETTINGS))
+    plt.close("all")
+    assert None not in fingerprints
+    assert fingerprints[0] == fingerprints[2]
+    assert len({fingerprints[0], fingerprints[1], fingerprints[3], fingerprints[4]}) == 4
+
+
+def test_renderer_reuses_output():
+    renderer = PlotRenderer(max_entries=2)
+    first = renderer.render(make_figure([1, 2, 3]), SETTINGS)
+    assert renderer.render(make_figure([1, 2, 3]), SETTINGS) == first
+    assert (renderer.hits, renderer.misses) == (1, 1)
+    renderer.render(make_figure([3, 2, 1]), SETTINGS)
+    renderer.render(make_figure([2, 2, 2]), SETTINGS)
+    assert len(renderer) == 2
+    plt.close("all")
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason="Processes cannot be forked")
+def test_workers_render_the_same_image():
+    renderer = PlotRenderer(workers=1)
+    try:
+        figure = make_figure([1, 2, 3])
+        assert renderer.rasterize(figure, SETTINGS) == save_figure(figure, SETTINGS)
+    finally:
+        renderer.shutdown()
+        plt.close("all")
+
+
+def test_plots_are_served_by_url():
+    server = Server(_custom_name="TEST_PLOTS")
+
+    @route(server=server)
+    def index(state: int) -> Page:
+        plt.plot([1, 2, 3], [state, 2, 1])
+        return Page(state, [MatPlotLibPlot(), Button("Add", "add")])
+
+    @route(server=server)
+    def add(state: int) -> Page:
+        return index(state + 1)
+
+    server.setup(0)
+    visitor = TestApp(server.app)
+    page = visitor.get("/")
+    assert "data:image" not in page.text
+    url = re.search(r"src='(/--blobs/[0-9a-f]+\.png)'", page.text).group(1)
+    assert visitor.get(url).content_type == "image/png"
+    hits = server.plots.hits
+    assert url in visitor.get("/").text
+    assert server.plots.hits == hits + 1
+    assert url not in visitor.get("/add").text
+
+
+class FakePool:
+    stopped = False
+
+    def shutdown(self, wait=True):
+        self.stopped = True
+
+
+def test_only_forking_stops_the_pool(monkeypatch):
+    server = Server(_custom_name="TEST_PLOTS")
+
+    @route(server=server)
+    def index(state: int) -> Page:
+        return Page(state, [f"Count {state}"])
+
+    server.setup(0)
+    pool = FakePool()
+    monkeypatch.setattr(server.plots, "_pool", pool)
+    assert "Count 0" in TestApp(server.app).get("/--reset")
+    assert not pool.stopped
+    server.before_fork()
+    assert pool.stopped and server.plots._pool is None
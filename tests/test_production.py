@@ -0,0 +1,60 @@
+from webtest import TestApp
+
+from drafter import *
+from tests.helpers import Counter, make_counter_server
+
+
+def change_type(state: Counter) -> Page:
+    return Page(state.count, ["The state is now a number"])
+
+
+def broken(state: Counter) -> Page:
+    raise ValueError("oops")
+
+
+def make_server(**kwargs):
+    return make_counter_server("TEST_PRODUCTION", change_type, broken, initial_state=Counter(0), **kwargs)
+
+
+def test_production_keeps_no_history(capsys):
+    server = make_server(production=True)
+    visitor = TestApp(server.app)
+    visitor.get("/add")
+    page = visitor.get("/add").text
+    assert "Count is 2" in page
+    assert "Debug Information" not in page
+    session = next(iter(server.sessions._sessions.values()))
+    assert len(session.page_history) == 0
+    assert len(session.state_history) == 0
+    assert capsys.readouterr().out == ""
+    visitor.get("/--debug", status=404)
+    visitor.get("/--metrics", status=404)
+
+
+def test_production_skips_state_type_checks():
+    visitor = TestApp(make_server(production=True).app)
+    visitor.get("/")
+    assert "The state is now a number" in visitor.get("/change_type").text
+    development = TestApp(make_server().app)
+    development.get("/")
+    assert "changed from its previous type" in development.get("/change_type", status=500).text
+
+
+def test_production_still_shows_error_pages():
+    visitor = TestApp(make_server(production=True).app)
+    response = visitor.get("/broken", status=500)
+    assert "Error creating page" in response.text
+    assert "oops" in response.text
+
+
+def test_deploy_site_turns_on_production():
+    from drafter.server import MAIN_SERVER
+    from drafter.deploy import deploy_site, show_debug_information
+    original = MAIN_SERVER.configuration.production
+    try:
+        deploy_site()
+        assert MAIN_SERVER.configuration.production
+        assert not MAIN_SERVER.configuration.debug
+    finally:
+        MAIN_SERVER.configuration.production = original
+        show_debug_information()
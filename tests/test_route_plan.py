@@ -0,0 +1,61 @@
+"""
+Tests for the precompiled route call plans.
+"""
+import inspect
+from unittest import mock
+
+from webtest import TestApp
+
+from drafter import *
+from drafter.history import ConversionRecord, UnchangedRecord
+
+
+def test_plan_describes_parameters():
+    server = Server(_custom_name="TEST_PLANS")
+
+    def buy(state: dict, apples: int, *, note="") -> Page:
+        return Page(state, [])
+
+    plan = server.compile_route_plan(buy)
+    assert plan.names == ["state", "apples", "note"]
+    assert plan.positions == {"state": 0, "apples": 1, "note": 2}
+    assert plan.state_first
+    assert plan.has_state()
+    assert plan.state_type is dict
+    assert not plan.parameters["apples"].show_name
+    assert plan.parameters["note"].show_name
+
+
+def test_plan_converters_record_conversions():
+    server = Server(_custom_name="TEST_PLANS")
+
+    def buy(state, apples: int, pears) -> Page:
+        return Page(state, [])
+
+    plan = server.compile_route_plan(buy)
+    record = []
+    assert plan.convert("apples", "5", record) == 5
+    assert plan.convert("apples", 6, record) == 6
+    assert plan.convert("pears", "many", record) == "many"
+    assert plan.convert("plums", "extra", record) == "extra"
+    assert record == [ConversionRecord("apples", "5", int, 5),
+                      UnchangedRecord("apples", 6),
+                      UnchangedRecord("pears", "many", inspect.Parameter.empty),
+                      UnchangedRecord("plums", "extra")]
+
+
+def test_requests_do_not_inspect_signatures():
+    server = Server(_custom_name="TEST_PLANS", debug=False)
+
+    @route(server=server)
+    def index(state: int) -> Page:
+        return Page(state, [TextBox("amount", 1), Button("Add", "add")])
+
+    @route(server=server)
+    def add(state: int, amount: int) -> Page:
+        return Page(state + amount, [f"Total is {state + amount}"])
+
+    server.setup(0)
+    visitor = TestApp(server.app)
+    with mock.patch("inspect.signature", side_effect=AssertionError("signature inspected per request")):
+        assert "Total is 4" in visitor.get("/add", {"amount": "4"}).text
@@ -0,0 +1,155 @@
+"""
+Tests for serving requests with threads and worker processes.
+"""
+import os
+import socket
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+import urllib.request
+from http.cookiejar import CookieJar
+from wsgiref.simple_server import make_server
+
+import pytest
+
+from drafter import *
+from drafter.serving import make_server_class, choose_server_adapter, QuietRequestHandler, ThreadedServer, \
+    PreforkServer, ThreadPoolWSGIServer
+
+
+class SilentHandler(QuietRequestHandler):
+    quiet = True
+
+
+def serve_in_background(app, threads):
+    httpd = make_server('127.0.0.1', 0, app, make_server_class(threads), SilentHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    return httpd, f"http://127.0.0.1:{httpd.server_port}"
+
+
+def test_choose_server_adapter():
+    assert choose_server_adapter(1, 1) is None
+    assert choose_server_adapter(1, 4) is ThreadedServer
+    assert choose_server_adapter(3, 1) is PreforkServer
+    assert issubclass(make_server_class(4), ThreadPoolWSGIServer)
+    assert make_server_class(4).threads == 4
+
+
+def test_slow_route_does_not_block_others():
+    server = Server(_custom_name="TEST_THREADS", debug=False)
+    released = threading.Event()
+
+    @route(server=server)
+    def index(state: int) -> Page:
+        return Page(state, ["Fast"])
+
+    @route(server=server)
+    def slow(state: int) -> Page:
+        released.wait(5)
+        return Page(state, ["Slow"])
+
+    server.setup(0)
+    httpd, url = serve_in_background(server.app, threads=4)
+    try:
+        results = []
+        waiting = threading.Thread(target=lambda: results.append(urllib.request.urlopen(url + "/slow").read()))
+        waiting.start()
+        time.sleep(0.1)
+        # With a single thread, this would wait for the slow route (and time out)
+        assert b"Fast" in urllib.request.urlopen(url + "/", timeout=3).read()
+        released.set()
+        waiting.join(5)
+        assert b"Slow" in results[0]
+    finally:
+        released.set()
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_same_visitor_requests_take_turns():
+    server = Server(_custom_name="TEST_THREADS", debug=False)
+    inside = []
+    overlapped = []
+
+    @route(server=server)
+    def index(state: int) -> Page:
+        return Page(state, [str(state)])
+
+    @route(server=server)
+    def add(state: int) -> Page:
+        inside.append(1)
+        if len(inside) > 1:
+            overlapped.append(True)
+        time.sleep(0.05)
+        inside.pop()
+        return index(state + 1)
+
+    server.setup(0)
+    httpd, url = serve_in_background(server.app, threads=4)
+    try:
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+        opener.open(url + "/").read()
+        visits = [threading.Thread(target=lambda: opener.open(url + "/add").read()) for _ in range(4)]
+        for visit in visits:
+            visit.start()
+        for visit in visits:
+            visit.join(5)
+        assert not overlapped
+        session = next(iter(server.sessions._sessions.values()))
+        assert session.state == 4
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="Forking is not available on this platform")
+def test_workers_share_the_listening_socket(tmp_path):
+    port = free_port()
+    script = tmp_path / "site.py"
+    script.write_text(textwrap.dedent(f"""
+        import os
+        from drafter import *
+
+        @route
+        def index(state: int) -> Page:
+            return Page(state, ["Worker " + str(os.getpid())])
+
+        hide_debug_information()
+        start_server(0, port={port}, workers=2, threads=2, quiet=True)
+    """))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environment = dict(os.environ, PYTHONPATH=root + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    process = subprocess.Popen([sys.executable, str(script)], cwd=str(tmp_path), env=environment,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        body = None
+        for _ in range(100):
+            try:
+                body = urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=2).read()
+                break
+            except OSError:
+                time.sleep(0.05)
+        assert body is not None and b"Worker " in body
+        assert str(process.pid).encode() not in body
+        worker_pid = int(body.split(b"Worker ")[1].split(b"<")[0])
+    finally:
+        process.terminate()
+        process.wait(5)
+    # The workers are stopped along with the main process
+    for _ in range(100):
+        try:
+            os.kill(worker_pid, 0)
+        except ProcessLookupError:
+            break
+        time.sleep(0.05)
+    else:
+        pytest.fail("The worker process was not stopped")
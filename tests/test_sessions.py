@@ -0,0 +1,100 @@
+"""
+Tests for per-visitor sessions and the session stores.
+"""
+import time
+
+import pytest
+from webtest import TestApp
+
+from drafter import *
+from drafter.constants import SESSION_COOKIE_KEY
+from drafter.sessions import Session, MemorySessionStore, SQLiteSessionStore
+from tests.helpers import Counter, make_counter_server
+
+
+def make_server(**kwargs):
+    return make_counter_server("TEST_SESSIONS", initial_state=Counter(0), **kwargs)
+
+
+def test_visitors_have_separate_state():
+    server = make_server()
+    ada, bob = TestApp(server.app), TestApp(server.app)
+
+    assert "Count is 0" in ada.get("/").text
+    assert "Count is 1" in ada.get("/add").text
+    assert "Count is 2" in ada.get("/add").text
+    assert "Count is 0" in bob.get("/").text
+    assert "Count is 1" in bob.get("/add").text
+    assert "Count is 3" in ada.get("/add").text
+    assert len(server.sessions) == 2
+
+
+def test_reset_only_affects_one_visitor():
+    server = make_server()
+    ada, bob = TestApp(server.app), TestApp(server.app)
+    ada.get("/add")
+    bob.get("/add")
+    bob.get("/add")
+
+    assert "Count is 0" in ada.get("/--reset").text
+    assert "Count is 3" in bob.get("/add").text
+
+
+def test_unknown_session_cookie_starts_fresh():
+    server = make_server()
+    visitor = TestApp(server.app)
+    visitor.set_cookie(SESSION_COOKIE_KEY, "not-a-real-session")
+    assert "Count is 1" in visitor.get("/add").text
+    assert visitor.cookies[SESSION_COOKIE_KEY] != "not-a-real-session"
+
+
+def test_sqlite_sessions_survive_between_requests(tmp_path):
+    server = make_server(session_store="sqlite", session_path=str(tmp_path / "sessions.db"))
+    # The routes are local functions, so they cannot be pickled; only keep the count instead
+    server.sessions.serializer = lambda session: f"{session.session_id} {session.state.count}".encode()
+    server.sessions.deserializer = lambda data: Session(data.split()[0].decode(), Counter(int(data.split()[1])))
+    visitor = TestApp(server.app)
+    visitor.get("/add")
+    assert "Count is 2" in visitor.get("/add").text
+    assert len(server.sessions) == 1
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemorySessionStore(max_sessions=2, idle_timeout=0)
+    for name in "abc":
+        store.save(Session(name))
+    assert store.load("a") is None
+    assert store.load("b") is not None
+    store.save(Session("d"))
+    assert store.load("c") is None
+    assert store.load("b") is not None
+    assert len(store) == 2
+
+
+def test_memory_store_expires_idle_sessions():
+    store = MemorySessionStore(idle_timeout=60)
+    stale = Session("stale", last_accessed=time.time() - 120)
+    store.save(stale)
+    store.save(Session("fresh"))
+    assert store.load("stale") is None
+    assert store.load("fresh") is not None
+
+
+@pytest.mark.parametrize("idle_timeout", [0, 60])
+def test_sqlite_store_round_trip(idle_timeout):
+    store = SQLiteSessionStore(":memory:", idle_timeout=idle_timeout)
+    session = Session("abc", {"name": "Ada"})
+    session.page_history.append(("visit", "{}"))
+    store.save(session)
+    loaded = store.load("abc")
+    assert loaded.state == {"name": "Ada"}
+    assert loaded.page_history == [("visit", "{}")]
+    store.delete("abc")
+    assert store.load("abc") is None
+    assert len(store) == 0
+
+
+def test_sqlite_store_expires_idle_sessions():
+    store = SQLiteSessionStore(":memory:", idle_timeout=60)
+    store.save(Session("stale", last_accessed=time.time() - 120))
+    assert store.load("stale") is None
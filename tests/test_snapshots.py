@@ -0,0 +1,106 @@
+import pickle
+from collections import namedtuple
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+import pytest
+from webtest import TestApp
+
+from drafter import *
+from drafter.server import Server
+from drafter.snapshots import take_snapshot, restore_snapshot, snapshot_type, FrozenDataclass, \
+    CircularSnapshotError
+
+Pair = namedtuple("Pair", ["left", "right"])
+
+
+@dataclass
+class Row:
+    label: str
+    amount: int
+
+
+@dataclass
+class Ledger:
+    owner: str
+    rows: List[Row] = field(default_factory=list)
+    totals: Dict[str, int] = field(default_factory=dict)
+
+
+def make_ledger(size: int) -> Ledger:
+    return Ledger("Ada", [Row(f"Row {i}", i) for i in range(size)], {"all": size})
+
+
+def test_snapshots_restore_equal_values():
+    ledger = make_ledger(100)
+    snapshot = take_snapshot(ledger)
+    assert restore_snapshot(snapshot) == ledger
+    assert restore_snapshot(snapshot) is not ledger
+    assert snapshot_type(snapshot) is Ledger
+    assert restore_snapshot(take_snapshot({"a": (1, {2}), "b": frozenset([3])})) == {"a": (1, {2}), "b": frozenset([3])}
+    assert restore_snapshot(take_snapshot(Pair(1, [2]))) == Pair(1, [2])
+    assert pickle.loads(pickle.dumps(snapshot)).kind is Ledger
+
+
+def test_snapshots_are_immutable_and_independent():
+    ledger = make_ledger(3)
+    snapshot = take_snapshot(ledger)
+    with pytest.raises(AttributeError):
+        snapshot.values = ()
+    ledger.rows[0].amount = 99
+    ledger.owner = "Bea"
+    restored = restore_snapshot(snapshot)
+    assert restored.rows[0].amount == 0
+    assert restored.owner == "Ada"
+    restored.rows.append(Row("new", 1))
+    assert len(restore_snapshot(snapshot).rows) == 3
+
+
+def test_unchanged_parts_are_shared():
+    ledger = make_ledger(1000)
+    first = take_snapshot(ledger)
+    assert take_snapshot(ledger, first) is first
+    ledger.rows[500].amount += 1
+    second = take_snapshot(ledger, first)
+    assert isinstance(second, FrozenDataclass) and second is not first
+    first_rows, second_rows = first.values[1], second.values[1]
+    changed = [index for index, (old, new) in enumerate(zip(first_rows.segments, second_rows.segments))
+               if old is not new]
+    assert len(changed) == 1
+    assert second.values[2] is first.values[2]
+    assert restore_snapshot(first).rows[500].amount == 500
+    assert restore_snapshot(second).rows[500].amount == 501
+
+
+def test_circular_states_are_reported():
+    cycle = []
+    cycle.append(cycle)
+    with pytest.raises(CircularSnapshotError):
+        take_snapshot(cycle)
+
+
+def test_server_keeps_real_history_of_mutated_state():
+    server = Server(_custom_name="TEST_SNAPSHOTS")
+
+    @route(server=server)
+    def index(state: Ledger) -> Page:
+        return Page(state, [f"Rows: {len(state.rows)}", Button("Add", "add")])
+
+    @route(server=server)
+    def add(state: Ledger) -> Page:
+        state.rows.append(Row(f"Row {len(state.rows)}", len(state.rows)))
+        return index(state)
+
+    server.setup(make_ledger(2))
+    visitor = TestApp(server.app)
+    visitor.get("/")
+    visitor.get("/add")
+    visitor.get("/add")
+    session = next(iter(server.sessions._sessions.values()))
+    assert [len(restore_snapshot(snapshot).rows) for snapshot in session.state_history] == [2, 3, 4]
+    # Only the list of rows changed, so the owner and totals are shared between the snapshots
+    first, last = session.state_history[0], session.state_history[-1]
+    assert last.values[2] is first.values[2]
+    history = visitor.get("/--debug/history").text
+    assert history.count("Resulting State:") == 3
+    assert "Row 3" in history
@@ -0,0 +1,57 @@
+import pickle
+from dataclasses import dataclass, field
+from typing import List
+
+from webtest import TestApp
+
+from drafter import *
+from drafter.server import Server
+from drafter.history import StateDumpCache
+
+
+@dataclass
+class Basket:
+    owner: str
+    items: List[str] = field(default_factory=list)
+
+
+def test_cache_reuses_dump_until_cleared():
+    cache = StateDumpCache()
+    basket = Basket("Ada", ["apple"])
+    first = cache.dump(basket)
+    assert cache.dump(basket) is first
+    assert (cache.hits, cache.misses) == (1, 1)
+    # Checking the cache only compares identities, so changes in place need the cache to be cleared
+    basket.items.append("pear")
+    assert cache.dump(basket) is first
+    cache.clear()
+    assert "pear" in cache.dump(basket)
+    assert cache.dump(Basket("Ada", ["apple", "pear"])) == cache.dumped
+    assert cache.misses == 3
+    assert pickle.loads(pickle.dumps(cache)).dumped is None
+
+
+def test_server_reuses_dumps_between_requests():
+    server = Server(_custom_name="TEST_STATE_CACHE")
+
+    @route(server=server)
+    def index(state: Basket) -> Page:
+        return Page(state, [f"{state.owner} has {len(state.items)} items", Button("Add", "add")])
+
+    @route(server=server)
+    def add(state: Basket) -> Page:
+        state.items.append("apple")
+        return index(state)
+
+    server.setup(Basket("Ada"))
+    visitor = TestApp(server.app)
+    visitor.get("/")
+    visitor.get("/")
+    visitor.get("/add")
+    assert "2 items" in visitor.get("/add").text
+    # Routes change the state in place, and the saved state follows
+    session = next(iter(server.sessions._sessions.values()))
+    assert session.dump_cache.dumped == '{"owner": "Ada", "items": ["apple", "apple"]}'
+    dumps = server.metrics.state_dumps.values()
+    assert dumps[("hit",)] >= 2
+    assert dumps[("miss",)] >= 2
@@ -0,0 +1,200 @@
+import json
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple, Union
+
+import pytest
+from webtest import TestApp
+
+from drafter import *
+from drafter.server import Server
+from drafter.state_codecs import get_codec
+
+
+class Color(Enum):
+    RED = "red"
+    GREEN = "green"
+
+
+class Size(Enum):
+    SMALL = 1
+    LARGE = 2
+
+
+@dataclass
+class Point:
+    x: int
+    y: float
+
+
+@dataclass
+class Node:
+    name: str
+    children: List['Node'] = field(default_factory=list)
+
+
+@dataclass
+class Everything:
+    position: Tuple[int, int]
+    path: Tuple[Point, ...]
+    tags: Set[str]
+    frozen: FrozenSet[int]
+    nickname: Optional[str]
+    answer: Union[int, str]
+    color: Color
+    sizes: Dict[Size, List[Color]]
+    by_id: Dict[int, str]
+    by_position: Dict[Tuple[int, int], Point]
+    nested: Dict[str, List[Tuple[str, int]]]
+    tree: Node
+    anything: list = field(default_factory=list)
+    count: int = 0
+
+
+def round_trip(value, target):
+    codec = get_codec(target)
+    return codec.decode(json.loads(json.dumps(codec.encode(value))))
+
+
+def test_codec_is_cached_per_type():
+    assert get_codec(Everything) is get_codec(Everything)
+    assert get_codec(List[int]) is get_codec(List[int])
+
+
+def test_round_trip_everything():
+    state = Everything(position=(3, 4), path=(Point(1, 2.5), Point(3, 4.0)), tags={"a", "b"},
+                       frozen=frozenset({1, 2}), nickname=None, answer="forty-two", color=Color.GREEN,
+                       sizes={Size.SMALL: [Color.RED], Size.LARGE: []}, by_id={1: "one", 20: "twenty"},
+                       by_position={(0, 1): Point(0, 1.0)}, nested={"pairs": [("a", 1), ("b", 2)]},
+                       tree=Node("root", [Node("left"), Node("right", [Node("leaf")])]),
+                       anything=[1, "two", [3]])
+    restored = round_trip(state, Everything)
+    assert restored == state
+    assert isinstance(restored.path, tuple) and isinstance(restored.path[0], Point)
+    assert isinstance(restored.frozen, frozenset)
+    assert restored.count == 0
+
+
+def test_union_members_are_told_apart():
+    assert round_trip(42, Union[int, str]) == 42
+    assert round_trip("42", Union[int, str]) == "42"
+    assert round_trip(Point(1, 2.0), Union[Point, Node]) == Point(1, 2.0)
+    assert round_trip(Node("n"), Union[Point, Node]) == Node("n")
+    assert round_trip(None, Optional[Point]) is None
+    assert round_trip(3, float) == 3.0
+
+
+def test_missing_fields_use_defaults():
+    assert get_codec(Node).decode({"name": "alone"}) == Node("alone")
+
+
+def test_unannotated_values_fall_back_to_generic_walker():
+    codec = get_codec(None)
+    assert codec.encode({"a": (1, 2)}) == {"a": [1, 2]}
+    assert codec.decode([1, 2]) == [1, 2]
+    # A value that does not match its annotation is still saved
+    assert get_codec(Point).encode(Node("n")) == {"name": "n", "children": []}
+
+
+def test_server_restores_state_with_codecs():
+    server = Server(_custom_name="TEST_SERVER")
+
+    @route(server=server)
+    def index(state: Everything) -> Page:
+        return Page(state, [f"Position {state.position!r}", f"Tags {sorted(state.tags)!r}",
+                            f"Color {state.color.name}", f"Ids {state.by_id!r}", Button("Move", "move")])
+
+    @route(server=server)
+    def move(state: Everything) -> Page:
+        state.position = (state.position[0] + 1, state.position[1])
+        state.by_id[len(state.by_id)] = "new"
+        return index(state)
+
+    server.setup(Everything(position=(0, 0), path=(), tags={"x"}, frozen=frozenset(), nickname="n",
+                            answer=1, color=Color.RED, sizes={}, by_id={}, by_position={}, nested={},
+                            tree=Node("root")))
+    app = TestApp(server.app)
+    response = app.get("/")
+    assert "Position (0, 0)" in response
+    assert "Color RED" in response
+    response = app.get("/move")
+    assert "Position (1, 0)" in response
+    assert "Ids {0: 'new'}" in response
+    response = app.get("/move")
+    assert "Position (2, 0)" in response
+
+
+@dataclass
+class Cell:
+    value: int
+    rest: Optional['Cell'] = None
+
+
+def make_cells(length: int) -> Cell:
+    head = None
+    for value in range(length):
+        head = Cell(value, head)
+    return head
+
+
+def test_circular_references_are_reported():
+    cells = make_cells(3)
+    cells.rest.rest.rest = cells
+    with pytest.raises(ValueError, match="Circular reference detected"):
+        get_codec(Cell).encode(cells)
+    node = Node("loop")
+    node.children.append(node)
+    with pytest.raises(ValueError, match="Circular reference detected"):
+        get_codec(Node).encode(node)
+    shared = Point(1, 2.0)
+    assert get_codec(List[Point]).encode([shared, shared]) == [{"x": 1, "y": 2.0}] * 2
+
+
+def test_deep_states_can_be_dumped():
+    server = Server(_custom_name="TEST_SERVER")
+
+    @route(server=server)
+    def index(state: Cell) -> Page:
+        return Page(state, [f"Top {state.value}"])
+
+    server.setup(make_cells(3))
+    server._state = make_cells(5000)
+    dumped = server.dump_state()
+    assert dumped.startswith('{"value": 4999, "rest": {"value": 4998, "rest": ')
+    assert dumped.count('"value"') == 5000
+
+
+@dataclass
+class Mislabeled:
+    names: List[str]
+    data: dict
+    items: list
+    pair: Tuple[int, int]
+    by_id: Dict[int, str]
+
+
+def test_values_that_do_not_match_their_annotation_fall_back():
+    state = Mislabeled(names="abc", data=[1, 2], items={"a": 1}, pair=[1, 2], by_id="x")
+    assert get_codec(Mislabeled).encode(state) == {"names": "abc", "data": [1, 2], "items": {"a": 1},
+                                                   "pair": [1, 2], "by_id": "x"}
+
+
+def test_states_that_cannot_be_saved_show_an_error_page():
+    server = Server(_custom_name="TEST_SERVER")
+
+    @route(server=server)
+    def index(state: Point) -> Page:
+        return Page(state, [f"Point {state.x}", Button("Break", "broken")])
+
+    @route(server=server)
+    def broken(state: Point) -> Page:
+        state.x = object()
+        return index(state)
+
+    server.setup(Point(1, 2.0))
+    visitor = TestApp(server.app)
+    assert "Point 1" in visitor.get("/")
+    page = visitor.get("/broken", status=500)
+    assert "Error" in page
+    page = visitor.get("/", status=500)
+    assert "Error saving state" in page
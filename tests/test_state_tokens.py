@@ -0,0 +1,63 @@
+import json
+from urllib.parse import quote
+
+import pytest
+from webtest import TestApp
+
+from drafter import *
+from drafter.server import Server
+from drafter.state_tokens import encode_state_token, decode_state_token, is_state_token, StateTokenError, \
+    TOKEN_PREFIX
+
+SECRET = "correct horse battery staple"
+STATE = json.dumps({"owner": "Ada", "items": [{"name": f"Item {i}", "quantity": i} for i in range(200)]})
+
+
+def test_tokens_round_trip_and_are_compact():
+    token = encode_state_token(STATE, SECRET)
+    assert is_state_token(token)
+    assert quote(token, safe="") == token
+    assert decode_state_token(token, SECRET) == STATE
+    assert len(token) * 4 < len(quote(STATE))
+    chunks = json.JSONEncoder().iterencode(json.loads(STATE))
+    assert decode_state_token(encode_state_token(chunks, SECRET), SECRET) == STATE
+    assert not is_state_token(STATE)
+
+
+def test_tampered_or_foreign_tokens_are_rejected():
+    token = encode_state_token(STATE, SECRET)
+    with pytest.raises(StateTokenError, match="signature"):
+        decode_state_token(token, "another secret")
+    tampered = token[:-5] + ("A" if token[-5] != "A" else "B") + token[-4:]
+    with pytest.raises(StateTokenError):
+        decode_state_token(tampered, SECRET)
+    with pytest.raises(StateTokenError, match="version"):
+        decode_state_token(TOKEN_PREFIX + "AgAAAAAAAAAAAAAAAAAAAAAA", SECRET)
+    with pytest.raises(StateTokenError, match="more than"):
+        decode_state_token(encode_state_token(" " * 100000, SECRET), SECRET, max_size=1000)
+
+
+def test_server_restores_state_from_token(capsys):
+    server = Server(_custom_name="TEST_STATE_TOKENS", state_secret=SECRET)
+
+    @route(server=server)
+    def index(state: int) -> Page:
+        return Page(state, [f"Count is {state}", Button("Add", "add")])
+
+    @route(server=server)
+    def add(state: int) -> Page:
+        return index(state + 1)
+
+    server.setup(0)
+    visitor = TestApp(server.app)
+    token = encode_state_token("41", SECRET)
+    assert "Count is 42" in visitor.get("/add", {"--restorable-state": token})
+    forged = encode_state_token("1000", "not the secret")
+    assert "Count is 43" in visitor.get("/add", {"--restorable-state": forged})
+    assert "Could not restore the state" in capsys.readouterr().out
+    section = visitor.get("/--debug/state").text
+    assert "Link to this page with this state" in section
+    link = section.split("<a href='")[1].split("'")[0].replace("&amp;", "&")
+    assert "/add?--restorable-state=~" in link
+    # A new visitor, without the session, gets the same state back from the link
+    assert "Count is 44" in TestApp(server.app).get(link[link.index("/add?"):])
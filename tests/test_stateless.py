@@ -0,0 +1,70 @@
+import re
+
+from webtest import TestApp
+
+from drafter import *
+from drafter.server import Server
+from tests.helpers import make_counter_server
+
+SECRET = "shared between workers"
+
+
+def index(state: int) -> Page:
+    return Page(state, [f"Count is {state}", Button("Add", "add"), Link("Add by link", "add"),
+                        Link("Elsewhere", "https://example.com")])
+
+
+def make_worker(**kwargs):
+    return make_counter_server("TEST_STATELESS", index, stateless=True, state_secret=SECRET, **kwargs)
+
+
+def hidden_token(page) -> str:
+    return re.search(r"name='--restorable-state' value='([^']*)'", page.text).group(1)
+
+
+def test_any_worker_can_serve_the_next_request():
+    first, second = TestApp(make_worker().app), TestApp(make_worker().app)
+    page = first.get("/add")
+    assert "Count is 1" in page
+    token = hidden_token(page)
+    assert token.startswith("~")
+    # The form goes to a different worker, which has never seen this visitor
+    page = second.post("/add", {"--restorable-state": token})
+    assert "Count is 2" in page
+    link = re.search(r"<a href='(/add\?[^']*)'", page.text).group(1).replace("&amp;", "&")
+    assert "--restorable-state=~" in link
+    assert "Count is 3" in first.get(link)
+    # External links do not carry the state
+    external = re.search(r"<a href='(https://example.com[^']*)'", page.text).group(1)
+    assert "--restorable-state" not in external
+
+
+def test_unsigned_states_and_large_tokens_are_reported(capsys):
+    worker = TestApp(make_worker(stateless_token_budget=10).app)
+    assert "Count is 1" in worker.get("/add", {"--restorable-state": "41"})
+    output = capsys.readouterr().out
+    assert "only signed state tokens are accepted" in output
+    assert "over the budget of 10 characters" in output
+
+
+def test_nested_links_carry_the_state():
+    server = Server(_custom_name="TEST_STATELESS", stateless=True, state_secret=SECRET)
+
+    @route(server=server)
+    def index(state: int) -> Page:
+        return Page(state, [f"Count is {state}", Div(Link("In a div", "add")),
+                            BulletedList([Link("In a list", "add")]),
+                            Table([["Cell", Link("In a table", "add")]])])
+
+    @route(server=server)
+    def add(state: int) -> Page:
+        return index(state + 1)
+
+    server.setup(0)
+    worker, other = TestApp(server.app), TestApp(make_worker().app)
+    page = worker.get("/add")
+    links = re.findall(r"<a href='(/add\?[^']*)'[^>]*>In a (div|list|table)</a>", page.text)
+    assert [kind for link, kind in links] == ["div", "list", "table"]
+    for link, kind in links:
+        assert "--restorable-state=~" in link
+        assert "Count is 2" in other.get(link.replace("&amp;", "&"))
@@ -0,0 +1,98 @@
+"""
+Tests for streaming pages in chunks as they are rendered.
+"""
+import gzip
+import io
+
+from webtest import TestApp
+
+from drafter import *
+from drafter.server import coalesce_chunks
+from tests.helpers import make_counter_server
+
+
+def index(state: int) -> Page:
+    return Page(state, [
+        Header("Numbers"),
+        Table([[str(i), str(i * i)] for i in range(state)], header=["n", "n squared"]),
+        Div("Total:", Span(str(state)), BulletedList(["a", "b"])),
+    ], js="console.log('done')")
+
+
+def broken(state: int) -> Page:
+    return Page(state, ["Before the error", BrokenContent(), "After the error"])
+
+
+def make_server(**kwargs):
+    return make_counter_server("TEST_STREAMING", index, broken, initial_state=1000, **kwargs)
+
+
+class BrokenContent(PageContent):
+    def __str__(self):
+        raise ValueError("This content cannot be rendered")
+
+
+def raw_get(server, path, accept_encoding=None):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+               'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO()}
+    if accept_encoding is not None:
+        environ['HTTP_ACCEPT_ENCODING'] = accept_encoding
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started.update(headers)
+
+    return started, list(server.app(environ, start_response))
+
+
+def test_coalesce_chunks():
+    assert list(coalesce_chunks(["a", "bb", "ccc", "d"], 3)) == ["abb", "ccc", "d"]
+    assert list(coalesce_chunks([], 3)) == []
+
+
+def test_components_render_in_fragments():
+    table = Table([["1", "2"], ["3", "4"]], header=["a", "b"])
+    fragments = list(table.render_iter(None, None))
+    assert len(fragments) == 4
+    assert "".join(fragments) == str(table)
+    group = Div("Hello", Span("there"), style_color="red")
+    assert "".join(group.render_iter(None, None)) == str(group)
+    listing = NumberedList(["a", "b"])
+    assert "".join(listing.render_iter(None, None)) == str(listing)
+
+
+def test_streamed_page_matches_rendered_page():
+    regular = TestApp(make_server(debug=False).app).get("/").text
+    streamed_server = make_server(debug=False, stream_pages=True, stream_chunk_size=512)
+    headers, chunks = raw_get(streamed_server, "/")
+    assert 'Content-Length' not in headers
+    assert len(chunks) > 3
+    assert b"".join(chunks).decode('utf-8') == regular
+    assert chunks[0].decode('utf-8').startswith("\n<html>")
+    assert "<table" not in chunks[0].decode('utf-8')
+
+
+def test_streamed_page_records_history_and_debug():
+    server = make_server(stream_pages=True)
+    page = TestApp(server.app).get("/").text
+    assert "Page Load History" in page
+    session = next(iter(server.sessions._sessions.values()))
+    assert session.page_history[-1][0].status == "Finished Page Load"
+
+
+def test_streamed_page_shows_errors_inline():
+    server = make_server(debug=False, stream_pages=True)
+    page = TestApp(server.app).get("/broken").text
+    assert "Before the error" in page
+    assert "This content cannot be rendered" in page
+    assert "After the error" not in page
+    assert page.rstrip().endswith("</html>")
+
+
+def test_streamed_page_is_compressed():
+    server = make_server(debug=False, stream_pages=True, stream_chunk_size=512)
+    _, plain = raw_get(server, "/")
+    headers, compressed = raw_get(server, "/", "gzip")
+    assert headers['Content-Encoding'] == 'gzip'
+    assert len(compressed) > 3
+    assert gzip.decompress(b"".join(compressed)) == b"".join(plain)
@@ -0,0 +1,61 @@
+from webtest import TestApp
+
+from drafter import *
+from drafter.timing import PhaseTimer, format_server_timing
+from tests.helpers import make_counter_server
+
+
+def test_phase_timer_accumulates():
+    timer = PhaseTimer()
+    timer.start("a")
+    timer.start("b")
+    timer.start("a")
+    timer.stop()
+    timer.stop()
+    assert list(timer.timings) == ["a", "b"]
+    assert all(duration >= 0 for duration in timer.timings.values())
+    assert timer.total == sum(timer.timings.values())
+
+
+def test_format_server_timing():
+    header = format_server_timing({"prepare_args": 0.5, "route": 2.25})
+    assert header == "prepare_args;dur=0.500, route;dur=2.250, total;dur=2.750"
+
+
+def broken(state: int) -> Page:
+    return "oops"
+
+
+def make_server(**kwargs):
+    return make_counter_server("TEST_TIMING", broken, **kwargs)
+
+
+def test_server_timing_header_and_history():
+    server = make_server()
+    visitor = TestApp(server.app)
+    response = visitor.get("/add")
+    phases = [metric.split(";")[0] for metric in response.headers['Server-Timing'].split(", ")]
+    assert phases == ["restore_state_if_available", "dump_state", "prepare_args", "route",
+                      "verify_page_result", "verify_content", "render_content", "make_debug_page",
+                      "wrap_page", "total"]
+    session = next(iter(server.sessions._sessions.values()))
+    visit = session.page_history[-1][0]
+    assert list(visit.timings)[:4] == ["restore_state_if_available", "dump_state", "prepare_args", "route"]
+    assert "wrap_page" in visit.timings
+    history = visitor.get("/--debug/history").text
+    assert "Timing: <code>restore_state_if_available</code>" in history
+
+
+def test_server_timing_on_error_page():
+    visitor = TestApp(make_server().app)
+    response = visitor.get("/broken", expect_errors=True)
+    assert "route;dur=" in response.headers['Server-Timing']
+    assert "render_content" not in response.headers['Server-Timing']
+
+
+def test_streamed_page_records_render_timing():
+    server = make_server(stream_pages=True)
+    response = TestApp(server.app).get("/")
+    assert "render_content" not in response.headers['Server-Timing']
+    session = next(iter(server.sessions._sessions.values()))
+    assert "render_content" in session.page_history[-1][0].timings
@@ -0,0 +1,95 @@
+import hashlib
+import io
+import os
+import pathlib
+from typing import BinaryIO, Iterator
+
+import pytest
+from webtest import TestApp
+
+from drafter import *
+from drafter.server import Server
+from drafter.uploads import read_multipart, UploadLimits, UploadTooLarge, MalformedUpload
+import drafter.uploads
+
+BOUNDARY = "----drafter-test"
+DATA = bytes(range(256)) * 1200
+
+
+def make_body(data: bytes) -> bytes:
+    return (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"note\"\r\n\r\nhello\r\n"
+            f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"data\"; filename=\"data.bin\"\r\n"
+            f"Content-Type: application/octet-stream\r\n\r\n").encode() + data + \
+        (f"\r\n--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"empty\"; filename=\"\"\r\n\r\n\r\n"
+         f"--{BOUNDARY}--\r\n").encode()
+
+
+@pytest.mark.parametrize("chunk_size", [3, 1000, 64 * 1024])
+def test_files_are_streamed_into_spools(monkeypatch, chunk_size):
+    monkeypatch.setattr(drafter.uploads, "UPLOAD_CHUNK_SIZE", chunk_size)
+    fields, uploads = read_multipart(io.BytesIO(make_body(DATA)).read, BOUNDARY, UploadLimits(spool_size=1000))
+    assert fields == [("note", "hello"), ("empty", "")]
+    [upload] = uploads
+    assert (upload.name, upload.filename, upload.size) == ("data", "data.bin", len(DATA))
+    assert upload.digest == hashlib.sha256(DATA).hexdigest()
+    assert b"".join(upload.chunks(5000)) == DATA
+    path = upload.path
+    assert pathlib.Path(path).read_bytes() == DATA
+    upload.close()
+    assert not os.path.exists(path)
+
+
+def test_limits_stop_uploads():
+    body = make_body(DATA)
+    with pytest.raises(UploadTooLarge, match="data.bin"):
+        read_multipart(io.BytesIO(body).read, BOUNDARY, UploadLimits(max_file_size=1000))
+    with pytest.raises(UploadTooLarge, match="request"):
+        read_multipart(io.BytesIO(body).read, BOUNDARY, UploadLimits(max_request_size=1000))
+    with pytest.raises(MalformedUpload):
+        read_multipart(io.BytesIO(body[:-10]).read, BOUNDARY, UploadLimits())
+    small, = read_multipart(io.BytesIO(make_body(b"tiny")).read, BOUNDARY, UploadLimits())[1]
+    with pytest.raises(OSError):
+        os.stat(small._path or "")
+
+
+def test_routes_receive_streamed_uploads():
+    server = Server(_custom_name="TEST_UPLOADS", upload_spool_size=1000, upload_max_file_size=len(DATA))
+    paths = []
+
+    @route(server=server)
+    def index(state: str) -> Page:
+        return Page(state, [state, FileUpload("data"), Button("Send", "receive")])
+
+    @route(server=server)
+    def receive(state: str, data: Upload) -> Page:
+        return index(f"{data.filename} has {data.size} bytes with hash {data.digest}")
+
+    @route(server=server)
+    def receive_path(state: str, data: pathlib.Path) -> Page:
+        paths.append(data)
+        return index(f"Path holds {len(data.read_bytes())} bytes")
+
+    @route(server=server)
+    def receive_chunks(state: str, data: Iterator[bytes]) -> Page:
+        return index(f"Chunks hold {sum(len(chunk) for chunk in data)} bytes")
+
+    @route(server=server)
+    def receive_handle(state: str, data: BinaryIO) -> Page:
+        return index(f"Handle starts with {data.read(3)!r}")
+
+    @route(server=server)
+    def receive_bytes(state: str, data: bytes) -> Page:
+        return index(f"Bytes hold {len(data)} bytes")
+
+    server.setup("")
+    visitor = TestApp(server.app)
+    upload = [("data", "data.bin", DATA)]
+    page = visitor.post("/receive", upload_files=upload)
+    assert f"data.bin has {len(DATA)} bytes with hash {hashlib.sha256(DATA).hexdigest()}" in page
+    assert f"Path holds {len(DATA)} bytes" in visitor.post("/receive_path", upload_files=upload)
+    assert not paths[0].exists()
+    assert f"Chunks hold {len(DATA)} bytes" in visitor.post("/receive_chunks", upload_files=upload)
+    assert "Handle starts with b'\\x00\\x01\\x02'" in visitor.post("/receive_handle", upload_files=upload)
+    assert f"Bytes hold {len(DATA)} bytes" in visitor.post("/receive_bytes", upload_files=upload)
+    too_big = visitor.post("/receive", upload_files=[("data", "big.bin", DATA + b"!")], status=413)
+    assert "big.bin" in too_big
@@ -81,12 +81,13 @@ def get_raw_files(theme):
         return CACHED_DECOMPRESSED[theme]
     if theme not in RAW_FILES:
         return None
-    return RawFiles(
+    CACHED_DECOMPRESSED[theme] = RawFiles(
         RAW_FILES[theme].metadata,
         {k: f"<script>{v}</script>" for k, v in RAW_FILES[theme].scripts.items()},
         {k: f"<style>{v}</style>" for k, v in RAW_FILES[theme].styles.items()},
         {k: f"<script>{v}</script>" for k, v in RAW_FILES[theme].deploy.items()},
     )
+    return CACHED_DECOMPRESSED[theme]
 
 def get_themes():
     return list(RAW_FILES.keys())